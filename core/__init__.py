@@ -4,8 +4,45 @@
 # The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
 # or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
 
-from .smxfile import SmxFile, SmxScript
-from .hotplug import HotPlug
+import importlib
+
+# {<name>: <module>}, the modules are imported on first access of its members, so the startup is fast
+_LAZY = {
+    'SmxFile': 'smxfile',
+    'SmxScript': 'smxfile',
+    'BootPlan': 'smxfile',
+    'BootCmd': 'smxfile',
+    'BundleFile': 'bundle',
+    'export_bundle': 'bundle',
+    'is_bundle': 'bundle',
+    'HotPlug': 'hotplug',
+    'BootEngine': 'engine',
+    'BootHooks': 'engine',
+    'BootCancelled': 'engine',
+    'Transport': 'engine',
+    'ChunkTuner': 'transfer',
+    'ChunkedTransfer': 'transfer',
+    'device_type': 'transfer',
+    'Checkpoint': 'checkpoint',
+    'port_path': 'checkpoint',
+    'RetryPolicy': 'retry',
+    'RetryRule': 'retry',
+    'RETRY_COMMANDS': 'retry',
+    'RETRY_REG_COMMANDS': 'retry',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module('.' + _LAZY[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_LAZY.keys()))
+
 
 __author__  = "Martin Olejar"
 __contact__ = "martin.olejar@gmail.com"
@@ -16,7 +53,28 @@ __all__ = [
     # Classes
     'SmxFile',
     'SmxScript',
-    'HotPlug'
+    'BootPlan',
+    'BootCmd',
+    'BundleFile',
+    'HotPlug',
+    'BootEngine',
+    'BootHooks',
+    'Transport',
+    'ChunkTuner',
+    'ChunkedTransfer',
+    'Checkpoint',
+    'RetryPolicy',
+    'RetryRule',
+    # Errors
+    'BootCancelled',
+    # Functions
+    'export_bundle',
+    'is_bundle',
+    'device_type',
+    'port_path',
+    # Constants
+    'RETRY_COMMANDS',
+    'RETRY_REG_COMMANDS'
 ]
 
 # Application license
@@ -0,0 +1,242 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import mmap
+import json
+from struct import pack, unpack_from, calcsize
+
+# internals
+from .segments.base import data_parts, data_digest
+from .smxfile import BootCmd, BootPlan, FoldedDCD, file_key
+
+
+########################################################################################################################
+# Bundle file format (little endian)
+#
+#   HEADER:  magic (8s) | version (H) | reserved (H) | meta size (I) | records count (I) | data offset (I)
+#   META:    JSON with name, description, chip and scripts table (name, description, first record, records count,
+#            command descriptions and folded register writes of DCD records)
+#   RECORDS: op (B) | bytes (B) | reserved (H) | address (I) | value (I) | offset (Q) | length (Q)
+#   DATA:    deduplicated segment payloads, every aligned to BUNDLE_ALIGN
+########################################################################################################################
+
+BUNDLE_MAGIC = b'IMXSBNDL'
+BUNDLE_VERSION = 1
+BUNDLE_ALIGN = 4096
+
+HEADER_FORMAT = '<8sHHIII'
+HEADER_SIZE = calcsize(HEADER_FORMAT)
+RECORD_FORMAT = '<BBHIIQQ'
+RECORD_SIZE = calcsize(RECORD_FORMAT)
+
+BUNDLE_OPS = ('wreg', 'wdcd', 'wimg', 'sdcd', 'jrun')
+
+
+class BundleError(Exception):
+    """Thrown when bundle file is not valid"""
+    pass
+
+
+def is_bundle(file):
+    """ Check if file is boot bundle
+    :param file: The path to file
+    :return: True or False
+    """
+    # virtual path of archive member or directory
+    if not os.path.isfile(file):
+        return False
+    with open(file, 'rb') as f:
+        return f.read(len(BUNDLE_MAGIC)) == BUNDLE_MAGIC
+
+
+def export_bundle(smx, file):
+    """ Export all resolved scripts of loaded SMX file into boot bundle
+    :param smx: The loaded SmxFile object
+    :param file: The path to output bundle file
+    :return: The size of bundle in bytes
+    """
+    plans = [smx.get_plan(index, lazy=False) for index in range(len(smx.scripts))]
+
+    # deduplicate payloads
+    payloads = []
+    offsets = {}
+    data_size = 0
+    meta = {'name': smx.name, 'desc': smx.description, 'chip': smx.platform, 'scripts': []}
+    records = []
+    for plan in plans:
+        script = {'name': plan.name, 'desc': plan.description, 'first': len(records), 'count': len(plan),
+                  'descs': [cmd.description for cmd in plan], 'wregs': {}}
+        meta['scripts'].append(script)
+        for i, cmd in enumerate(plan):
+            offset, length = 0, 0
+            if cmd.data is not None:
+                key = data_digest(cmd.data)
+                if key not in offsets:
+                    offsets[key] = data_size
+                    payloads.append(cmd.data)
+                    data_size += len(cmd.data) + (-len(cmd.data) % BUNDLE_ALIGN)
+                offset, length = offsets[key], len(cmd.data)
+            if isinstance(cmd.data, FoldedDCD):
+                # the register writes are sent one by one if the target rejects the DCD
+                script['wregs'][str(i)] = [[wreg.address, wreg.value, wreg.bytes, wreg.description]
+                                           for wreg in cmd.data.wregs]
+            records.append(pack(RECORD_FORMAT, BUNDLE_OPS.index(cmd.name), cmd.bytes or 0, 0, cmd.address or 0,
+                                cmd.value or 0, offset, length))
+    records = b''.join(records)
+
+    meta_data = json.dumps(meta).encode()
+    data_offset = HEADER_SIZE + len(meta_data) + len(records)
+    data_offset += -data_offset % BUNDLE_ALIGN
+
+    with open(file, 'wb') as f:
+        f.write(pack(HEADER_FORMAT, BUNDLE_MAGIC, BUNDLE_VERSION, 0, len(meta_data), len(records) // RECORD_SIZE,
+                     data_offset))
+        f.write(meta_data)
+        f.write(records)
+        f.write(bytes(data_offset - f.tell()))
+        for data in payloads:
+            for part in data_parts(data):
+                f.write(part)
+            f.write(bytes(-len(data) % BUNDLE_ALIGN))
+
+    return data_offset + data_size
+
+
+class BundleScript(object):
+    """ Script info inside boot bundle """
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+
+    def __str__(self):
+        return "{} ({})".format(self.name, self.description)
+
+
+class BundleFile(object):
+    """ Prebuilt boot bundle
+
+        The bundle file is mapped into memory and the payloads of boot plans are read-only memoryview slices of it,
+        therefore they are shared without copying between any number of concurrent boots.
+    """
+
+    @property
+    def name(self):
+        return self._meta['name']
+
+    @property
+    def platform(self):
+        return self._meta['chip']
+
+    @property
+    def description(self):
+        return self._meta['desc']
+
+    @property
+    def scripts(self):
+        return self._scripts
+
+    @property
+    def path(self):
+        return self._path
+
+    def __init__(self, file):
+        self._file = os.path.abspath(file)
+        self._path = os.path.dirname(self._file)
+        with open(file, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._open(file)
+        except BundleError:
+            self._mm.close()
+            raise
+
+    def _open(self, file):
+        size = len(self._mm)
+        if size < HEADER_SIZE:
+            raise BundleError("Not a boot bundle: {}".format(file))
+        magic, version, _, meta_size, records_count, data_offset = unpack_from(HEADER_FORMAT, self._mm)
+        if magic != BUNDLE_MAGIC:
+            raise BundleError("Not a boot bundle: {}".format(file))
+        if version != BUNDLE_VERSION:
+            raise BundleError("Not supported bundle version: {}".format(version))
+
+        # the truncated or damaged bundle is rejected before any data are written into target
+        records_offset = HEADER_SIZE + meta_size
+        if records_offset + records_count * RECORD_SIZE > data_offset or data_offset > size:
+            raise BundleError("Truncated or damaged bundle header: {}".format(file))
+        try:
+            self._meta = json.loads(self._mm[HEADER_SIZE:records_offset].decode())
+            scripts = [(item['name'], item['desc'], item['first'], item['count'], item['descs'])
+                       for item in self._meta['scripts']]
+        except (ValueError, KeyError, TypeError):
+            raise BundleError("Damaged bundle meta data: {}".format(file))
+        for name, _, first, count, descs in scripts:
+            if first < 0 or first + count > records_count or len(descs) != count:
+                raise BundleError("Script \"{}\" records out of bundle: {}".format(name, file))
+        for index in range(records_count):
+            op, _, _, _, _, offset, length = unpack_from(RECORD_FORMAT, self._mm, records_offset + index * RECORD_SIZE)
+            if op >= len(BUNDLE_OPS) or data_offset + offset + length > size:
+                raise BundleError("Record {} out of bundle data (truncated file ?): {}".format(index, file))
+
+        self._view = memoryview(self._mm)
+        self._records_offset = records_offset
+        self._records_count = records_count
+        self._data_offset = data_offset
+        self._scripts = [BundleScript(item[0], item[1]) for item in scripts]
+        self._plans = None
+
+    def info(self):
+        pass
+
+    def load(self):
+        pass
+
+    def memory_info(self):
+        return " Bundle: {} Bytes mapped\n".format(len(self._mm))
+
+    def warm_up(self, background=False):
+        """ Decode and memoize plans of all scripts
+        :param background: Ignored, the decoding doesn't touch the payloads
+        """
+        self._plans = [self.get_plan(index) for index in range(len(self._scripts))]
+
+    def get_plan(self, index, lazy=None):
+        """ Get boot plan from bundle
+        :param index: The script index
+        :param lazy: Ignored, the payloads are mapped from bundle file
+        :return: BootPlan object
+        """
+        if self._plans is not None:
+            return self._plans[index]
+        script = self._meta['scripts'][index]
+        cmds = []
+        for i in range(script['count']):
+            op, nbytes, _, address, value, offset, length = unpack_from(
+                RECORD_FORMAT, self._mm, self._records_offset + (script['first'] + i) * RECORD_SIZE)
+            name = BUNDLE_OPS[op]
+            data = None
+            if name in ('wdcd', 'wimg'):
+                offset += self._data_offset
+                data = self._view[offset:offset + length]
+            wregs = script.get('wregs', {}).get(str(i))
+            if name == 'wdcd' and wregs:
+                data = FoldedDCD(data, [BootCmd('wreg', address, value, nbytes, None, desc)
+                                        for address, value, nbytes, desc in wregs])
+            if name == 'wreg':
+                cmds.append(BootCmd(name, address, value, nbytes, None, script['descs'][i]))
+            elif name == 'sdcd':
+                cmds.append(BootCmd(name, None, None, None, None, script['descs'][i]))
+            else:
+                cmds.append(BootCmd(name, address, None, None, data, script['descs'][i]))
+
+        # the payloads are identified by the bundle file, they aren't hashed for checkpoints
+        return BootPlan(script['name'], script['desc'], self.platform, cmds,
+                        key="{}#{}".format(file_key(self._file), index))
+
+    def get_script(self, index):
+        return self.get_plan(index)
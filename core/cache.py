@@ -0,0 +1,26 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+
+# Base directory of all cached data (digests, artifacts, signatures, checkpoints, transfer tuning)
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'imxsb')
+
+
+def atomic_write(path, data):
+    """ Write file content, so that readers see either the old or the complete new content
+    :param path: The file path, missing directories are created
+    :param data: The content as string or bytes
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_file = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(tmp_file, 'w' if isinstance(data, str) else 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, path)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
@@ -0,0 +1,169 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import json
+import time
+import hashlib
+from .cache import CACHE_DIR, atomic_write
+from .segments.base import data_digest, is_stream
+from .smxfile import file_key
+
+# Directory with checkpoint files of interrupted boots, one file per device
+CHECKPOINT_DIR = os.path.join(CACHE_DIR, 'checkpoints')
+
+# Size of written data read back from target and the searched range before padding
+PROBE_SIZE = 16
+PROBE_SEARCH = 4096
+
+# Min interval in seconds between stores of the offset inside running command
+CHECKPOINT_INTERVAL = 0.5
+
+
+def port_path(transport):
+    """ Get USB port path of boot target, which doesn't change when the device re-enumerates
+    :param transport: The target object
+    :return: string or None if not known
+    """
+    usbd = getattr(transport, 'usbd', None)
+    # pyusb device (linux, mac)
+    dev = getattr(usbd, 'dev', None)
+    ports = getattr(dev, 'port_numbers', None)
+    if ports:
+        return "{}-{}".format(dev.bus, '.'.join(str(port) for port in ports))
+    # pywinusb device (windows)
+    path = getattr(getattr(usbd, 'device', None), 'device_path', None)
+    return path if path else None
+
+
+def _data_key(data):
+    """ Get identity of command data without loading it
+    :param data: The command data
+    :return: string or None
+    """
+    if data is None:
+        return None
+    if is_stream(data):
+        return file_key(data.path)
+    if hasattr(data, 'prepare'):
+        # the deferred data of lazy plan are never loaded here
+        return 'deferred:{}'.format(len(data))
+    return data_digest(data)
+
+
+def plan_id(plan):
+    """ Get identifier of boot plan content
+    :param plan: The BootPlan object
+    :return: hex string
+
+    The plan is identified by the metadata of its source files (see BootPlan.key), so that neither deferred data are
+    prepared nor the payloads are hashed. Only the in-memory data of plan without known sources are hashed.
+    """
+    key = getattr(plan, 'key', None)
+    sha = hashlib.sha256(repr((plan.name, key)).encode())
+    for cmd in plan:
+        digest = None if key is not None else _data_key(cmd.data)
+        sha.update(repr((cmd.name, cmd.address, cmd.value, cmd.bytes, digest)).encode())
+    return sha.hexdigest()
+
+
+def written_probe(plan, count, offset=0):
+    """ Get the last data written into target memory, which show if the target hasn't been reset
+    :param plan: The BootPlan object
+    :param count: The count of executed commands
+    :param offset: The count of written bytes of the first not executed command
+    :return: (address, expected bytes) or None if no distinguishable data have been written
+    """
+    index, end = count, offset
+    if not (index < len(plan) and plan[index].name == 'wimg' and end):
+        # the last finished image write
+        index = next((i for i in reversed(range(min(count, len(plan)))) if plan[i].name == 'wimg'), None)
+        if index is None:
+            return None
+        end = None
+    cmd = plan[index]
+    data = cmd.data.prepare() if hasattr(cmd.data, 'prepare') else cmd.data
+    end = len(data) if end is None else end
+    start = max(0, end - PROBE_SEARCH)
+    tail = bytes(data[start:end])
+    # skip padding at the end, it can't be distinguished from erased memory
+    size = len(tail.rstrip(tail[-1:]))
+    pos = start + max(0, size - PROBE_SIZE)
+    pos -= pos % 4
+    window = bytes(data[pos:min(pos + PROBE_SIZE, end)])
+    if len(set(window)) < 2:
+        return None
+    return cmd.address + pos, window
+
+
+class Checkpoint(object):
+    """ Progress of boot plan on single device
+
+        The count of finished commands and the offset of the last acknowledged chunk of running command are stored
+        in checkpoint file named by device port path. The checkpoint is valid only for the same plan. The offset is
+        stored at most once per interval, the finished commands are always stored.
+    """
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, hashlib.sha256(self.device.encode()).hexdigest() + '.json')
+
+    def __init__(self, device, directory=CHECKPOINT_DIR, interval=CHECKPOINT_INTERVAL):
+        """ Init Checkpoint
+        :param device: The device identifier (see port_path())
+        :param directory: The directory for checkpoint files
+        :param interval: The min interval in seconds between stores of the offset inside running command
+        """
+        assert isinstance(device, str)
+        self.device = device
+        self.directory = directory
+        self.interval = interval
+        # private
+        self._plan_id = None
+        self._saved = None
+
+    def _id(self, plan):
+        if self._plan_id is None or self._plan_id[0] is not plan:
+            self._plan_id = (plan, plan_id(plan))
+        return self._plan_id[1]
+
+    def load(self, plan):
+        """ Get progress of interrupted boot
+        :param plan: The BootPlan object
+        :return: (count of finished commands, offset in running command) or None
+        """
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+            if state['device'] != self.device or state['plan'] != self._id(plan):
+                return None
+            return int(state['done']), int(state['offset'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, plan, done, offset=0):
+        """ Store progress of running boot
+        :param plan: The BootPlan object
+        :param done: The count of finished commands
+        :param offset: The count of acknowledged bytes of running command
+        """
+        now = time.monotonic()
+        if offset and self._saved is not None and now - self._saved < self.interval:
+            return
+        self._saved = now
+        state = {'device': self.device, 'plan': self._id(plan), 'done': done, 'offset': offset}
+        try:
+            atomic_write(self.path, json.dumps(state))
+        except OSError:
+            pass
+
+    def clear(self):
+        """ Remove checkpoint after successful boot """
+        self._saved = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
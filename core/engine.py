@@ -0,0 +1,471 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import time
+import queue
+import threading
+import collections
+
+# internals
+from .transfer import ChunkedTransfer
+from .checkpoint import written_probe
+from .retry import RetryStats, error_matches
+from .segments.base import STREAM_CHUNK
+
+# Errors of DCD write after which the folded register writes are sent one by one: the ROM has rejected the DCD by error
+# status (the names are used for matching, so that the imx module is not imported) or the transport doesn't support it
+DCD_REJECT_ERRORS = ('SdpCommandError', NotImplementedError)
+
+
+class BootCancelled(Exception):
+    """Thrown when boot has been cancelled"""
+    pass
+
+
+class Transport(object):
+    """ Interface of boot target
+
+        The SDP devices from imx.sdp module (scan_usb) implement it directly. The progress handler passed into open()
+        is called with progress level of running command in range 0 - pg_range, if it returns False the transfer must
+        be aborted by exception.
+    """
+
+    pg_range = 100
+    pg_resolution = 5
+
+    def open(self, handler=None):
+        raise NotImplementedError()
+
+    def close(self):
+        raise NotImplementedError()
+
+    def read(self, address, length):
+        raise NotImplementedError()
+
+    def write(self, address, value, count=4):
+        raise NotImplementedError()
+
+    def write_dcd(self, address, data):
+        raise NotImplementedError()
+
+    def write_file(self, address, data):
+        raise NotImplementedError()
+
+    def skip_dcd(self):
+        raise NotImplementedError()
+
+    def jump_and_run(self, address):
+        raise NotImplementedError()
+
+
+class BootHooks(object):
+    """ Base class of boot engine hooks
+
+        The hooks are called from the thread which runs the engine. Any object implementing some of these methods can
+        be used as hook.
+    """
+
+    def on_start(self, plan):
+        """ Called before the target is opened
+        :param plan: The BootPlan object
+        """
+        pass
+
+    def on_command(self, index, cmd):
+        """ Called before command is executed
+        :param index: The command index
+        :param cmd: The BootCmd object
+        """
+        pass
+
+    def on_progress(self, value, level):
+        """ Called during execution of command
+        :param value: The total progress in range 0 - pg_range
+        :param level: The progress of running command in range 0 - pg_range
+        """
+        pass
+
+    def on_resume(self, index, offset, reset):
+        """ Called when interrupted boot is resumed from checkpoint
+        :param index: The index of the first not finished command
+        :param offset: The count of already written bytes of this command
+        :param reset: True if the target has been reset and all commands are executed again
+        """
+        pass
+
+    def on_retry(self, index, cmd, attempt, error, delay):
+        """ Called when failed command is going to be executed again
+        :param index: The command index
+        :param cmd: The BootCmd object
+        :param attempt: The number of failed attempt (from 1)
+        :param error: The exception of failed attempt
+        :param delay: The delay before retry in seconds
+        """
+        pass
+
+    def on_command_done(self, index, cmd, elapsed):
+        """ Called after command is executed
+        :param index: The command index
+        :param cmd: The BootCmd object
+        :param elapsed: The execution time in seconds
+        """
+        pass
+
+    def on_finish(self, error):
+        """ Called after the boot is finished
+        :param error: The exception or None if successful
+        """
+        pass
+
+
+class _Prefetcher(object):
+    """ Preparation of deferred data of boot commands in background thread
+
+        The data are prepared in order of commands into bounded queue, so that at most depth prepared data wait for
+        transfer while the next ones are prepared.
+    """
+
+    def __init__(self, plan, depth, cancel, skip=()):
+        self._plan = plan
+        self._skip = skip
+        self._cancel = cancel
+        self._stop = threading.Event()
+        self._queue = queue.Queue(depth)
+        self._thread = threading.Thread(target=self._run, name='imxsb-prefetch', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _stopped(self):
+        return self._stop.is_set() or self._cancel.is_set()
+
+    def _put(self, item):
+        while not self._stopped():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        for index, cmd in enumerate(self._plan):
+            if not is_deferred(cmd.data) or index in self._skip:
+                continue
+            if self._stopped():
+                return
+            try:
+                item = (index, cmd.data.prepare(), None)
+            except Exception as e:
+                item = (index, None, e)
+            if not self._put(item) or item[2] is not None:
+                return
+
+    def get(self, index):
+        """ Get prepared data of command, wait if they are not ready
+        :param index: The command index
+        :return: The data
+        """
+        while True:
+            try:
+                cmd_index, data, error = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._cancel.is_set():
+                    raise BootCancelled("Boot cancelled")
+                continue
+            if error is not None:
+                raise error
+            assert cmd_index == index
+            return data
+
+
+def is_deferred(data):
+    """ Check if command data are prepared on demand (see DeferredData) """
+    return data is not None and hasattr(data, 'prepare')
+
+
+def is_streamed(data):
+    """ Check if command data are read from file by chunks (see FileStream) """
+    return data is not None and hasattr(data, 'chunks')
+
+
+def _split(data, chunk_size, start=0):
+    offset = start
+    while offset < len(data):
+        size = min(chunk_size(), len(data) - offset)
+        yield offset, data[offset:offset + size]
+        offset += size
+
+
+class BootEngine(object):
+    """ Executor of boot plan on the target
+
+        Single engine object executes single plan once. The cancel() can be called from any thread and it takes effect
+        also in the middle of running data transfer. If the plan contains deferred data (lazy plan), they are prepared
+        in background while the previous commands are executed. The images streamed from file are always written
+        by chunks. With checkpoint, the progress is recorded after every command and chunk, and the next run of the
+        same plan on the same device continues from the failed command. With retry policy, the command failed by
+        transient error is executed again, the interrupted image write continues from the last written chunk.
+    """
+
+    @property
+    def plan(self):
+        return self._plan
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def retry_stats(self):
+        """ The RetryStats object of the last run """
+        return self._stats
+
+    def __init__(self, transport, plan, hooks=None, pg_range=1000, pg_resolution=None, prefetch=2, transfer=None,
+                 checkpoint=None, retry=None):
+        """ Init BootEngine
+        :param transport: The target object (see Transport)
+        :param plan: The BootPlan object
+        :param hooks: The list of hooks objects (see BootHooks)
+        :param pg_range: The range of progress values
+        :param pg_resolution: The count of transferred packets between progress updates (None is transport default)
+        :param prefetch: The max count of prepared deferred data waiting for transfer
+        :param transfer: The ChunkedTransfer object for splitting of images into write transactions
+        :param checkpoint: The Checkpoint object of target device for resuming of interrupted boot
+        :param retry: The RetryPolicy object (None is without retry)
+        """
+        self.transport = transport
+        self.hooks = [] if hooks is None else list(hooks)
+        self.pg_range = pg_range
+        self.pg_resolution = pg_resolution
+        self.prefetch = prefetch
+        self.transfer = transfer
+        self.checkpoint = checkpoint
+        self.retry = retry
+        # private
+        self._plan = plan
+        self._cancel = threading.Event()
+        self._pgval = 0
+        self._pgstp = 0
+        # running chunk: (offset, size, total)
+        self._chunk = None
+        # running command index and count of commands finished by interrupted boot
+        self._index = 0
+        self._resumed = 0
+        # acknowledged bytes of running image write
+        self._written = 0
+        self._stats = RetryStats()
+
+    def _emit(self, name, *args):
+        for hook in self.hooks:
+            method = getattr(hook, name, None)
+            if method is not None:
+                method(*args)
+
+    def _progress_handler(self, level):
+        if self._chunk is not None:
+            offset, size, total = self._chunk
+            level = int((offset + size * level / self.pg_range) * self.pg_range / total)
+        self._emit('on_progress', int(self._pgval + (self._pgstp / self.pg_range) * level), level)
+        return not self._cancel.is_set()
+
+    def cancel(self):
+        """ Stop the boot as soon as possible """
+        self._cancel.set()
+
+    def execute(self, cmd, offset=0):
+        """ Execute single command on the target
+        :param cmd: The BootCmd object
+        :param offset: The count of already written bytes of image (resumed wimg only)
+        """
+        if cmd.name == 'wreg':
+            self.transport.write(cmd.address, cmd.value, cmd.bytes)
+        elif cmd.name == 'wdcd':
+            try:
+                self.transport.write_dcd(cmd.address, cmd.data)
+            except Exception as e:
+                # the DCD folded from register writes can be rejected by the ROM (not allowed register address) or not
+                # supported by the transport, then the original writes are sent one by one. With any other error the
+                # ROM could already execute a part of the DCD, so the writes are not repeated.
+                wregs = getattr(cmd.data, 'wregs', None)
+                if wregs is None or self._cancel.is_set() or not error_matches(e, DCD_REJECT_ERRORS):
+                    raise
+                try:
+                    for wreg in wregs:
+                        self.transport.write(wreg.address, wreg.value, wreg.bytes)
+                except Exception as error:
+                    raise error from e
+        elif cmd.name == 'wimg':
+            if offset or is_streamed(cmd.data) or self.transfer is not None and self.transfer.split(len(cmd.data)):
+                self._write_chunked(cmd.address, cmd.data, offset)
+            else:
+                self.transport.write_file(cmd.address, cmd.data)
+        elif cmd.name == 'sdcd':
+            self.transport.skip_dcd()
+        elif cmd.name == 'jrun':
+            self.transport.jump_and_run(cmd.address)
+        else:
+            raise Exception("Command: {} not supported".format(cmd.name))
+
+    def _write_chunked(self, address, data, start=0):
+        transfer = self.transfer
+        if transfer is None:
+            transfer = ChunkedTransfer(chunk_size=STREAM_CHUNK)
+        total = len(data)
+        # the sizes of chunks in order of reading
+        sizes = collections.deque()
+
+        def next_size():
+            sizes.append(transfer.chunk_size)
+            return sizes[-1]
+
+        chunks = data.chunks(next_size, start) if is_streamed(data) else _split(data, next_size, start)
+        pg_resolution = self.transport.pg_resolution
+        try:
+            for offset, chunk in chunks:
+                chunk_size = sizes.popleft()
+                self._chunk = (offset, len(chunk), total)
+                self.transport.pg_resolution = transfer.pg_resolution(len(chunk))
+                start = time.perf_counter()
+                self.transport.write_file(address + offset, chunk)
+                transfer.record(chunk_size, len(chunk), time.perf_counter() - start)
+                self._written = offset + len(chunk)
+                if self.checkpoint is not None:
+                    self.checkpoint.save(self._plan, self._index, self._written)
+                if self._cancel.is_set():
+                    raise BootCancelled("Boot cancelled")
+        finally:
+            chunks.close()
+            self._chunk = None
+            self.transport.pg_resolution = pg_resolution
+
+    def _execute(self, index, cmd, offset=0):
+        rule = None if self.retry is None else self.retry.rule(cmd.name)
+        attempt = 1
+        while True:
+            start = time.perf_counter()
+            self._written = offset
+            try:
+                self.execute(cmd, offset)
+                return
+            except Exception as e:
+                if self._cancel.is_set() or rule is None or attempt >= rule.attempts or not rule.retryable(e):
+                    raise
+                delay = rule.delay(attempt)
+                self._emit('on_retry', index, cmd, attempt, e, delay)
+                if self._cancel.wait(delay):
+                    raise BootCancelled("Boot cancelled")
+                # stay on the opened target if possible
+                reopen = rule.reopen(e)
+                if reopen:
+                    self.transport.close()
+                    self.transport.open(self._progress_handler)
+                if cmd.name == 'wimg':
+                    offset = self._written
+                self._stats.record(cmd.name, time.perf_counter() - start, reopen)
+                attempt += 1
+
+    def _probe(self, address, expected):
+        try:
+            return bytes(self.transport.read(address, len(expected)))[:len(expected)] == expected
+        except Exception:
+            return False
+
+    def _resume(self):
+        """ Get the commands finished by interrupted boot and the offset in the first not finished one """
+        state = None if self.checkpoint is None else self.checkpoint.load(self._plan)
+        if state is None or state == (0, 0):
+            return set(), 0
+        done, offset = state
+        # the last written data are read back, if they don't match the target has been reset and the memory content
+        # is lost, so the boot starts again from the first command
+        probe = written_probe(self._plan, done, offset)
+        if probe is None or not self._probe(*probe):
+            self._emit('on_resume', 0, 0, True)
+            return set(), 0
+        self._resumed = done
+        self._emit('on_resume', done, offset, False)
+        return set(range(done)), offset
+
+    def run(self):
+        """ Execute the boot plan, raise BootCancelled if cancelled """
+        steps = self._plan.pg_steps(self.pg_range)
+        self.transport.pg_range = self.pg_range
+        if self.pg_resolution is not None:
+            self.transport.pg_resolution = self.pg_resolution
+        self._pgval = 0
+        self._pgstp = 0
+        self._resumed = 0
+        self._stats = RetryStats()
+
+        error = None
+        prefetcher = None
+        self._emit('on_start', self._plan)
+        try:
+            # connect target
+            self.transport.open(self._progress_handler)
+            skip, offset = self._resume()
+            if any(is_deferred(cmd.data) for index, cmd in enumerate(self._plan) if index not in skip):
+                # prepare data of next commands while the previous data are transferred
+                prefetcher = _Prefetcher(self._plan, max(1, self.prefetch), self._cancel, skip)
+            for index, cmd in enumerate(self._plan):
+                if self._cancel.is_set():
+                    raise BootCancelled("Boot cancelled")
+
+                self._pgval += self._pgstp
+                self._pgstp = steps[index]
+                if index in skip:
+                    continue
+
+                self._index = index
+                if is_deferred(cmd.data):
+                    cmd = cmd._replace(data=prefetcher.get(index))
+                self._emit('on_command', index, cmd)
+                start = time.perf_counter()
+                self._execute(index, cmd, offset if index == self._resumed else 0)
+                self._emit('on_command_done', index, cmd, time.perf_counter() - start)
+                if self.checkpoint is not None and index >= self._resumed:
+                    self.checkpoint.save(self._plan, index + 1)
+
+            self._emit('on_progress', self.pg_range, self.pg_range)
+            if self.checkpoint is not None:
+                self.checkpoint.clear()
+            if self.transfer is not None:
+                self.transfer.save()
+
+        except BootCancelled as e:
+            error = e
+            raise
+
+        except Exception as e:
+            # the transport aborts running transfer by its own exception
+            error = BootCancelled("Boot cancelled") if self._cancel.is_set() else e
+            if error is e:
+                raise
+            raise error from e
+
+        finally:
+            if prefetcher is not None:
+                # stop preparing of data which will not be transferred
+                prefetcher.stop()
+            try:
+                self.transport.close()
+            finally:
+                self._emit('on_finish', error)
+
+    async def run_async(self):
+        """ Execute the boot plan in worker thread, cancelling of the task cancels the boot """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, self.run)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self.cancel()
+            # the result of aborted run is not awaited anymore
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            raise
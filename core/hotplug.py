@@ -25,13 +25,13 @@ class HotPlugBase:
 
 if os.name == 'posix':
 
-    import pyudev
-    # import syslog
-
     class HotPlug(HotPlugBase):
 
         def __init__(self, callback=None):
             super().__init__()
+            # imported on first use
+            import pyudev
+            # import syslog
             context = pyudev.Context()
             # context.log_priority = syslog.LOG_DEBUG
             self.monitor = pyudev.Monitor.from_netlink(context)
@@ -47,6 +47,7 @@ if os.name == 'posix':
         def start(self):
             assert self.callback is not None, ""
             self.callback()
+            import pyudev
             self.observer = pyudev.MonitorObserver(self.monitor, callback=self.callback, name='monitor-observer')
             self.observer.start()
 
@@ -0,0 +1,91 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import threading
+
+# internals
+from .segments.base import resolve_path
+from .segments.archive import find_member
+
+# Size of chunk for reading of file content if posix_fadvise() is not supported
+READAHEAD_CHUNK = 1024 * 1024
+
+
+class Readahead(object):
+    """ Background readahead of files into OS page cache
+
+        The files are processed from the largest one in low priority thread. If supported, the kernel is asked to
+        read the content via posix_fadvise(WILLNEED), otherwise the content is read and dropped.
+    """
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def __init__(self, roots, paths):
+        """ Init Readahead
+        :param roots: The list of search roots
+        :param paths: The list of file paths
+        """
+        self._roots = list(roots)
+        self._paths = list(paths)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='imxsb-readahead', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        try:
+            # lower priority of this thread only (linux)
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+
+        files = {}
+        for path in self._paths:
+            if self._stop.is_set():
+                return
+            try:
+                file_path = resolve_path(self._roots, path)
+                if not file_path:
+                    continue
+                if not os.path.exists(file_path):
+                    # member of archive, read the whole archive file
+                    archive, _ = find_member(file_path)
+                    if archive is None:
+                        continue
+                    file_path = archive.path
+                files[file_path] = os.path.getsize(file_path)
+            except Exception:
+                # missing or unreachable files are reported later by load
+                continue
+
+        for file_path in sorted(files, key=files.get, reverse=True):
+            if self._stop.is_set():
+                return
+            try:
+                self._readahead(file_path)
+            except OSError:
+                continue
+
+    def _readahead(self, file_path):
+        with open(file_path, 'rb', buffering=0) as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                return
+            buffer = bytearray(READAHEAD_CHUNK)
+            while not self._stop.is_set() and f.readinto(buffer):
+                pass
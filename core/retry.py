@@ -0,0 +1,127 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+# Exceptions of transient USB errors, the names are used for matching, so that the imx module is not imported
+RETRY_ERRORS = ('SdpTimeoutError', 'SdpDataError', 'SdpConnectionError', 'TimeoutError', 'ConnectionError')
+
+# Exceptions after which the target must be opened again
+REOPEN_ERRORS = ('SdpConnectionError', 'SdpDataError', 'ConnectionError')
+
+# Commands retried by default, the repeated image write only writes the same content into the same memory
+RETRY_COMMANDS = ('wimg',)
+
+# Commands which can be retried on request, a lot of i.MX registers are triggered by the write access itself
+RETRY_REG_COMMANDS = ('wreg', 'wdcd', 'sdcd')
+
+
+def error_matches(error, kinds):
+    """ Check if exception is instance of some exception class
+    :param error: The exception object
+    :param kinds: The list of exception classes or its names
+    :return: bool
+    """
+    names = [cls.__name__ for cls in type(error).__mro__]
+    for kind in kinds:
+        if isinstance(kind, str) and kind in names or isinstance(kind, type) and isinstance(error, kind):
+            return True
+    return False
+
+
+class RetryRule(object):
+    """ Retry rule of single command type """
+
+    def __init__(self, attempts=3, backoff=0.1, factor=2.0, max_delay=2.0, retry_on=RETRY_ERRORS,
+                 reopen_on=REOPEN_ERRORS):
+        """ Init RetryRule
+        :param attempts: The max count of attempts (1 is without retry)
+        :param backoff: The delay in seconds before the first retry
+        :param factor: The multiplier of delay for every next retry
+        :param max_delay: The max delay in seconds
+        :param retry_on: The exception classes or its names which are retried
+        :param reopen_on: The exception classes or its names after which the target is opened again
+        """
+        assert attempts >= 1
+        self.attempts = attempts
+        self.backoff = backoff
+        self.factor = factor
+        self.max_delay = max_delay
+        self.retry_on = tuple(retry_on)
+        self.reopen_on = tuple(reopen_on)
+
+    def delay(self, attempt):
+        """ Get delay before retry
+        :param attempt: The number of failed attempt (from 1)
+        :return: seconds
+        """
+        return min(self.backoff * self.factor ** (attempt - 1), self.max_delay)
+
+    def retryable(self, error):
+        return error_matches(error, self.retry_on)
+
+    def reopen(self, error):
+        return error_matches(error, self.reopen_on)
+
+
+class RetryPolicy(object):
+    """ Retry rules for command types
+
+        By default, only the image writes are retried, because they can be executed again without side effects. The
+        register writes, DCD and skip DCD are retried only on request (see RETRY_REG_COMMANDS), the failed command could
+        be already executed by the target and a lot of registers are triggered by the write access itself. The jrun is
+        never retried, the code on target could be already running.
+    """
+
+    def __init__(self, rules=None, attempts=3, commands=RETRY_COMMANDS):
+        """ Init RetryPolicy
+        :param rules: The rules for command types: {<command name>: RetryRule}, which replace the default ones
+        :param attempts: The max count of attempts of default rules
+        :param commands: The names of commands with default rule, the others are not retried
+        """
+        assert 'jrun' not in commands
+        self.rules = {name: RetryRule(attempts) for name in commands}
+        self.rules['jrun'] = RetryRule(1)
+        if rules is not None:
+            self.rules.update(rules)
+
+    def rule(self, name):
+        """ Get retry rule of command type
+        :param name: The command name
+        :return: RetryRule object or None
+        """
+        return self.rules.get(name)
+
+
+class RetryStats(object):
+    """ Metrics of retries in single boot run """
+
+    @property
+    def retries(self):
+        return sum(self.by_command.values())
+
+    def __init__(self):
+        self.reopens = 0
+        self.lost_time = 0.0
+        # {<command name>: count of retries}
+        self.by_command = {}
+
+    def record(self, name, lost_time, reopen=False):
+        """ Add retry of command
+        :param name: The command name
+        :param lost_time: The time of failed attempt and backoff in seconds
+        :param reopen: True if the target has been opened again
+        """
+        self.by_command[name] = self.by_command.get(name, 0) + 1
+        self.lost_time += lost_time
+        if reopen:
+            self.reopens += 1
+
+    def info(self):
+        """ Get report of retries
+        :return: string
+        """
+        cmds = ', '.join("{}: {}".format(name, count) for name, count in sorted(self.by_command.items()))
+        return "Retries: {} ({}), reopened: {}x, lost time: {:.2f} s".format(self.retries, cmds or 'none',
+                                                                           self.reopens, self.lost_time)
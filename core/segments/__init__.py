@@ -4,11 +4,36 @@
 # The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
 # or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
 
-from .fdt import DatSegFDT, InitErrorFDT
-from .dcd import DatSegDCD, InitErrorDCD
-from .imx import DatSegIMX2, DatSegIMX2B, DatSegIMX3, InitErrorIMX
-from .raw import DatSegRAW, InitErrorRAW
-from .uboot import DatSegUBI, DatSegUBX, DatSegUBT, InitErrorUBI, InitErrorUBX, InitErrorUBT
+import importlib
+
+# {<name>: <module>}, the modules are imported on first access of its members
+_LAZY = {
+    'DatSegFDT': 'fdt', 'InitErrorFDT': 'fdt',
+    'DatSegDCD': 'dcd', 'InitErrorDCD': 'dcd',
+    'DatSegIMX2': 'imx', 'DatSegIMX2B': 'imx', 'DatSegIMX3': 'imx', 'InitErrorIMX': 'imx',
+    'DatSegRAW': 'raw', 'InitErrorRAW': 'raw',
+    'DatSegUBI': 'uboot', 'DatSegUBX': 'uboot', 'DatSegUBT': 'uboot',
+    'InitErrorUBI': 'uboot', 'InitErrorUBX': 'uboot', 'InitErrorUBT': 'uboot',
+    'sign_images': 'hab', 'SignErrorHAB': 'hab', 'HAB_CACHE_DIR': 'hab',
+    'file_sha256': 'digest', 'DigestError': 'digest',
+    'ArtifactBackend': 'artifacts', 'ArtifactCache': 'artifacts', 'ArtifactError': 'artifacts',
+    'register_backend': 'artifacts', 'set_cache': 'artifacts', 'ARTIFACT_CACHE_DIR': 'artifacts',
+    'register_segment': 'registry', 'get_segment_class': 'registry', 'segment_types': 'registry',
+    'RegistryError': 'registry',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module('.' + _LAZY[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_LAZY.keys()))
+
 
 __all__ = [
     'DatSegFDT',
@@ -20,6 +45,16 @@ __all__ = [
     'DatSegUBI',
     'DatSegUBX',
     'DatSegUBT',
+    'ArtifactBackend',
+    'ArtifactCache',
+    # Functions
+    'sign_images',
+    'file_sha256',
+    'register_backend',
+    'set_cache',
+    'register_segment',
+    'get_segment_class',
+    'segment_types',
     # Errors
     'InitErrorFDT',
     'InitErrorDCD',
@@ -27,5 +62,12 @@ __all__ = [
     'InitErrorRAW',
     'InitErrorUBI',
     'InitErrorUBX',
-    'InitErrorUBT'
+    'InitErrorUBT',
+    'SignErrorHAB',
+    'ArtifactError',
+    'DigestError',
+    'RegistryError',
+    # Constants
+    'HAB_CACHE_DIR',
+    'ARTIFACT_CACHE_DIR'
 ]
\ No newline at end of file
@@ -0,0 +1,173 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import mmap
+import threading
+from struct import unpack_from
+
+# Supported archive file extensions
+ARCHIVE_EXTS = ('.zip', '.tar')
+
+# Opened archives: {<absolute path>: Archive}
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+class ArchiveError(Exception):
+    """Thrown when archive file is not supported"""
+    pass
+
+
+class Archive(object):
+    """ Zip or uncompressed tar archive with member offset index
+
+        The index is created once when the archive is opened. The content of stored (not compressed) members is
+        returned as read-only memoryview slice of mapped archive file, the compressed zip members are decompressed.
+    """
+
+    @property
+    def path(self):
+        return self._path
+
+    def __init__(self, path):
+        """ Init Archive
+        :param path: The path to *.zip or *.tar file
+        """
+        import tarfile
+        import zipfile
+
+        self._path = os.path.abspath(path)
+        # {<member name>: (<data offset or None if compressed>, <size>)}
+        self._index = {}
+        self._zip = None
+
+        if zipfile.is_zipfile(self._path):
+            self._zip = zipfile.ZipFile(self._path)
+            with open(self._path, 'rb') as f:
+                for info in self._zip.infolist():
+                    if info.is_dir():
+                        continue
+                    offset = None
+                    if info.compress_type == zipfile.ZIP_STORED:
+                        # the local header may have different extra field than central directory
+                        f.seek(info.header_offset)
+                        name_len, extra_len = unpack_from('<HH', f.read(30), 26)
+                        offset = info.header_offset + 30 + name_len + extra_len
+                    self._index[info.filename] = (offset, info.file_size)
+        else:
+            try:
+                with tarfile.open(self._path, 'r:') as tar:
+                    for info in tar.getmembers():
+                        if info.isfile():
+                            self._index[os.path.normpath(info.name).replace(os.sep, '/')] = (info.offset_data,
+                                                                                             info.size)
+            except tarfile.ReadError:
+                raise ArchiveError("Not supported archive (only zip and uncompressed tar): {}".format(path))
+
+        with open(self._path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else None
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def names(self):
+        return list(self._index.keys())
+
+    def member(self, path):
+        """ Get member name from virtual path
+        :param path: The path inside archive: <archive path>/<member name>
+        :return: member name or None
+        """
+        path = os.path.normpath(os.path.abspath(path))
+        if not path.startswith(self._path + os.sep):
+            return None
+        return path[len(self._path) + 1:].replace(os.sep, '/')
+
+    def member_path(self, name):
+        """ Get virtual path of member
+        :param name: The member name
+        :return: <archive path>/<member name>
+        """
+        return os.path.join(self._path, *name.split('/'))
+
+    def read(self, name):
+        """ Read member content
+        :param name: The member name
+        :return: read-only memoryview or bytes
+        """
+        offset, size = self._index[name]
+        if offset is None:
+            return self._zip.read(name)
+        if size == 0:
+            return memoryview(b'')
+        return memoryview(self._mm)[offset:offset + size]
+
+    def close(self):
+        """ Close archive file, the mapping is released when the last returned member view is dropped """
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:
+                # some member views are still referenced, the mapping is closed by garbage collector
+                pass
+            self._mm = None
+
+
+def is_archive(path):
+    """ Check if path is supported archive file """
+    return path.lower().endswith(ARCHIVE_EXTS) and os.path.isfile(path)
+
+
+def open_archive(path):
+    """ Open archive and register it for resolving of virtual paths
+    :param path: The path to archive
+    :return: Archive object
+    """
+    path = os.path.abspath(path)
+    with _archives_lock:
+        if path not in _archives:
+            _archives[path] = Archive(path)
+        return _archives[path]
+
+
+def close_archive(path):
+    """ Unregister and close archive
+    :param path: The path to archive
+    """
+    with _archives_lock:
+        archive = _archives.pop(os.path.abspath(path), None)
+    if archive is not None:
+        archive.close()
+
+
+def find_member(path):
+    """ Find archive which contains the path
+    :param path: The virtual path
+    :return: (Archive, member name) or (None, None)
+    """
+    for archive in list(_archives.values()):
+        name = archive.member(path)
+        if name is not None:
+            return archive, name
+    return None, None
+
+
+def split_archive_path(path):
+    """ Split path into archive path and member name
+    :param path: <archive path> or <archive path>/<member name>
+    :return: (archive path, member name or '') or (None, None)
+    """
+    head, tail = os.path.abspath(path), ''
+    while head and head != os.path.dirname(head):
+        if is_archive(head):
+            return head, tail
+        head, name = os.path.split(head)
+        tail = name if not tail else name + '/' + tail
+    return None, None
@@ -0,0 +1,341 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ..cache import CACHE_DIR, atomic_write
+
+# Default directory for artifacts cache
+ARTIFACT_CACHE_DIR = os.path.join(CACHE_DIR, 'artifacts')
+
+# Default max size of artifacts cache in bytes
+ARTIFACT_CACHE_SIZE = 4 * 1024 * 1024 * 1024
+
+# Whitespace separated list of mirrors (base URLs or directories) for content hash URIs: sha256:<hex digest>
+ARTIFACT_MIRRORS_ENV = 'IMXSB_ARTIFACT_MIRRORS'
+
+# Registered backends: {<scheme>: ArtifactBackend}
+_backends = {}
+
+
+class ArtifactError(Exception):
+    """Thrown when artifact can not be fetched"""
+    pass
+
+
+def _copy_stream(src, dst, sha):
+    while True:
+        chunk = src.read(1024 * 1024)
+        if not chunk:
+            break
+        sha.update(chunk)
+        dst.write(chunk)
+
+
+class ArtifactBackend(object):
+    """ Base class for artifact store backends
+
+        The backend serves URIs with given scheme. If the backend is not cached, the artifact is read in place from
+        path returned by local_path(), otherwise the content is written into opened file by fetch() and stored into
+        local content-addressed cache.
+    """
+
+    SCHEME = None
+    CACHED = True
+
+    def local_path(self, uri):
+        """ Get local path of not cached artifact
+        :param uri: The artifact URI
+        :return: path
+        """
+        raise NotImplementedError()
+
+    def fetch(self, uri, file):
+        """ Download artifact content
+        :param uri: The artifact URI
+        :param file: The opened output file
+        :return: sha256 hex digest of content
+        """
+        raise NotImplementedError()
+
+
+class FileBackend(ArtifactBackend):
+    """ Artifacts on local or mounted file system: file:///<path> """
+
+    SCHEME = 'file'
+    CACHED = False
+
+    def local_path(self, uri):
+        import urllib.parse
+        import urllib.request
+        return urllib.request.url2pathname(urllib.parse.urlparse(uri).path)
+
+
+class HttpBackend(ArtifactBackend):
+    """ Artifacts on HTTP server or mirror: http://<host>/<path> or https://<host>/<path> """
+
+    SCHEME = 'http'
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+
+    def fetch(self, uri, file):
+        import urllib.request
+        sha = hashlib.sha256()
+        try:
+            with urllib.request.urlopen(uri, timeout=self.timeout) as response:
+                _copy_stream(response, file, sha)
+        except OSError as e:
+            raise ArtifactError("{}: {}".format(uri, e))
+        return sha.hexdigest()
+
+
+class HttpsBackend(HttpBackend):
+
+    SCHEME = 'https'
+
+
+class HashBackend(ArtifactBackend):
+    """ Artifacts addressed by content hash: sha256:<hex digest>
+
+        The content is searched in mirrors as <mirror>/<hex digest>, where mirror is base URL or directory.
+    """
+
+    SCHEME = 'sha256'
+
+    def __init__(self, mirrors=None, timeout=30):
+        if mirrors is None:
+            mirrors = os.environ.get(ARTIFACT_MIRRORS_ENV, '').split()
+        self.mirrors = list(mirrors)
+        self.timeout = timeout
+
+    def fetch(self, uri, file):
+        import urllib.request
+        digest = uri.split(':', 1)[1].lower()
+        errors = []
+        for mirror in self.mirrors:
+            sha = hashlib.sha256()
+            file.seek(0)
+            file.truncate()
+            try:
+                if '://' in mirror:
+                    with urllib.request.urlopen(mirror.rstrip('/') + '/' + digest, timeout=self.timeout) as src:
+                        _copy_stream(src, file, sha)
+                else:
+                    with open(os.path.join(mirror, digest), 'rb') as src:
+                        _copy_stream(src, file, sha)
+            except OSError as e:
+                errors.append("{}: {}".format(mirror, e))
+                continue
+            if sha.hexdigest() != digest:
+                errors.append("{}: content hash mismatch".format(mirror))
+                continue
+            return digest
+        raise ArtifactError("{} not found in mirrors: {}".format(uri, '; '.join(errors) or 'none defined'))
+
+
+def register_backend(backend):
+    """ Register artifact store backend (replaces the one with the same scheme)
+    :param backend: The ArtifactBackend object
+    """
+    assert isinstance(backend, ArtifactBackend)
+    _backends[backend.SCHEME] = backend
+
+
+def is_uri(path):
+    """ Check if path is artifact URI served by some of registered backends """
+    if not isinstance(path, str) or ':' not in path:
+        return False
+    scheme = path.split(':', 1)[0].lower()
+    # single letter is windows drive
+    return len(scheme) > 1 and scheme in _backends
+
+
+class ArtifactCache(object):
+    """ Local content-addressed cache of artifacts
+
+        The content is stored as <cache dir>/objects/<sha256> and the URIs are mapped to it by <cache dir>/refs/<sha256
+        of URI>. The artifacts are treated as immutable, therefore once fetched URI is never downloaded again until it's
+        evicted. If the total size exceeds the limit, the least recently used objects are removed, except the ones
+        fetched by this cache object, which can be still used by opened SMX files or boot plans.
+    """
+
+    def __init__(self, cache_dir=ARTIFACT_CACHE_DIR, max_size=ARTIFACT_CACHE_SIZE, max_workers=4):
+        """ Init ArtifactCache
+        :param cache_dir: The cache directory
+        :param max_size: The max size of cached objects in bytes (None is unlimited)
+        :param max_workers: The max count of parallel downloads for prefetch
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._pending = {}
+        # paths of objects used by this process
+        self._used = set()
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='imxsb-fetch')
+
+    def _object_path(self, digest):
+        return os.path.join(self.cache_dir, 'objects', digest)
+
+    def _ref_path(self, uri):
+        return os.path.join(self.cache_dir, 'refs', hashlib.sha256(uri.encode()).hexdigest())
+
+    def lookup(self, uri):
+        """ Get path of cached artifact
+        :param uri: The artifact URI
+        :return: path or None if not cached
+        """
+        if uri.lower().startswith(HashBackend.SCHEME + ':'):
+            digest = uri.split(':', 1)[1].lower()
+        else:
+            try:
+                with open(self._ref_path(uri)) as f:
+                    digest = f.read().strip()
+            except OSError:
+                return None
+        path = self._object_path(digest)
+        try:
+            # update access time for LRU eviction
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def _fetch(self, uri):
+        path = self.lookup(uri)
+        if path is not None:
+            with self._lock:
+                self._used.add(path)
+            return path
+
+        backend = _backends[uri.split(':', 1)[0].lower()]
+        os.makedirs(os.path.join(self.cache_dir, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(self.cache_dir, 'refs'), exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(prefix='fetch_', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'w+b') as f:
+                digest = backend.fetch(uri, f)
+            path = self._object_path(digest)
+            with self._lock:
+                self._used.add(path)
+            os.replace(tmp_file, path)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+        if not uri.lower().startswith(HashBackend.SCHEME + ':'):
+            atomic_write(self._ref_path(uri), digest)
+
+        self.evict()
+        return path
+
+    def fetch(self, uri):
+        """ Get local path of artifact, download it if it's not cached
+        :param uri: The artifact URI
+        :return: path
+        """
+        backend = _backends[uri.split(':', 1)[0].lower()]
+        if not backend.CACHED:
+            return backend.local_path(uri)
+
+        with self._lock:
+            future = self._pending.get(uri)
+        if future is not None:
+            return future.result()
+        return self._fetch(uri)
+
+    def prefetch(self, uris):
+        """ Start background download of artifacts
+        :param uris: The list of artifact URIs
+        """
+        with self._lock:
+            for uri in uris:
+                if uri in self._pending or not _backends[uri.split(':', 1)[0].lower()].CACHED:
+                    continue
+                future = self._executor.submit(self._fetch, uri)
+                future.add_done_callback(lambda _, key=uri: self._done(key))
+                self._pending[uri] = future
+
+    def _done(self, uri):
+        with self._lock:
+            self._pending.pop(uri, None)
+
+    def evict(self, keep=None):
+        """ Remove the least recently used objects if cache size exceeds the limit
+        :param keep: The path of object which must not be removed (the used objects are never removed)
+        """
+        if self.max_size is None:
+            return
+        objects_dir = os.path.join(self.cache_dir, 'objects')
+        with self._lock:
+            used = set(self._used)
+        if keep is not None:
+            used.add(keep)
+        items = []
+        for entry in os.scandir(objects_dir):
+            stat = entry.stat()
+            items.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in items)
+        for _, size, path in sorted(items):
+            if total <= self.max_size:
+                break
+            if path in used:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            self._used.clear()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+_cache = None
+
+
+def get_cache():
+    """ Get global artifacts cache """
+    global _cache
+    if _cache is None:
+        _cache = ArtifactCache()
+    return _cache
+
+
+def set_cache(cache):
+    """ Replace global artifacts cache
+    :param cache: The ArtifactCache object
+    """
+    global _cache
+    assert isinstance(cache, ArtifactCache)
+    _cache = cache
+
+
+def fetch_artifact(uri):
+    """ Get local path of artifact
+    :param uri: The artifact URI
+    :return: path
+    """
+    return get_cache().fetch(uri)
+
+
+def prefetch_artifacts(uris):
+    """ Start concurrent background download of artifacts
+    :param uris: The list of artifact URIs
+    """
+    get_cache().prefetch([uri for uri in uris if is_uri(uri)])
+
+
+register_backend(FileBackend())
+register_backend(HttpBackend())
+register_backend(HttpsBackend())
+register_backend(HashBackend())
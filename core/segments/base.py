@@ -5,22 +5,82 @@
 # or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
 
 import os
+import mmap
+import queue
+import hashlib
+import threading
+from bisect import bisect_right
+from .archive import find_member
+from .artifacts import is_uri, fetch_artifact
+from .digest import file_sha256, DigestError
 
+# Default size of chunks read from streamed file
+STREAM_CHUNK = 1024 * 1024
 
-def get_full_path(root, *path_list):
+# The files smaller than this are read by load_file(), the larger ones are mapped
+LOAD_MMAP_MIN = 16 * 1024 * 1024
+
+# Resolved paths cache: {(<roots>, <path>): (<full path>, [(<probed dir>, <mtime>), ...])}
+_path_cache = {}
+
+
+def path_exists(path):
+    """ Check if path exists in file system or inside opened archive """
+    if os.path.exists(path):
+        return True
+    archive, name = find_member(path)
+    return archive is not None and name in archive
+
+
+def _dir_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def resolve_path(roots, path):
+    """ Resolve path against search roots
+    :param roots: The list of search roots
+    :param path: The path
+    :return: The full path or empty string if doesn't exist
+
+    The results are cached and invalidated if the mtime of any probed directory has been changed. The artifact URIs
+    are resolved to local path inside artifacts cache.
     """
-    :param root:
-    :param path:
-    :return:
+    if is_uri(path):
+        return fetch_artifact(path)
+
+    key = (tuple(roots), path)
+    if key in _path_cache:
+        file_path, dirs = _path_cache[key]
+        if all(_dir_mtime(item) == mtime for item, mtime in dirs):
+            return file_path
+
+    file_path = ""
+    dirs = []
+    for abs_path in [path] + [os.path.join(root, path) for root in roots]:
+        abs_path = os.path.normpath(abs_path)
+        dir_path = os.path.dirname(os.path.abspath(abs_path))
+        dirs.append((dir_path, _dir_mtime(dir_path)))
+        if path_exists(abs_path):
+            file_path = abs_path
+            break
+
+    _path_cache[key] = (file_path, dirs)
+    return file_path
+
+
+def get_full_path(root, *path_list):
+    """ Get full paths of files
+    :param root: The search root or ordered list of search roots
+    :param path_list: The paths of files
+    :return: The list of full paths
     """
+    roots = [root] if isinstance(root, str) else root
     ret_path = []
     for path in path_list:
-        file_path = ""
-        for abs_path in [path, os.path.join(root, path)]:
-            abs_path = os.path.normpath(abs_path)
-            if os.path.exists(abs_path):
-                file_path = abs_path
-                break
+        file_path = resolve_path(roots, path)
         if not file_path:
             raise Exception("Path: \"%s\" doesnt exist" % path)
         ret_path.append(file_path)
@@ -28,6 +88,284 @@ def get_full_path(root, *path_list):
     return ret_path
 
 
+def load_file(file_path):
+    """ Load file content, the large files are mapped into memory without copying
+    :param file_path: The path to file
+    :return: read-only memoryview of file content
+
+    The files smaller than LOAD_MMAP_MIN are read, so that the loaded data segment doesn't keep the file mapped (a
+    truncated mapped file crashes the process by SIGBUS and the mapped file can't be replaced on Windows).
+    """
+    if not os.path.exists(file_path):
+        archive, name = find_member(file_path)
+        if archive is not None:
+            return memoryview(archive.read(name))
+
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < LOAD_MMAP_MIN:
+            return memoryview(f.read())
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def read_file(file_path, text=False):
+    """ Read file content
+    :param file_path: The path to file
+    :param text: Return content as string if True
+    :return: bytes or str
+    """
+    if not os.path.exists(file_path):
+        archive, name = find_member(file_path)
+        if archive is not None:
+            data = bytes(archive.read(name))
+            return data.decode() if text else data
+
+    with open(file_path, 'r' if text else 'rb') as f:
+        return f.read()
+
+
+class SgBuffer(object):
+    """ Scatter-gather buffer
+
+        Sequence of buffer-protocol objects (bytes, bytearray, memoryview, mmap, ...) which behaves like a single
+        read-only bytes object without joining them. Only the requested slices are copied.
+    """
+
+    @property
+    def parts(self):
+        return self._parts
+
+    def __init__(self, *parts):
+        self._parts = []
+        self._offsets = []
+        self._size = 0
+        for part in parts:
+            self.append(part)
+
+    def __len__(self):
+        return self._size
+
+    def __bytes__(self):
+        return b''.join(self._parts)
+
+    def __eq__(self, obj):
+        return bytes(self) == bytes(obj)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            if key < 0:
+                key += self._size
+            if not 0 <= key < self._size:
+                raise IndexError("SgBuffer index out of range")
+            index = bisect_right(self._offsets, key) - 1
+            return self._parts[index][key - self._offsets[index]]
+
+        if not isinstance(key, slice):
+            raise TypeError("SgBuffer indices must be integers or slices")
+
+        start, stop, step = key.indices(self._size)
+        if step != 1:
+            return bytes(self)[key]
+        if start >= stop:
+            return b''
+
+        data = []
+        index = bisect_right(self._offsets, start) - 1
+        while start < stop:
+            offset = self._offsets[index]
+            part = self._parts[index]
+            end = min(stop - offset, len(part))
+            data.append(part[start - offset:end])
+            start = offset + end
+            index += 1
+
+        return data[0].tobytes() if len(data) == 1 else b''.join(data)
+
+    def append(self, part):
+        """ Append buffer-protocol object
+        :param part: bytes, bytearray, memoryview, mmap, SgBuffer, FileStream ...
+        """
+        if isinstance(part, SgBuffer):
+            for item in part.parts:
+                self.append(item)
+            return
+        if isinstance(part, FileStream):
+            part = part.view()
+        part = memoryview(part).cast('B')
+        if len(part):
+            self._parts.append(part)
+            self._offsets.append(self._size)
+            self._size += len(part)
+
+    def tobytes(self):
+        return bytes(self)
+
+
+class FileStream(object):
+    """ Read-only content of file which is read by chunks on demand
+
+        The stream holds only the file path and its size, so that large images are not loaded into memory. The chunks()
+        iterator reads the next chunk in background while the current one is used (double buffering). The slices are
+        read directly from file, therefore the stream can be used as data of any write command. If the SHA256 digest
+        is pinned, the chunks() iterator checks the read content and raises DigestError instead of the last chunk, so
+        that the file changed after verification is never transferred completely.
+    """
+
+    @property
+    def path(self):
+        return self._path
+
+    def __init__(self, path, sha256=None):
+        """ Init FileStream
+        :param path: The path to regular file
+        :param sha256: The expected SHA256 digest of file content (hex string)
+        """
+        self._path = path
+        self._size = os.path.getsize(path)
+        self._sha256 = sha256
+
+    def __len__(self):
+        return self._size
+
+    def __bytes__(self):
+        return self[:]
+
+    def __eq__(self, obj):
+        return bytes(self) == bytes(obj)
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            if key < 0:
+                key += self._size
+            if not 0 <= key < self._size:
+                raise IndexError("FileStream index out of range")
+            return self[key:key + 1][0]
+
+        if not isinstance(key, slice):
+            raise TypeError("FileStream indices must be integers or slices")
+
+        start, stop, step = key.indices(self._size)
+        if step != 1:
+            return bytes(self)[key]
+        if start >= stop:
+            return b''
+        with open(self._path, 'rb') as f:
+            f.seek(start)
+            data = f.read(stop - start)
+        if len(data) != stop - start:
+            raise IOError("{}: File has been truncated".format(self._path))
+        return data
+
+    def view(self):
+        """ Map the content into memory
+        :return: read-only memoryview
+        """
+        return load_file(self._path)
+
+    def chunks(self, size=STREAM_CHUNK, start=0):
+        """ Iterate over content by chunks, the next chunk is read in background while the current one is used
+        :param size: The chunk size or callable which returns the size of next chunk
+        :param start: The offset of first chunk
+        :return: iterator of (offset, bytes)
+        """
+        chunk_size = size if callable(size) else lambda: size
+        buffers = queue.Queue(1)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    buffers.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def reader():
+            offset = start
+            sha = None if self._sha256 is None else hashlib.sha256()
+            try:
+                with open(self._path, 'rb') as f:
+                    # the skipped content is only hashed
+                    while sha is not None and f.tell() < start:
+                        data = f.read(min(STREAM_CHUNK, start - f.tell()))
+                        if not data:
+                            raise IOError("{}: File has been truncated".format(self._path))
+                        sha.update(data)
+                    f.seek(offset)
+                    while offset < self._size and not stop.is_set():
+                        data = f.read(min(chunk_size(), self._size - offset))
+                        if not data:
+                            raise IOError("{}: File has been truncated".format(self._path))
+                        if sha is not None:
+                            sha.update(data)
+                            if offset + len(data) == self._size and sha.hexdigest() != self._sha256:
+                                raise DigestError("SHA256 of \"{}\" doesn't match: {} != {}".format(
+                                    self._path, sha.hexdigest(), self._sha256))
+                        put((offset, data))
+                        offset += len(data)
+            except Exception as e:
+                put(e)
+            put(None)
+
+        thread = threading.Thread(target=reader, name='imxsb-stream', daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = buffers.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    def tobytes(self):
+        return bytes(self)
+
+
+def is_stream(data):
+    """ Check if data are streamed from file (see FileStream) """
+    return isinstance(data, FileStream)
+
+
+def data_parts(data):
+    """ Iterate over segment data without joining or loading them
+    :param data: bytes, buffer-protocol object, SgBuffer or FileStream
+    :return: iterator of buffer-protocol objects
+    """
+    if isinstance(data, SgBuffer):
+        return iter(data.parts)
+    if isinstance(data, FileStream):
+        return (chunk for _, chunk in data.chunks())
+    return iter([data])
+
+
+def data_buffers(data):
+    """ Get underlying buffers of segment data, the slices of the same buffer are returned only once
+    :param data: bytes, buffer-protocol object or SgBuffer (the streamed data have no buffer)
+    :return: dict {<id of buffer>: <part of data>}
+    """
+    buffers = {}
+    if data is None or is_stream(data):
+        return buffers
+    for part in (data.parts if isinstance(data, SgBuffer) else [data]):
+        base = part.obj if isinstance(part, memoryview) else part
+        buffers.setdefault(id(base), part)
+    return buffers
+
+
+def data_digest(data):
+    """ Get SHA-256 digest of segment data
+    :param data: bytes, buffer-protocol object, SgBuffer or FileStream
+    :return: hex string
+    """
+    sha = hashlib.sha256()
+    for part in data_parts(data):
+        sha.update(part)
+    return sha.hexdigest()
+
+
 def get_data_segment(db, name):
     """ Get data segments by it's name
     :param db:
@@ -38,25 +376,80 @@ def get_data_segment(db, name):
     assert isinstance(name, str), ""
 
     for item in db:
-        if item.full_name == name.upper():
+        if item.full_name.upper() == name.upper():
             return item
 
     raise Exception("{} doesn't exist !".format(name))
 
 
 class DatSegBase(object):
-    """ Data segments base class """
+    """ Data segments base class
+
+        The content of loaded data segment (self.data) is bytes or any buffer-protocol object (bytearray, memoryview,
+        mmap) or SgBuffer, which is passed to target device without copying. If the data segment is managed by
+        SegmentStore (self.store), its released or evicted data are reloaded on next access.
+    """
 
     MARK = 'base'
 
+    @property
+    def data(self):
+        if self._data is None:
+            if self.evicted and self.store is not None:
+                self.store.reload(self)
+        elif self.store is not None:
+            self.store.touch(self)
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self.evicted = False
+        self.released = False
+        if self.store is not None:
+            if value is None:
+                self.store.discard(self)
+            else:
+                self.store.put(self)
+
     @property
     def loaded(self):
-        return False if self.data is None else True
+        return False if self._data is None else True
+
+    @property
+    def size(self):
+        return 0 if self._data is None else len(self._data)
+
+    @property
+    def mem_size(self):
+        """ The size of loaded data held in memory (the streamed data are not held) """
+        return 0 if self._data is None or isinstance(self._data, FileStream) else len(self._data)
+
+    @property
+    def mem_buffers(self):
+        """ The underlying buffers of loaded data held in memory: {<id of buffer>: <size of buffer>}
+
+            The buffers shared with other data segments (zero-copy composition) have the same id.
+        """
+        return {key: memoryview(part.obj if isinstance(part, memoryview) else part).nbytes
+                for key, part in data_buffers(self._data).items()}
 
     @property
     def full_name(self):
         return '{}.{}'.format(self.name, self.MARK)
 
+    @property
+    def depends(self):
+        """ The names of data segments which are used for building this one """
+        return []
+
+    @property
+    def files(self):
+        """ The paths of files which are read by this data segment """
+        if self.path is None:
+            return []
+        return list(self.path) if isinstance(self.path, list) else [self.path]
+
     def __init__(self, name):
         """ Init BaseItem
         :param name: Data segments name
@@ -65,10 +458,15 @@ class DatSegBase(object):
         assert isinstance(name, str)
 
         self.name = name
+        self.store = None
+        self.evicted = False
         self.data = None
         self.path = None
+        self.sha256 = None
         self.address = None
         self.description = ""
+        # the data have been released as not needed (see release())
+        self.released = False
 
     def __str__(self):
         """ String representation """
@@ -81,6 +479,37 @@ class DatSegBase(object):
     def info(self):
         return self.full_name
 
+    def evict(self):
+        """ Drop loaded data, which will be reloaded on next access if the data segment is managed by store """
+        if self._data is not None:
+            self._data = None
+            self.evicted = True
+
+    def release(self):
+        """ Drop loaded data which aren't needed anymore, they are reloaded on next access like evicted ones
+
+            The memory is freed only if the data aren't referenced by other objects (data segments built from them,
+            boot plans, ...), the caller should check it by data_buffers().
+        """
+        if self._data is not None:
+            self.evict()
+            self.released = True
+            if self.store is not None:
+                self.store.discard(self)
+
+    def verify(self, root_path):
+        """ Check content of source file against pinned SHA256 digest
+        :param root_path: The search root or list of search roots
+        """
+        if self.sha256 is None:
+            return
+        # the data segments accept SHA256 only together with single FILE
+        assert isinstance(self.path, str)
+        digest = file_sha256(get_full_path(root_path, self.path)[0])
+        if digest != self.sha256:
+            raise DigestError("{}: SHA256 of \"{}\" doesn't match: {} != {}".format(self.full_name, self.path, digest,
+                                                                                  self.sha256))
+
     def init(self, data):
         raise NotImplementedError()
 
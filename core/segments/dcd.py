@@ -4,8 +4,43 @@
 # The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
 # or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
 
-from imx.img import SegDCD
-from .base import DatSegBase, get_full_path
+import hashlib
+from struct import pack, unpack_from, error as StructError
+from itertools import repeat
+from imx.img import SegDCD, CmdWriteData, EnumWriteOps, EnumCheckOps, EnumEngine
+from .digest import sha256_value
+from .base import DatSegBase, get_full_path, read_file
+
+# The max count of compiled DCD text items kept in cache
+DCD_CACHE_SIZE = 32
+
+# DCD binary format tags
+DCD_TAG = 0xD2
+DCD_PARAM = 0x41
+CMD_WRITE_TAG = 0xCC
+CMD_CHECK_TAG = 0xCF
+CMD_UNLOCK_TAG = 0xB2
+CMD_NOP_TAG = 0xC0
+DCD_CMD_TAGS = (CMD_WRITE_TAG, CMD_CHECK_TAG, CMD_UNLOCK_TAG, CMD_NOP_TAG)
+
+DCD_WRITE_OPS = {
+    'WriteValue': EnumWriteOps.WRITE_VALUE,
+    'WriteValue1': EnumWriteOps.WRITE_VALUE1,
+    'ClearBitMask': EnumWriteOps.CLEAR_BITMASK,
+    'SetBitMask': EnumWriteOps.SET_BITMASK
+}
+
+DCD_CHECK_OPS = {
+    'CheckAllClear': EnumCheckOps.ALL_CLEAR,
+    'CheckAllSet': EnumCheckOps.ALL_SET,
+    'CheckAnyClear': EnumCheckOps.ANY_CLEAR,
+    'CheckAnySet': EnumCheckOps.ANY_SET
+}
+
+DCD_CMD_NAMES = frozenset(list(DCD_WRITE_OPS) + list(DCD_CHECK_OPS) + ['Unlock', 'Nop'])
+
+# Compiled DCD text cache: {<sha1 of text>: <bytes>}
+_dcd_cache = {}
 
 
 class InitErrorDCD(Exception):
@@ -13,6 +48,175 @@ class InitErrorDCD(Exception):
     pass
 
 
+def compile_dcd_txt(text):
+    """ Compile DCD text directly into binary DCD segment
+    :param text: The string with DCD commands
+    :return: The DCD segment as bytes
+
+    The output is identical with SegDCD.parse_txt(text).export(), the lines are processed by the same rules (comments,
+    multi-line commands ended by backslash, unknown lines are ignored), but no command objects are created, all values
+    are converted at once and packed as 32-bit words by single call. Compiled data are cached by hash of the text.
+    Values of Unlock command are packed as 32-bit words, how is defined by HAB specification.
+    """
+    assert isinstance(text, str)
+
+    key = hashlib.sha1(text.encode()).digest()
+    data = _dcd_cache.get(key)
+    if data is not None:
+        return data
+
+    # collect commands: [tag, param, index of the first value, count of values] and the not converted values
+    cmds = []
+    values = []
+    cmd_write = None
+    mline = None
+    strip = '\0' in text
+    for line_cnt, line in enumerate(text.split('\n'), 1):
+        if strip:
+            line = line.rstrip('\0')
+        # ignore empty lines and comments (also inside of multi-line command)
+        if not line or line[0] == '#':
+            continue
+        if mline is not None:
+            cmd = mline + line.split()
+            mline = None
+        else:
+            cmd = line.split()
+            if not cmd or cmd[0] not in DCD_CMD_NAMES:
+                continue
+        if cmd[-1] == '\\':
+            mline = cmd[:-1]
+            continue
+
+        name = cmd[0]
+        if name in DCD_WRITE_OPS:
+            if len(cmd) < 4:
+                raise SyntaxError("Write CMD: not enough arguments at line {}".format(line_cnt))
+            if cmd[1] not in ('1', '2', '4'):
+                raise SyntaxError("Write CMD: not supported width at line {}".format(line_cnt))
+            param = (DCD_WRITE_OPS[name] << 3) | int(cmd[1])
+            if cmd_write is None or cmd_write[1] != param:
+                cmd_write = [CMD_WRITE_TAG, param, len(values), 0]
+                cmds.append(cmd_write)
+            values += cmd[2:4]
+            cmd_write[3] += 2
+            continue
+
+        cmd_write = None
+        if name in DCD_CHECK_OPS:
+            if len(cmd) < 4:
+                raise SyntaxError("Check CMD: not enough arguments at line {}".format(line_cnt))
+            if cmd[1] not in ('1', '2', '4'):
+                raise SyntaxError("Check CMD: not supported width at line {}".format(line_cnt))
+            args = cmd[2:5]
+            cmds.append([CMD_CHECK_TAG, (DCD_CHECK_OPS[name] << 3) | int(cmd[1]), len(values), len(args)])
+        elif name == 'Unlock':
+            if len(cmd) < 2 or not EnumEngine.is_valid(cmd[1]):
+                raise SyntaxError("Unlock CMD: wrong engine parameter at line {}".format(line_cnt))
+            args = cmd[2:]
+            cmds.append([CMD_UNLOCK_TAG, EnumEngine[cmd[1]], len(values), len(args)])
+        else:
+            args = []
+            cmds.append([CMD_NOP_TAG, 0, len(values), 0])
+        values += args
+
+    # all values are converted at once, the DCD header, command headers and values are 32-bit big-endian words
+    try:
+        values = list(map(int, values, repeat(0)))
+    except ValueError as ex:
+        raise SyntaxError("DCD CMD: {}".format(str(ex)))
+    size = 4 + 4 * (len(cmds) + len(values))
+    if size > 0xFFFF:
+        raise SyntaxError("DCD CMD: too many commands, the size {} exceeds 64 kB".format(size))
+    words = [(DCD_TAG << 24) | (size << 8) | DCD_PARAM]
+    for tag, param, index, count in cmds:
+        words.append((tag << 24) | ((4 + 4 * count) << 8) | param)
+        words += values[index:index + count]
+    try:
+        data = pack(">{}L".format(len(words)), *words)
+    except StructError:
+        raise SyntaxError("DCD CMD: value out of 32-bit range")
+
+    if len(_dcd_cache) >= DCD_CACHE_SIZE:
+        del _dcd_cache[next(iter(_dcd_cache))]
+    _dcd_cache[key] = data
+
+    return data
+
+
+def check_dcd(data):
+    """ Check structure of binary DCD segment without parsing of its commands
+    :param data: The DCD segment as bytes
+    :return: None, raise ValueError if the data isn't valid DCD
+
+    The header tag, length and HAB version are checked and the command headers are walked, so that the data which
+    would be rejected by target are found before the boot.
+    """
+    if len(data) < 4:
+        raise ValueError("DCD header is missing")
+    tag, length, param = unpack_from(">BHB", data, 0)
+    if tag != DCD_TAG:
+        raise ValueError("Invalid DCD header tag: 0x{:02X}".format(tag))
+    if length != len(data):
+        raise ValueError("DCD length in header {} doesn't match data size {}".format(length, len(data)))
+    if param >> 4 != 4:
+        raise ValueError("Not supported DCD version: 0x{:02X}".format(param))
+    offset = 4
+    while offset < length:
+        if length - offset < 4:
+            raise ValueError("Truncated DCD command at offset {}".format(offset))
+        tag, size, _ = unpack_from(">BHB", data, offset)
+        if tag not in DCD_CMD_TAGS:
+            raise ValueError("Invalid DCD command tag 0x{:02X} at offset {}".format(tag, offset))
+        if size < 4 or size % 4 or offset + size > length:
+            raise ValueError("Invalid DCD command length {} at offset {}".format(size, offset))
+        offset += size
+
+
+def optimize_dcd(dcd_obj):
+    """ Optimize DCD segment
+    :param dcd_obj: The SegDCD object
+    :return: The new optimized SegDCD object
+
+    Consecutive write commands of the same kind and width are merged into one and bitmask operations with zero mask
+    are dropped. The commands order is never changed and all other writes (also the repeated identical ones) and
+    commands are kept, because a lot of i.MX registers are triggered by the write access itself and NOP commands can
+    be used as delay.
+    """
+    assert isinstance(dcd_obj, SegDCD)
+
+    opt_obj = SegDCD(dcd_obj.header.param, True)
+    cmd_write = None
+
+    for cmd in dcd_obj:
+        if not isinstance(cmd, CmdWriteData):
+            if cmd_write is not None:
+                opt_obj.append(cmd_write)
+                cmd_write = None
+            opt_obj.append(cmd)
+            continue
+
+        # the dropped writes don't split the merged command
+        values = [(address, value) for address, value in cmd
+                  if value != 0 or cmd.ops not in (EnumWriteOps.CLEAR_BITMASK, EnumWriteOps.SET_BITMASK)]
+        if not values:
+            continue
+
+        if cmd_write is not None and (cmd_write.ops != cmd.ops or cmd_write.bytes != cmd.bytes):
+            opt_obj.append(cmd_write)
+            cmd_write = None
+
+        if cmd_write is None:
+            cmd_write = CmdWriteData(cmd.bytes, cmd.ops)
+        for address, value in values:
+            cmd_write.append(address, value)
+
+    if cmd_write is not None:
+        opt_obj.append(cmd_write)
+
+    return opt_obj
+
+
 class DatSegDCD(DatSegBase):
     """ Data segments class for Device Configuration Data
 
@@ -20,11 +224,14 @@ class DatSegDCD(DatSegBase):
             DESC: srt
             ADDR: int
             DATA: str or bytes (required)
+            OPTIMIZE: <'yes' or 'no'> (default: 'no')
 
         <NAME>.dcd:
             DESC: srt
             ADDR: int
             FILE: path (required)
+            SHA256: hex str
+            OPTIMIZE: <'yes' or 'no'> (default: 'no')
     """
 
     MARK = 'dcd'
@@ -32,6 +239,9 @@ class DatSegDCD(DatSegBase):
     def __init__(self, name, smx_data=None):
         super().__init__(name)
         self._txt_data = None
+        self._optimize = 'no'
+        # size of DCD data before optimization
+        self.raw_size = None
         if smx_data is not None:
             self.init(smx_data)
 
@@ -65,11 +275,31 @@ class DatSegDCD(DatSegBase):
                 if not isinstance(val, str):
                     raise InitErrorDCD("{}/FILE: Value must be a string !".format(self.full_name))
                 self.path = val
+            elif key == 'SHA256':
+                try:
+                    self.sha256 = sha256_value(val)
+                except ValueError as ex:
+                    raise InitErrorDCD("{}/SHA256: {}".format(self.full_name, str(ex)))
+            elif key == 'OPTIMIZE':
+                if not isinstance(val, str):
+                    raise InitErrorDCD("{}/OPTIMIZE: Value must be a string !".format(self.full_name))
+                val = val.lower()
+                if val not in ('yes', 'no'):
+                    raise InitErrorDCD("{}/OPTIMIZE: Not supported value \"{}\"".format(self.full_name, val))
+                self._optimize = val
             else:
                 raise InitErrorDCD("{}: Not supported property name \"{}\" !".format(self.full_name, key))
 
         if self.path is None and self._txt_data is None:
             raise InitErrorDCD("{}: FILE or DATA property must be defined !".format(self.full_name))
+        if self.sha256 is not None and not isinstance(self.path, str):
+            raise InitErrorDCD("{}/SHA256: Can be used only with single FILE !".format(self.full_name))
+
+    def info(self):
+        msg = self.full_name
+        if self.loaded and self._optimize == 'yes':
+            msg += " (optimized: {} -> {} Bytes)".format(self.raw_size, len(self.data))
+        return msg
 
     def load(self, db, root_path):
         """ load DCD segments
@@ -77,17 +307,23 @@ class DatSegDCD(DatSegBase):
         :param root_path: ...
         """
         assert isinstance(db, list)
-        assert isinstance(root_path, str)
+        assert isinstance(root_path, (str, list))
 
         if self.path is None:
-            dcd_obj = SegDCD.parse_txt(self._txt_data)
+            data = compile_dcd_txt(self._txt_data)
         else:
             file_path = get_full_path(root_path, self.path)[0]
             if file_path.endswith(".txt"):
-                with open(file_path, 'r') as f:
-                    dcd_obj = SegDCD.parse_txt(f.read())
+                data = compile_dcd_txt(read_file(file_path, True))
             else:
-                with open(file_path, 'rb') as f:
-                    dcd_obj = SegDCD.parse(f.read())
+                data = read_file(file_path)
+                try:
+                    check_dcd(data)
+                except ValueError as ex:
+                    raise InitErrorDCD("{}: Not valid DCD file \"{}\": {}".format(self.full_name, self.path, str(ex)))
+
+        self.raw_size = len(data)
+        if self._optimize == 'yes':
+            data = optimize_dcd(SegDCD.parse(data)).export()
 
-        self.data = dcd_obj.export()
+        self.data = data
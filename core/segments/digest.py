@@ -0,0 +1,121 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import json
+import string
+import hashlib
+import threading
+from ..cache import CACHE_DIR, atomic_write
+from .archive import find_member
+
+# Sidecar index of computed digests, used where extended attributes are not supported
+DIGEST_INDEX_FILE = os.path.join(CACHE_DIR, 'digests.json')
+
+# Name of extended attribute with cached digest
+DIGEST_XATTR = 'user.imxsb.sha256'
+
+_index = None
+_index_lock = threading.Lock()
+
+
+class DigestError(Exception):
+    """Thrown when content hash doesn't match the pinned one"""
+    pass
+
+
+def is_sha256(value):
+    """ Check if value is SHA256 hex digest """
+    return isinstance(value, str) and len(value) == 64 and all(c in string.hexdigits for c in value)
+
+
+def sha256_value(value):
+    """ Get pinned SHA256 digest from value of data segment attribute
+    :param value: The attribute value
+    :return: lower-case hex string
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        # YAML reads the digest composed only of decimal digits as number, its leading zeros can't be recovered
+        raise ValueError("Value must be quoted, the hex string is read as number !")
+    if not is_sha256(value):
+        raise ValueError("Value must be a hex string with 64 chars !")
+    return value.lower()
+
+
+def _file_id(stat):
+    return "{}:{}:{}".format(stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _index_get(key, file_id):
+    global _index
+    with _index_lock:
+        if _index is None:
+            try:
+                with open(DIGEST_INDEX_FILE) as f:
+                    _index = json.load(f)
+            except (OSError, ValueError):
+                _index = {}
+        item = _index.get(key)
+    return item[1] if item is not None and item[0] == file_id else None
+
+
+def _index_set(key, file_id, digest):
+    with _index_lock:
+        _index[key] = (file_id, digest)
+        try:
+            atomic_write(DIGEST_INDEX_FILE, json.dumps(_index))
+        except OSError:
+            pass
+
+
+def _hash_file(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1024 * 1024)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def file_sha256(path):
+    """ Get SHA256 digest of file content
+    :param path: The path to file or member of opened archive
+    :return: hex string
+
+    The computed digest is cached in extended attribute of the file or in sidecar index, keyed by inode, mtime and
+    size of the file. Therefore the content is hashed again only if the file has been changed.
+    """
+    archive, name = (None, None) if os.path.exists(path) else find_member(path)
+    if archive is not None:
+        # the member is identified by archive file
+        key = os.path.abspath(path)
+        file_id = _file_id(os.stat(archive.path)) + ':' + name
+        digest = _index_get(key, file_id)
+        if digest is None:
+            digest = hashlib.sha256(archive.read(name)).hexdigest()
+            _index_set(key, file_id, digest)
+        return digest
+
+    file_id = _file_id(os.stat(path))
+    try:
+        value = os.getxattr(path, DIGEST_XATTR).decode()
+        if value.rsplit(':', 1)[0] == file_id:
+            return value.rsplit(':', 1)[1]
+    except (OSError, AttributeError, ValueError):
+        pass
+    digest = _index_get(os.path.abspath(path), file_id)
+    if digest is not None:
+        return digest
+
+    digest = _hash_file(path)
+    try:
+        os.setxattr(path, DIGEST_XATTR, "{}:{}".format(file_id, digest).encode())
+    except (OSError, AttributeError):
+        # read-only file or file system without xattr support
+        _index_set(os.path.abspath(path), file_id, digest)
+    return digest
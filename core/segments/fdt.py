@@ -6,7 +6,8 @@
 
 
 import fdt
-from .base import DatSegBase, get_full_path
+from .digest import sha256_value
+from .base import DatSegBase, get_full_path, read_file
 
 
 class InitErrorFDT(Exception):
@@ -21,6 +22,7 @@ class DatSegFDT(DatSegBase):
             DESC: srt
             ADDR: int
             FILE: path (required)
+            SHA256: hex str
             MODE: <'disabled' or 'merge'> default ('disabled')
             DATA: str
     """
@@ -60,6 +62,11 @@ class DatSegFDT(DatSegBase):
                 if not isinstance(val, str):
                     raise InitErrorFDT("{}/FILE: Value must be a string !".format(self.full_name))
                 self.path = val
+            elif key == 'SHA256':
+                try:
+                    self.sha256 = sha256_value(val)
+                except ValueError as ex:
+                    raise InitErrorFDT("{}/SHA256: {}".format(self.full_name, str(ex)))
             elif key == 'DATA':
                 if not isinstance(val, str):
                     raise InitErrorFDT("{}/DATA: Value must be a string !".format(self.full_name))
@@ -83,15 +90,13 @@ class DatSegFDT(DatSegBase):
         :param root_path: ...
         """
         assert isinstance(db, list)
-        assert isinstance(root_path, str)
+        assert isinstance(root_path, (str, list))
 
         file_path = get_full_path(root_path, self.path)[0]
         if file_path.endswith(".dtb"):
-            with open(file_path, 'rb') as f:
-                fdt_obj = fdt.parse_dtb(f.read())
+            fdt_obj = fdt.parse_dtb(read_file(file_path))
         else:
-            with open(file_path, 'r') as f:
-                fdt_obj = fdt.parse_dts(f.read())
+            fdt_obj = fdt.parse_dts(read_file(file_path, True))
 
         if self._mode is 'merge':
             fdt_obj.merge(fdt.parse_dts(self._dts_data))
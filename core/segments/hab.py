@@ -0,0 +1,197 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import shlex
+import hashlib
+import tempfile
+import subprocess
+from ..cache import CACHE_DIR, atomic_write
+
+# Default directory for signatures cache
+HAB_CACHE_DIR = os.path.join(CACHE_DIR, 'hab')
+
+# Default signing tool command line
+HAB_SIGN_TOOL = 'cst -o {output} -i {csf}'
+
+
+class SignErrorHAB(Exception):
+    """Thrown when image signing fails"""
+    pass
+
+
+def keys_digest(keys_path):
+    """ Get identification of signing keys
+    :param keys_path: The path to directory with keys or single key file
+    :return: hex string
+    """
+    items = []
+    if os.path.isdir(keys_path):
+        for root, _, files in os.walk(keys_path):
+            for name in sorted(files):
+                items.append(os.path.join(root, name))
+    elif os.path.exists(keys_path):
+        items.append(keys_path)
+
+    sha = hashlib.sha256()
+    for item in sorted(items):
+        stat = os.stat(item)
+        sha.update("{}:{}:{}\n".format(item, stat.st_size, stat.st_mtime_ns).encode())
+    return sha.hexdigest()
+
+
+class SignJob(object):
+    """ Signing job for single boot image
+
+        The job is executed in separate process, therefore it holds only plain data.
+    """
+
+    @property
+    def key(self):
+        """ Signature cache key: hash of signed region, CSF template, keys and tool """
+        sha = hashlib.sha256(self.data[:self.length])
+        sha.update(self.csf_text.encode())
+        sha.update(self.keys_id.encode())
+        sha.update(self.tool.encode())
+        return sha.hexdigest()
+
+    def __init__(self, name, data, address, length, csf_text, keys_path, tool=HAB_SIGN_TOOL):
+        """ Init SignJob
+        :param name: The name of signed data segment
+        :param data: The unsigned image data
+        :param address: The load address of image data
+        :param length: The length of signed region from image start
+        :param csf_text: The CSF description template (Jinja2)
+        :param keys_path: The working directory of signing tool with keys
+        :param tool: The signing tool command line
+        """
+        self.name = name
+        self.data = data
+        self.address = address
+        self.length = length
+        self.csf_text = csf_text
+        self.keys_path = keys_path
+        self.keys_id = keys_digest(keys_path)
+        self.tool = tool
+
+
+def parse_sign_data(name, value, error=SignErrorHAB):
+    """ Parse SIGN property of data segment
+    :param name: The full name of data segment
+    :param value: The SIGN property value (dictionary with CSFT, KEYS and TOOL)
+    :param error: The exception class raised for not valid value
+    :return: dictionary with upper case keys
+    """
+    if not isinstance(value, dict):
+        raise error("{}/SIGN: Not a dictionary !".format(name))
+    sign_data = {}
+    for k, v in value.items():
+        if not isinstance(k, str):
+            raise error("{}/SIGN: Not supported property: {}".format(name, k))
+        k = k.upper()
+        if k not in ('CSFT', 'KEYS', 'TOOL'):
+            raise error("{}/SIGN: Not supported property name \"{}\"".format(name, k))
+        if not isinstance(v, str):
+            raise error("{}/SIGN/{}: Value must be a string !".format(name, k))
+        sign_data[k] = v
+
+    if 'CSFT' not in sign_data:
+        raise error("{}/SIGN: CSFT property must be defined !".format(name))
+    if 'TOOL' not in sign_data:
+        sign_data['TOOL'] = HAB_SIGN_TOOL
+    return sign_data
+
+
+def create_sign_job(name, sign_data, root_path, data, address, length):
+    """ Create signing job from parsed SIGN property
+    :param name: The full name of data segment
+    :param sign_data: The parsed SIGN property (see parse_sign_data())
+    :param root_path: The search root or list of search roots
+    :param data: The unsigned image data
+    :param address: The load address of image data
+    :param length: The length of signed region from image start
+    :return: SignJob object
+    """
+    from .base import get_full_path, read_file
+
+    csft_path = get_full_path(root_path, sign_data['CSFT'])[0]
+    if 'KEYS' in sign_data:
+        keys_path = get_full_path(root_path, sign_data['KEYS'])[0]
+    else:
+        keys_path = os.path.dirname(csft_path)
+    return SignJob(name, data, address, length, read_file(csft_path, True), keys_path, sign_data['TOOL'])
+
+
+def run_sign_job(job):
+    """ Execute signing tool for single job
+    :param job: The SignJob object
+    :return: The output of signing tool as bytes
+    """
+    import jinja2
+
+    with tempfile.TemporaryDirectory(prefix='imxsb_') as tmp_dir:
+        image_file = os.path.join(tmp_dir, 'image.bin')
+        csf_file = os.path.join(tmp_dir, 'image.csf')
+        output_file = os.path.join(tmp_dir, 'output.bin')
+
+        with open(image_file, 'wb') as f:
+            f.write(job.data)
+
+        csf_text = jinja2.Template(job.csf_text).render(
+            IMAGE_FILE=image_file,
+            IMAGE_ADDR="0x{:08X}".format(job.address),
+            SIGN_SIZE="0x{:X}".format(job.length),
+            BLOCKS="0x{:08X} 0x0 0x{:X} \"{}\"".format(job.address, job.length, image_file))
+        with open(csf_file, 'w') as f:
+            f.write(csf_text)
+
+        cmd = [arg.format(output=output_file, csf=csf_file, image=image_file) for arg in shlex.split(job.tool)]
+        ret = subprocess.run(cmd, cwd=job.keys_path if os.path.isdir(job.keys_path) else None,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if ret.returncode != 0:
+            raise SignErrorHAB("{}: {}".format(job.name, ret.stdout.decode(errors='replace').strip()))
+
+        with open(output_file, 'rb') as f:
+            return f.read()
+
+
+def sign_images(jobs, cache_dir=HAB_CACHE_DIR, max_workers=None):
+    """ Sign images and cache the signatures
+    :param jobs: The list of SignJob objects
+    :param cache_dir: The directory for signatures cache or None for disabled cache
+    :param max_workers: The max count of parallel signing processes
+    :return: The list of signing tool outputs in order of jobs
+    """
+    keys = [job.key for job in jobs]
+    results = [None] * len(jobs)
+    pending = []
+
+    for i, key in enumerate(keys):
+        if cache_dir is not None and os.path.exists(os.path.join(cache_dir, key)):
+            with open(os.path.join(cache_dir, key), 'rb') as f:
+                results[i] = f.read()
+        elif key not in (keys[n] for n in pending):
+            pending.append(i)
+
+    if pending:
+        if len(pending) == 1:
+            outputs = [run_sign_job(jobs[pending[0]])]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers) as executor:
+                outputs = list(executor.map(run_sign_job, [jobs[i] for i in pending]))
+
+        for i, output in zip(pending, outputs):
+            results[i] = output
+            if cache_dir is not None:
+                atomic_write(os.path.join(cache_dir, keys[i]), output)
+
+    # jobs with the same key as already signed one
+    for i, key in enumerate(keys):
+        if results[i] is None:
+            results[i] = results[keys.index(key)]
+
+    return results
@@ -6,7 +6,9 @@
 
 import imx
 import uboot
-from .base import DatSegBase, get_data_segment, get_full_path
+from .digest import sha256_value
+from .base import DatSegBase, SgBuffer, get_data_segment, get_full_path, read_file
+from .hab import parse_sign_data, create_sign_job
 
 EXPORT_UENV_FIX = True
 
@@ -26,15 +28,39 @@ class InitErrorIMX(Exception):
     pass
 
 
+class SegAPPView(imx.img.SegAPP):
+    """ APP segment which holds any buffer-protocol object without copying
+
+        The export() returns only the padding, so that the image can be exported without APP data, which are placed
+        in front of the padding by caller (see DatSegIMX2.load()).
+    """
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    def export(self, padding=False):
+        return bytes(self.padding) if padding else b''
+
+
 class DatSegIMX2(DatSegBase):
     """ Data segments class for i.MX6 and i.MX7 boot image
 
         <NAME>.imx2:
             DESC: srt
             FILE: path (required)
+            SHA256: hex str
             MODE: <'disabled', 'merge' or 'replace'> (default: 'disabled')
             MARK: str (default: 'bootcmd=')
             EVAL: str (required if MODE is not disabled)
+            SIGN:
+                CSFT: path (required)
+                KEYS: path (default: CSFT directory)
+                TOOL: str (default: 'cst -o {output} -i {csf}')
 
         <NAME>.imx2:
             DESC: srt
@@ -45,10 +71,18 @@ class DatSegIMX2(DatSegBase):
                 IMGVER: int (default: 0x41)
                 DCDSEG: <NAME>.DCD
                 APPSEG: <NAME>.UBIN (required)
+            SIGN:
+                CSFT: path (required)
+                KEYS: path (default: CSFT directory)
+                TOOL: str (default: 'cst -o {output} -i {csf}')
     """
 
     MARK = 'imx2'
 
+    @property
+    def depends(self):
+        return [self._imx_data[key] for key in ('DCDSEG', 'APPSEG') if key in self._imx_data]
+
     def __init__(self, name, smx_data=None):
         super().__init__(name)
         self.dcd = None
@@ -56,6 +90,9 @@ class DatSegIMX2(DatSegBase):
         self._mode = 'disabled'
         self._mark = 'bootcmd='
         self._imx_data = {}
+        self._sign_data = {}
+        self._sign_base = None
+        self._csf_offset = None
         if smx_data is not None:
             self.init(smx_data)
 
@@ -77,6 +114,11 @@ class DatSegIMX2(DatSegBase):
                 if not isinstance(val, str):
                     raise InitErrorIMX("{}/FILE: Value must be a string !".format(self.full_name))
                 self.path = val
+            elif key == 'SHA256':
+                try:
+                    self.sha256 = sha256_value(val)
+                except ValueError as ex:
+                    raise InitErrorIMX("{}/SHA256: {}".format(self.full_name, str(ex)))
             elif key == 'MODE':
                 if not isinstance(val, str):
                     raise InitErrorIMX("{}/MODE: Value must be a string !".format(self.full_name))
@@ -92,6 +134,8 @@ class DatSegIMX2(DatSegBase):
                 if not isinstance(val, str):
                     raise InitErrorIMX("{}/EVAL: Value must be a string !".format(self.full_name))
                 self._eval = val
+            elif key == 'SIGN':
+                self._sign_data = parse_sign_data(self.full_name, val, InitErrorIMX)
             elif key == 'DATA':
                 if not isinstance(val, dict):
                     raise InitErrorIMX("{}/DATA: Not a dictionary !".format(self.full_name))
@@ -131,6 +175,8 @@ class DatSegIMX2(DatSegBase):
 
         if self.path is None and not self._imx_data:
             raise InitErrorIMX("{}: FILE or DATA property must be defined !".format(self.full_name))
+        if self.sha256 is not None and not isinstance(self.path, str):
+            raise InitErrorIMX("{}/SHA256: Can be used only with single FILE !".format(self.full_name))
 
     def load(self, db, root_path):
         """ load DCD segments
@@ -138,7 +184,7 @@ class DatSegIMX2(DatSegBase):
         :param root_path: ...
         """
         assert isinstance(db, list)
-        assert isinstance(root_path, str)
+        assert isinstance(root_path, (str, list))
 
         if self._imx_data:
             imx_obj = imx.img.BootImg2(address=self._imx_data['STADDR'],
@@ -150,18 +196,21 @@ class DatSegIMX2(DatSegBase):
                 self.dcd = get_data_segment(db, self._imx_data['DCDSEG']).data
                 imx_obj.dcd = imx.img.SegDCD.parse(self.dcd)
 
-            imx_obj.add_image(get_data_segment(db, self._imx_data['APPSEG']))
+            imx_obj.app = SegAPPView(get_data_segment(db, self._imx_data['APPSEG']).data)
+            # the image is exported without APP data and composed from header, APP data view and tail without
+            # concatenation
+            img_data = imx_obj.export()
+            head_size = imx_obj.ivt.space + imx_obj.bdt.space + imx_obj.dcd.space
             self.address = imx_obj.address + imx_obj.offset
-            self.data = imx_obj.export()
+            self.data = SgBuffer(img_data[:head_size], imx_obj.app.data, img_data[head_size:])
 
         else:
             img_path = get_full_path(root_path, self.path)[0]
             if self._mode == 'disabled':
-                with open(img_path, 'rb') as f:
-                    self.data = f.read()
+                self.data = read_file(img_path)
             else:
                 env_img = uboot.EnvImgOld(self._mark)
-                env_img.open_img(img_path)
+                env_img.import_img(read_file(img_path))
                 if self._mode == 'replace':
                     env_img.clear()
                 env_img.load(self._eval)
@@ -171,6 +220,37 @@ class DatSegIMX2(DatSegBase):
             self.address = imx_obj.address + imx_obj.offset
             self.dcd = imx_obj.dcd.export()
 
+    def sign_job(self, root_path):
+        """ Get signing job for loaded image
+        :param root_path: ...
+        :return: SignJob object or None if signing is not required
+        """
+        if not self._sign_data:
+            return None
+
+        # reserve the space for CSF data, any old CSF data are dropped
+        imx_obj = imx.img.BootImg2.parse(bytes(self.data))
+        imx_obj.csf = imx.img.SegCSF(enabled=True)
+        self._sign_base = imx_obj.export()
+        # the CSF is placed at address from IVT, the image data start with IVT
+        self._csf_offset = imx_obj.ivt.csf_address - imx_obj.ivt.ivt_address
+
+        return create_sign_job(self.full_name, self._sign_data, root_path, self._sign_base, imx_obj.ivt.ivt_address,
+                               self._csf_offset)
+
+    def sign_done(self, csf_data):
+        """ Insert CSF data created by signing tool
+        :param csf_data: The signing tool output
+        """
+        csf_size = imx.img.BootImg2.CSF_SIZE
+        if len(csf_data) > csf_size:
+            raise InitErrorIMX("{}: CSF data exceed reserved size {} Bytes !".format(self.full_name, csf_size))
+
+        offset = self._csf_offset
+        self.data = (self._sign_base[:offset] + csf_data + bytes(csf_size - len(csf_data)) +
+                     self._sign_base[offset + csf_size:])
+        self._sign_base = None
+
 
 class DatSegIMX2B(DatSegBase):
     """ Data segments class for i.MX8M and i.MX8Mm boot image
@@ -205,7 +285,7 @@ class DatSegIMX2B(DatSegBase):
         :param root_path: ...
         """
         assert isinstance(db, list)
-        assert isinstance(root_path, str)
+        assert isinstance(root_path, (str, list))
 
 
 class DatSegIMX3(DatSegBase):
@@ -217,6 +297,11 @@ class DatSegIMX3(DatSegBase):
             MARK: str (default: 'bootcmd=')
             EVAL: str (required if MODE not disabled)
             FILE: path (required)
+            SHA256: hex str
+            SIGN:
+                CSFT: path (required)
+                KEYS: path (default: CSFT directory)
+                TOOL: str (default: 'cst -o {output} -i {csf}')
 
         <NAME>.imx3:
             DESC: srt
@@ -232,10 +317,26 @@ class DatSegIMX3(DatSegBase):
                     - TYPE: <'SCD', 'SCFW', 'CM4-0', 'CM4-1', 'APP-A35', 'APP-A53' or 'APP-A72'>
                       ADDR: int
                       FILE: path (required)
+            SIGN:
+                CSFT: path (required)
+                KEYS: path (default: CSFT directory)
+                TOOL: str (default: 'cst -o {output} -i {csf}')
     """
 
     MARK = 'imx3'
 
+    @property
+    def depends(self):
+        return [self._imx_data['DCDSEG']] if 'DCDSEG' in self._imx_data else []
+
+    @property
+    def files(self):
+        files = [] if self.path is None else [self.path]
+        for image in self._imx_data.get('IMAGES', []):
+            if isinstance(image, dict) and 'FILE' in image:
+                files.append(image['FILE'])
+        return files
+
     def __init__(self, name, smx_data=None):
         super().__init__(name)
         self.dcd = None
@@ -243,6 +344,8 @@ class DatSegIMX3(DatSegBase):
         self._mode = 'disabled'
         self._mark = 'bootcmd='
         self._imx_data = {}
+        self._sign_data = {}
+        self._sign_base = None
         if smx_data is not None:
             self.init(smx_data)
 
@@ -264,6 +367,11 @@ class DatSegIMX3(DatSegBase):
                 if not isinstance(val, str):
                     raise InitErrorIMX("{}/FILE: Value must be a string !".format(self.full_name))
                 self.path = val
+            elif key == 'SHA256':
+                try:
+                    self.sha256 = sha256_value(val)
+                except ValueError as ex:
+                    raise InitErrorIMX("{}/SHA256: {}".format(self.full_name, str(ex)))
             elif key == 'MODE':
                 if not isinstance(val, str):
                     raise InitErrorIMX("{}/MODE: Value must be a string !".format(self.full_name))
@@ -279,6 +387,8 @@ class DatSegIMX3(DatSegBase):
                 if not isinstance(val, str):
                     raise InitErrorIMX("{}/EVAL: Value must be a string !".format(self.full_name))
                 self._eval = val
+            elif key == 'SIGN':
+                self._sign_data = parse_sign_data(self.full_name, val, InitErrorIMX)
             elif key == 'DATA':
                 if not isinstance(val, dict):
                     raise InitErrorIMX("{}/DATA: Not a dictionary !".format(self.full_name))
@@ -312,6 +422,8 @@ class DatSegIMX3(DatSegBase):
 
         if self.path is None and not self._imx_data:
             raise InitErrorIMX("{}: FILE or DATA property must be defined !".format(self.full_name))
+        if self.sha256 is not None and not isinstance(self.path, str):
+            raise InitErrorIMX("{}/SHA256: Can be used only with single FILE !".format(self.full_name))
 
     def load(self, db, root_path):
         """ load DCD segments
@@ -319,7 +431,7 @@ class DatSegIMX3(DatSegBase):
         :param root_path: ...
         """
         assert isinstance(db, list)
-        assert isinstance(root_path, str)
+        assert isinstance(root_path, (str, list))
 
         if self._imx_data:
             imx_obj = imx.img.BootImg3b(address=self._imx_data['STADDR'],
@@ -339,8 +451,8 @@ class DatSegIMX3(DatSegBase):
                         address = int(address, 0)
                     except Exception as ex:
                         raise InitErrorIMX('{}'.format(str(ex)))
-                with open(get_full_path(root_path, image['FILE'])[0], 'rb') as f:
-                    imx_obj.add_image(f.read(), img_types[image['TYPE']], address)
+                imx_obj.add_image(read_file(get_full_path(root_path, image['FILE'])[0]), img_types[image['TYPE']],
+                                  address)
 
             self.address = imx_obj.address + imx_obj.offset
             self.data = imx_obj.export()
@@ -348,11 +460,10 @@ class DatSegIMX3(DatSegBase):
         else:
             img_path = get_full_path(root_path, self.path)[0]
             if self._mode == 'disabled':
-                with open(img_path, 'rb') as f:
-                    self.data = f.read()
+                self.data = read_file(img_path)
             else:
                 env_img = uboot.EnvImgOld(self._mark)
-                env_img.open_img(img_path)
+                env_img.import_img(read_file(img_path))
                 if self._mode == 'replace':
                     env_img.clear()
                 env_img.load(self._eval)
@@ -361,3 +472,20 @@ class DatSegIMX3(DatSegBase):
             imx_obj = imx.img.BootImg3b.parse(self.data)
             self.address = imx_obj.address + imx_obj.offset
             self.dcd = imx_obj.dcd.export()
+
+    def sign_job(self, root_path):
+        """ Get signing job for loaded image
+        :param root_path: ...
+        :return: SignJob object or None if signing is not required
+        """
+        if not self._sign_data:
+            return None
+
+        return create_sign_job(self.full_name, self._sign_data, root_path, bytes(self.data), self.address,
+                               len(self.data))
+
+    def sign_done(self, img_data):
+        """ Replace image with signed one created by signing tool
+        :param img_data: The signing tool output
+        """
+        self.data = img_data
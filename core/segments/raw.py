@@ -5,7 +5,10 @@
 # or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
 
 
-from .base import DatSegBase, get_full_path
+import os
+
+from .digest import sha256_value
+from .base import DatSegBase, FileStream, get_full_path, load_file
 
 
 class InitErrorRAW(Exception):
@@ -20,6 +23,7 @@ class DatSegRAW(DatSegBase):
             DESC: srt
             ADDR: int
             FILE: path (required)
+            SHA256: hex str
     """
 
     MARK = 'raw'
@@ -55,6 +59,11 @@ class DatSegRAW(DatSegBase):
                 if not isinstance(val, str):
                     raise InitErrorRAW("{}/FILE: Value must be a string !".format(self.full_name))
                 self.path = val
+            elif key == 'SHA256':
+                try:
+                    self.sha256 = sha256_value(val)
+                except ValueError as ex:
+                    raise InitErrorRAW("{}/SHA256: {}".format(self.full_name, str(ex)))
             else:
                 raise InitErrorRAW("{}: Not supported property name \"{}\" !".format(self.full_name, key))
 
@@ -68,7 +77,9 @@ class DatSegRAW(DatSegBase):
         :return:
         """
         assert isinstance(db, list)
-        assert isinstance(root_path, str)
+        assert isinstance(root_path, (str, list))
 
-        with open(get_full_path(root_path, self.path)[0], 'rb') as f:
-            self.data = f.read()
+        file_path = get_full_path(root_path, self.path)[0]
+        # regular files are streamed to target (the pinned digest is checked again during transfer), the archive members
+        # are loaded
+        self.data = FileStream(file_path, self.sha256) if os.path.isfile(file_path) else load_file(file_path)
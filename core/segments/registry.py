@@ -0,0 +1,137 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import sys
+import threading
+import importlib
+import importlib.util
+
+# Entry points group of data segment plugins: <type mark> = <module>:<class>
+SEGMENTS_ENTRY_POINTS = 'imxsb.segments'
+
+# The list of plugin directories separated by os.pathsep, every plugin is a module file named <type mark>.py
+SEGMENTS_PLUGIN_PATH_ENV = 'IMXSB_PLUGIN_PATH'
+
+# Default plugin directory
+SEGMENTS_PLUGIN_DIR = os.path.join(os.path.expanduser('~'), '.config', 'imxsb', 'plugins')
+
+# Built-in data segment types: {<type mark>: <module>:<class>}
+_builtin = {
+    'dcd': __package__ + '.dcd:DatSegDCD',
+    'fdt': __package__ + '.fdt:DatSegFDT',
+    'imx2': __package__ + '.imx:DatSegIMX2',
+    'imx2b': __package__ + '.imx:DatSegIMX2B',
+    'imx3': __package__ + '.imx:DatSegIMX3',
+    'ubi': __package__ + '.uboot:DatSegUBI',
+    'ubx': __package__ + '.uboot:DatSegUBX',
+    'ubt': __package__ + '.uboot:DatSegUBT',
+    'raw': __package__ + '.raw:DatSegRAW',
+}
+
+# Registered data segment types: {<type mark>: class, <module>:<class>, entry point or plugin file path}
+_registry = dict(_builtin)
+_registry_lock = threading.RLock()
+_discovered = False
+
+
+class RegistryError(Exception):
+    """Thrown when data segment type is not supported or its plugin is not valid"""
+    pass
+
+
+def register_segment(mark, target):
+    """ Register data segment type
+    :param mark: The type mark (extension in segment name)
+    :param target: The DatSeg* class or its location as "<module>:<class>" string which is imported on first use
+    """
+    assert isinstance(mark, str)
+    with _registry_lock:
+        _registry[mark.lower()] = target
+
+
+def _discover():
+    global _discovered
+    if _discovered:
+        return
+    _discovered = True
+
+    # plugins from entry points of installed packages, the built-in types have priority
+    try:
+        from importlib.metadata import entry_points
+        eps = entry_points()
+        eps = eps.select(group=SEGMENTS_ENTRY_POINTS) if hasattr(eps, 'select') else eps.get(SEGMENTS_ENTRY_POINTS, [])
+        for ep in eps:
+            _registry.setdefault(ep.name.lower(), ep)
+    except ImportError:
+        pass
+
+    # plugins from directories
+    dirs = os.environ.get(SEGMENTS_PLUGIN_PATH_ENV, '').split(os.pathsep) + [SEGMENTS_PLUGIN_DIR]
+    for plugin_dir in dirs:
+        if not plugin_dir or not os.path.isdir(plugin_dir):
+            continue
+        for name in sorted(os.listdir(plugin_dir)):
+            mark, ext = os.path.splitext(name)
+            if ext == '.py' and not mark.startswith('_'):
+                _registry.setdefault(mark.lower(), os.path.join(plugin_dir, name))
+
+
+def _import(mark, target):
+    if isinstance(target, type):
+        return target
+    if isinstance(target, str) and target.endswith('.py'):
+        # module file from plugin directory
+        module_name = 'imxsb_plugin_' + mark
+        spec = importlib.util.spec_from_file_location(module_name, target)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+        from .base import DatSegBase
+        for value in vars(module).values():
+            if isinstance(value, type) and issubclass(value, DatSegBase) and value.MARK == mark:
+                return value
+        raise RegistryError("Plugin {} doesn't contain data segment class with MARK = '{}'".format(target, mark))
+    if isinstance(target, str):
+        module_name, class_name = target.split(':')
+        return getattr(importlib.import_module(module_name), class_name)
+    # entry point
+    return target.load()
+
+
+def get_segment_class(mark):
+    """ Get data segment class, its module is imported on first use
+    :param mark: The type mark (extension in segment name)
+    :return: DatSeg* class
+    """
+    mark = mark.lower()
+    with _registry_lock:
+        if mark not in _registry:
+            _discover()
+        if mark not in _registry:
+            raise RegistryError("Not supported data segments type: {}".format(mark))
+        target = _registry[mark]
+        if isinstance(target, type):
+            return target
+        try:
+            cls = _import(mark, target)
+        except RegistryError:
+            raise
+        except Exception as e:
+            raise RegistryError("Data segments type {}: {}".format(mark, str(e)))
+        if getattr(cls, 'MARK', None) != mark:
+            raise RegistryError("Data segments type {}: Class {} has not MARK = '{}'".format(mark, cls.__name__, mark))
+        _registry[mark] = cls
+        return cls
+
+
+def segment_types():
+    """ Get marks of all registered data segment types (including plugins)
+    :return: list of strings
+    """
+    with _registry_lock:
+        _discover()
+        return sorted(_registry.keys())
@@ -4,9 +4,11 @@
 # The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
 # or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
 
-
+import os
+import re
 import uboot
-from .base import DatSegBase, get_full_path
+from .digest import sha256_value
+from .base import DatSegBase, get_full_path, load_file, read_file
 
 
 class InitErrorUBI(Exception):
@@ -24,6 +26,10 @@ class InitErrorUBT(Exception):
     pass
 
 
+# The path of file included into ITS: /incbin/("<path>"[, <offset>[, <size>]])
+INCBIN_PATH = re.compile(r'(/incbin/\(\s*")([^"]*)(")')
+
+
 class DatSegUBI(DatSegBase):
     """ Data segments class for old U-Boot main image
 
@@ -31,6 +37,7 @@ class DatSegUBI(DatSegBase):
             DESC: srt
             ADDR: int
             FILE: path (required)
+            SHA256: hex str
             MODE: <'disabled', 'merge' or 'replace'> (default: 'disabled')
             MARK: str (default: 'bootcmd=')
             EVAL: str (required if MODE is not disabled)
@@ -73,6 +80,11 @@ class DatSegUBI(DatSegBase):
                 if not isinstance(val, str):
                     raise InitErrorUBI("{}/FILE: Value must be a string !".format(self.full_name))
                 self.path = val
+            elif key == 'SHA256':
+                try:
+                    self.sha256 = sha256_value(val)
+                except ValueError as ex:
+                    raise InitErrorUBI("{}/SHA256: {}".format(self.full_name, str(ex)))
             elif key == 'MODE':
                 if not isinstance(val, str):
                     raise InitErrorUBI("{}/MODE: Value must be a string !".format(self.full_name))
@@ -103,14 +115,13 @@ class DatSegUBI(DatSegBase):
         :return:
         """
         assert isinstance(db, list)
-        assert isinstance(root_path, str)
+        assert isinstance(root_path, (str, list))
 
         if self._mode == 'disabled':
-            with open(get_full_path(root_path, self.path)[0], 'rb') as f:
-                self.data = f.read()
+            self.data = load_file(get_full_path(root_path, self.path)[0])
         else:
             img_obj = uboot.EnvImgOld(self._mark)
-            img_obj.open_img(get_full_path(root_path, self.path)[0])
+            img_obj.import_img(read_file(get_full_path(root_path, self.path)[0]))
             if self._mode == 'replace':
                 img_obj.clear()
             img_obj.load(self._eval)
@@ -133,6 +144,7 @@ class DatSegUBX(DatSegBase):
                 os: "openbsd", "netbsd", "freebsd", "bsd4", "linux", ... (default: "linux")
                 compress: "none", "gzip", "bzip2", "lzma", "lzo", "lz4" (default: "none")
             <DATA or PATH>: str (required)
+            SHA256: hex str
     """
 
     MARK = 'ubx'
@@ -170,6 +182,11 @@ class DatSegUBX(DatSegBase):
                 if not isinstance(val, (str, list)):
                     raise InitErrorUBX("{}/FILE: Value must be a string !".format(self.full_name))
                 self.path = val
+            elif key == 'SHA256':
+                try:
+                    self.sha256 = sha256_value(val)
+                except ValueError as ex:
+                    raise InitErrorUBX("{}/SHA256: {}".format(self.full_name, str(ex)))
             elif key == 'DATA':
                 if not isinstance(val, str):
                     raise InitErrorUBX("{}/DATA: Value must be a string !".format(self.full_name))
@@ -186,6 +203,8 @@ class DatSegUBX(DatSegBase):
 
         if self.path is None and self._txt_data is None:
             raise InitErrorUBX("{} FILE or DATA property must be defined !".format(self.full_name))
+        if self.sha256 is not None and not isinstance(self.path, str):
+            raise InitErrorUBX("{}/SHA256: Can be used only with single FILE !".format(self.full_name))
 
     def load(self, db, root_path):
         """ Load content
@@ -194,25 +213,21 @@ class DatSegUBX(DatSegBase):
         :return:
         """
         assert isinstance(db, list)
-        assert isinstance(root_path, str)
+        assert isinstance(root_path, (str, list))
 
         img_obj = uboot.new_img(**self._header)
         if img_obj.header.image_type == uboot.EnumImageType.FIRMWARE:
-            with open(get_full_path(root_path, self.path)[0], 'rb') as f:
-                img_obj.data = f.read()
+            img_obj.data = read_file(get_full_path(root_path, self.path)[0])
         elif img_obj.header.image_type == uboot.EnumImageType.SCRIPT:
             if self.path is None:
                 img_obj.load(self._txt_data)
             else:
-                with open(get_full_path(root_path, self.path)[0], 'r') as f:
-                    img_obj.load(f.read())
+                img_obj.load(read_file(get_full_path(root_path, self.path)[0], True))
         elif img_obj.header.image_type == uboot.EnumImageType.MULTI:
-            for img_path in get_full_path(root_path, self.path):
-                with open(img_path, 'rb') as f:
-                    img_obj.append(uboot.parse_img(f.read()))
+            for img_path in get_full_path(root_path, *(self.path if isinstance(self.path, list) else [self.path])):
+                img_obj.append(uboot.parse_img(read_file(img_path)))
         else:
-            with open(get_full_path(root_path, self.path)[0], 'rb') as f:
-                img_obj.data = f.read()
+            img_obj.data = read_file(get_full_path(root_path, self.path)[0])
 
         self.data = img_obj.export()
 
@@ -224,6 +239,7 @@ class DatSegUBT(DatSegBase):
             DESC: srt
             ADDR: int
             FILE: path (required)
+            SHA256: hex str
 
         <NAME>.ubt:
             DESC: srt
@@ -233,6 +249,13 @@ class DatSegUBT(DatSegBase):
 
     MARK = 'ubt'
 
+    @property
+    def files(self):
+        files = [] if self.path is None else [self.path]
+        if self._its_data is not None:
+            files += [m.group(2) for m in INCBIN_PATH.finditer(self._its_data)]
+        return files
+
     def __init__(self, name, smx_data=None):
         super().__init__(name)
         self._its_data = None
@@ -265,6 +288,11 @@ class DatSegUBT(DatSegBase):
                 if not isinstance(val, str):
                     raise InitErrorUBT("{}/FILE: Value must be a string !".format(self.full_name))
                 self.path = val
+            elif key == 'SHA256':
+                try:
+                    self.sha256 = sha256_value(val)
+                except ValueError as ex:
+                    raise InitErrorUBT("{}/SHA256: {}".format(self.full_name, str(ex)))
             elif key == 'DATA':
                 if not isinstance(val, str):
                     raise InitErrorUBT("{}/DATA: Value must be a string !".format(self.full_name))
@@ -274,6 +302,8 @@ class DatSegUBT(DatSegBase):
 
         if self.path is None and self._its_data is None:
             raise InitErrorUBT("{} FILE or DATA property must be defined !".format(self.full_name))
+        if self.sha256 is not None and not isinstance(self.path, str):
+            raise InitErrorUBT("{}/SHA256: Can be used only with single FILE !".format(self.full_name))
 
     def load(self, db, root_path):
         """ Load content
@@ -282,7 +312,21 @@ class DatSegUBT(DatSegBase):
         :return:
         """
         assert isinstance(db, list)
-        assert isinstance(root_path, str)
-
-        ftd_obj = uboot.parse_its(self._its_data, root_path)
+        assert isinstance(root_path, (str, list))
+
+        roots = [root_path] if isinstance(root_path, str) else list(root_path)
+        its_data = self._its_data
+        if its_data is None:
+            its_path = get_full_path(roots, self.path)[0]
+            its_data = read_file(its_path, True)
+            # the files included into ITS file are searched in its directory first
+            roots.insert(0, os.path.dirname(its_path))
+
+        # the included files are resolved by search roots like the files of other data segments
+        try:
+            its_data = INCBIN_PATH.sub(lambda m: m.group(1) + get_full_path(roots, m.group(2))[0] + m.group(3),
+                                       its_data)
+        except Exception as ex:
+            raise InitErrorUBT("{}: {}".format(self.full_name, str(ex)))
+        ftd_obj = uboot.parse_its(its_data)
         self.data = ftd_obj.to_itb()
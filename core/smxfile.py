@@ -6,13 +6,27 @@
 
 
 import os
-import imx
-import yaml
-import jinja2
+import hashlib
+import weakref
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 # internals
-from .segments import DatSegFDT, DatSegDCD, DatSegIMX2, DatSegIMX2B, DatSegIMX3, DatSegRAW, DatSegUBI, \
-                      DatSegUBX, DatSegUBT
+from .segments.hab import sign_images, HAB_CACHE_DIR
+from .segments.base import SgBuffer, read_file, get_data_segment, get_full_path, is_stream, data_buffers
+from .segments.archive import split_archive_path, open_archive, close_archive
+from .segments.artifacts import prefetch_artifacts
+from .segments.registry import get_segment_class
+from .store import SegmentStore
+from .readahead import Readahead
+
+
+# The types of boot images which are built from other data segments
+BOOT_IMAGES = ('imx2', 'imx2b', 'imx3')
+
+# Max size of DCD data accepted by boot ROM
+DCD_MAX_SIZE = 1768
 
 
 def fmt_size(num, kibibyte=True):
@@ -29,6 +43,245 @@ class ParseError(Exception):
     pass
 
 
+def file_key(path):
+    """ Get identity of file from its metadata, the content of file isn't read
+    :param path: The file path or path of archive member
+    :return: string
+    """
+    archive_path, _ = split_archive_path(path)
+    try:
+        stat = os.stat(path if archive_path is None else archive_path)
+    except OSError:
+        return path
+    return "{}:{}:{}".format(path, stat.st_size, stat.st_mtime_ns)
+
+
+def smx_files(smx_data):
+    """ Collect all file references from DATA section of SMX file
+    :param smx_data: The DATA section content
+    :return: list of paths
+    """
+    files = []
+    if isinstance(smx_data, dict):
+        for key, value in smx_data.items():
+            if key in ('FILE', 'CSFT', 'KEYS') and isinstance(value, str):
+                files.append(value)
+            elif key == 'FILE' and isinstance(value, list):
+                files += [item for item in value if isinstance(item, str)]
+            else:
+                files += smx_files(value)
+    elif isinstance(smx_data, list):
+        for value in smx_data:
+            files += smx_files(value)
+    return files
+
+
+class DeferredData(object):
+    """ Data of boot command which are prepared on demand (lazy boot plan)
+
+        The length is only estimation of data size until the data are prepared.
+    """
+
+    __slots__ = ('_loader', '_size')
+
+    def __init__(self, loader, size=0):
+        """ Init DeferredData
+        :param loader: The callback which returns the data
+        :param size: The estimated size of data
+        """
+        self._loader = loader
+        self._size = size
+
+    def __len__(self):
+        return self._size
+
+    def prepare(self):
+        """ Load or build the data
+        :return: The data
+        """
+        return self._loader()
+
+
+class FoldedDCD(bytes):
+    """ DCD data synthesized from register writes (see fold_wregs())
+
+        The original wreg commands are kept, so that they can be written one by one if the target rejects the DCD.
+    """
+
+    def __new__(cls, data, wregs):
+        """ Init FoldedDCD
+        :param data: The DCD data
+        :param wregs: The list of folded wreg commands (BootCmd)
+        """
+        obj = super().__new__(cls, data)
+        obj.wregs = tuple(wregs)
+        return obj
+
+
+class BootCmd(namedtuple('BootCmd', 'name address value bytes data description')):
+    """ Resolved boot command (immutable)
+
+        name:        'wreg', 'wdcd', 'wimg', 'sdcd' or 'jrun'
+        address:     int or None
+        value:       int or None (wreg only)
+        bytes:       int or None (wreg only)
+        data:        read-only data, DeferredData or None (wdcd and wimg only)
+        description: str
+    """
+    __slots__ = ()
+
+
+class BootPlan(object):
+    """ Immutable snapshot of fully resolved boot script
+
+        The plan holds direct references to data segments content, therefore it's not affected by later changes in
+        SmxFile and can be shared by any number of concurrent workers without locking. The per-run state (progress,
+        ...) must be kept outside of it.
+    """
+
+    __slots__ = ('_name', '_description', '_platform', '_cmds', '_saved', '_key', '__weakref__')
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def description(self):
+        return self._description
+
+    @property
+    def platform(self):
+        return self._platform
+
+    @property
+    def data_size(self):
+        return sum(len(cmd.data) for cmd in self._cmds if cmd.data is not None)
+
+    @property
+    def saved_round_trips(self):
+        """ The count of target transactions saved by merging of commands """
+        return self._saved
+
+    @property
+    def key(self):
+        """ The identity of plan sources (files and settings) or None if not known """
+        return self._key
+
+    def __init__(self, name, description, platform, cmds, saved_round_trips=0, key=None):
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_description', description)
+        object.__setattr__(self, '_platform', platform)
+        object.__setattr__(self, '_cmds', tuple(cmds))
+        object.__setattr__(self, '_saved', saved_round_trips)
+        object.__setattr__(self, '_key', key)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("BootPlan is immutable")
+
+    def __str__(self):
+        return "{} ({})".format(self._name, self._description)
+
+    def __len__(self):
+        return len(self._cmds)
+
+    def __getitem__(self, key):
+        return self._cmds[key]
+
+    def __iter__(self):
+        return self._cmds.__iter__()
+
+    def pg_steps(self, value):
+        """ Split progress range between commands by size of its data
+        :param value: The progress range
+        :return: tuple with progress step for every command
+        """
+        data_cnt = sum(1 for cmd in self._cmds if cmd.data is not None)
+        data_size = self.data_size
+        steps = int(value / 100)
+        point = (value - (len(self._cmds) - data_cnt) * steps) / data_size if data_size else 0
+        return tuple(steps if cmd.data is None else int(len(cmd.data) * point) for cmd in self._cmds)
+
+
+def coalesce_writes(cmds, sources, max_gap=0):
+    """ Merge consecutive image writes into adjacent memory into single write
+    :param cmds: The list of BootCmd
+    :param sources: The list of image names for every command, None if the command can not be merged
+    :param max_gap: The max gap in bytes between merged images (0 merges only exactly adjacent images)
+    :return: tuple of BootCmd
+
+    Only the writes with ascending and not overlapping address ranges are merged, so the images are written into
+    the same memory, but the gap between them is overwritten by zeros. The data are merged into SgBuffer without
+    copying. The images streamed from file are never merged, they are written by chunks which don't cross the image
+    boundary, so the merge wouldn't save any transaction. Every merge saves one write transaction if the merged data
+    are written at once (see ChunkedTransfer.split()).
+    """
+    ret = []
+    names = []
+    for cmd, source in zip(cmds, sources):
+        if source is not None and is_stream(cmd.data):
+            source = None
+        if source is not None and names:
+            last = ret[-1]
+            gap = cmd.address - (last.address + len(last.data))
+            if 0 <= gap <= max_gap:
+                data = SgBuffer(last.data, bytes(gap), cmd.data)
+                names.append(source)
+                description = 'Write images: {} ({})'.format(', '.join(names), fmt_size(len(data)))
+                ret[-1] = last._replace(data=data, description=description)
+                continue
+        names = [] if source is None else [source]
+        ret.append(cmd)
+    return tuple(ret)
+
+
+def fold_wregs(cmds, dcd_address=None):
+    """ Fold runs of register writes before the first image write or jump into DCD writes
+    :param cmds: The list of BootCmd
+    :param dcd_address: The address for DCD data (default: address of the first wdcd command)
+    :return: tuple of BootCmd
+
+    Every run of consecutive wreg commands is replaced by single wdcd command with synthesized DCD WriteData block,
+    which executes the writes in the same order (the serial downloader writes registers always as 32-bit value). If the
+    DCD address is not known, the wreg commands are kept as they are. The DCD data keep the original commands (see
+    FoldedDCD), the boot engine writes them one by one if the target rejects the DCD.
+    """
+    if dcd_address is None:
+        dcd_address = next((cmd.address for cmd in cmds if cmd.name == 'wdcd'), None)
+    if dcd_address is None:
+        return tuple(cmds)
+
+    import imx
+    # DCD header and WriteData command header are 4 bytes, every write is 8 bytes
+    max_writes = (DCD_MAX_SIZE - 8) // 8
+    ret = []
+    run = []
+
+    def flush():
+        if len(run) > 1:
+            dcd = imx.img.SegDCD(enabled=True)
+            dcd.append(imx.img.CmdWriteData(4, imx.img.EnumWriteOps.WRITE_VALUE,
+                                            [(cmd.address, cmd.value) for cmd in run]))
+            ret.append(BootCmd('wdcd', dcd_address, None, None, FoldedDCD(dcd.export(), run),
+                               'Write {} registers by DCD at address: 0x{:08X}'.format(len(run), dcd_address)))
+        else:
+            ret.extend(run)
+        run.clear()
+
+    for index, cmd in enumerate(cmds):
+        if cmd.name in ('wimg', 'jrun'):
+            flush()
+            return tuple(ret) + tuple(cmds[index:])
+        if cmd.name == 'wreg':
+            run.append(cmd)
+            if len(run) == max_writes:
+                flush()
+            continue
+        flush()
+        ret.append(cmd)
+    flush()
+    return tuple(ret)
+
+
 class SmxScript(object):
 
     def __init__(self, name, description, smx_data=None):
@@ -63,6 +316,20 @@ class SmxScript(object):
     def __iter__(self):
         return self._cmds.__iter__()
 
+    @property
+    def loaded(self):
+        return self._loaded
+
+    @property
+    def segments(self):
+        """ The full names of data segments used by this script (upper case) """
+        names = set()
+        for cmd in self._cmds:
+            if 'data_segment' in cmd:
+                name, ext = cmd['data_segment'].split('.')
+                names.add('{}.{}'.format(name, ext.split('/')[0]).upper())
+        return names
+
     def info(self):
         pass
 
@@ -147,7 +414,7 @@ class SmxScript(object):
                 else:
                     ext = [ext]
 
-                if cmd['name'] == 'wdcd' and ext[0].lower() != DatSegDCD.MARK:
+                if cmd['name'] == 'wdcd' and ext[0].lower() != 'dcd':
                     if len(line) < 3:
                         raise Exception("Command {} must have specified address value ".format(line[0]))
 
@@ -161,17 +428,31 @@ class SmxScript(object):
 
             self._cmds.append(cmd)
 
-    def load(self, db):
-        """
-        :param db:
-        :return:
+    def resolve(self, db, loader=None, size_hint=None, coalesce=None, fold=False, dcd_address=None):
+        """ Resolve commands with data segments
+        :param db: The list of data segments
+        :param loader: The callback for loading of data segment on demand: loader(item) -> item (lazy resolving)
+        :param size_hint: The callback for estimation of not loaded data segment size: size_hint(item) -> int
+        :param coalesce: The max gap in bytes between merged image writes (None is disabled)
+        :param fold: Fold register writes into DCD writes (see fold_wregs())
+        :param dcd_address: The address for DCD data of folded register writes
+        :return: tuple of BootCmd
+
+        If the loader is specified, the data of not loaded data segments are resolved as DeferredData. If coalesce is
+        specified, the consecutive writes of images into adjacent memory are merged into single write (see
+        coalesce_writes()).
         """
+        cmds = []
+        # the names of images which can be merged with adjacent ones
+        sources = []
         for cmd in self._cmds:
+            sources.append(None)
+            address = cmd.get('address')
+            description = cmd.get('description', '')
+            data = None
 
-            if cmd['name'] in ('sdcd', 'wreg'):
-                continue
-
-            if cmd['name'] == 'jrun' and 'address' in cmd:
+            if cmd['name'] == 'jrun' and 'address' in cmd or cmd['name'] in ('sdcd', 'wreg'):
+                cmds.append(BootCmd(cmd['name'], address, cmd.get('value'), cmd.get('bytes'), None, description))
                 continue
 
             name, ext = cmd['data_segment'].split('.')
@@ -187,41 +468,67 @@ class SmxScript(object):
                     break
 
             if image is None:
-                raise Exception("...")
+                raise Exception("Data segment \"{}\" doesn't exist !".format(cmd['data_segment']))
+
+            lazy = loader is not None and not image.loaded
+            if lazy and address is None and image.address is None:
+                # the address is known only from loaded data segment
+                loader(image)
+                lazy = False
 
-            if 'address' not in cmd:
-                cmd['address'] = image.address
+            if address is None:
+                address = image.address
 
             if cmd['name'] == 'jrun':
-                cmd['description'] = "Boot from address: 0x{:08X}".format(cmd['address'])
+                description = "Boot from address: 0x{:08X}".format(address)
 
-            if cmd['name'] == 'wdcd':
-                if ext[0].lower() in (DatSegIMX2.MARK, DatSegIMX2B.MARK, DatSegIMX3.MARK):
-                    cmd['data'] = image.dcd
+            if cmd['name'] in ('wdcd', 'wimg'):
+                attr = 'dcd' if cmd['name'] == 'wdcd' and ext[0].lower() in BOOT_IMAGES else 'data'
+                if lazy:
+                    size = 0 if size_hint is None else size_hint(image)
+                    data = DeferredData(lambda image=image, attr=attr: getattr(loader(image), attr), size)
                 else:
-                    cmd['data'] = image.data
-                cmd['description'] = 'Write DCD from: {} ({})'.format(image.name if image.path is None else image.path,
-                                                                      fmt_size(len(cmd['data'])))
-            if cmd['name'] == 'wimg':
-                cmd['data'] = image.data
-                cmd['description'] = 'Write image: {} ({})'.format(image.name if image.path is None else image.path,
-                                                                   fmt_size(len(cmd['data'])))
+                    data = getattr(image, attr)
+
+            if cmd['name'] in ('wdcd', 'wimg'):
+                # the size of deferred data is shown only if it's known from source files
+                size = " ({})".format(fmt_size(len(data))) if not lazy or len(data) else ""
+                description = '{}: {}{}'.format('Write DCD from' if cmd['name'] == 'wdcd' else 'Write image',
+                                                image.name if image.path is None else image.path, size)
+
+            if cmd['name'] == 'wimg' and not lazy and ext[0].lower() not in BOOT_IMAGES:
+                sources[-1] = image.name if image.path is None else image.path
+
+            cmds.append(BootCmd(cmd['name'], address, None, None, data, description))
+
+        if coalesce is not None:
+            cmds = coalesce_writes(cmds, sources, coalesce)
+        if fold:
+            cmds = fold_wregs(cmds, dcd_address)
+        return tuple(cmds)
+
+    def load(self, db):
+        """
+        :param db:
+        :return:
+        """
+        for cmd, boot_cmd in zip(self._cmds, self.resolve(db)):
+            if boot_cmd.address is not None:
+                cmd['address'] = boot_cmd.address
+            if boot_cmd.data is not None:
+                cmd['data'] = boot_cmd.data
+            cmd['description'] = boot_cmd.description
         self._loaded = True
 
+    def unload(self):
+        """ Drop references to data segments content """
+        for cmd in self._cmds:
+            cmd.pop('data', None)
+            cmd.pop('pg', None)
+        self._loaded = False
 
-class SmxFile(object):
 
-    data_segments = {
-        DatSegDCD.MARK: DatSegDCD,
-        DatSegFDT.MARK: DatSegFDT,
-        DatSegIMX2.MARK: DatSegIMX2,
-        DatSegIMX2B.MARK: DatSegIMX2B,
-        DatSegIMX3.MARK: DatSegIMX3,
-        DatSegUBI.MARK: DatSegUBI,
-        DatSegUBX.MARK: DatSegUBX,
-        DatSegUBT.MARK: DatSegUBT,
-        DatSegRAW.MARK: DatSegRAW
-    }
+class SmxFile(object):
 
     @property
     def name(self):
@@ -243,14 +550,61 @@ class SmxFile(object):
     def path(self):
         return self._path
 
-    def __init__(self, file=None, auto_load=False):
+    @property
+    def roots(self):
+        """ The ordered list of search roots for data segment files """
+        return self._roots
+
+    @property
+    def warmed_up(self):
+        return self._plans is not None
+
+    @property
+    def mem_budget(self):
+        return self._store.budget
+
+    @mem_budget.setter
+    def mem_budget(self, value):
+        self._store.budget = value
+
+    def __init__(self, file=None, auto_load=False, sign_cache=HAB_CACHE_DIR, sign_workers=None, release_inputs=True,
+                 mem_budget=None, search_paths=None, verify_workers=None, readahead=False, load_workers=None,
+                 lazy_load=False, coalesce_gap=None, fold_wreg=False, dcd_address=None):
+        # public
+        self.search_paths = [] if search_paths is None else list(search_paths)
+        self.sign_cache = sign_cache
+        self.sign_workers = sign_workers
+        self.release_inputs = release_inputs
+        self.verify_workers = verify_workers
+        self.readahead = readahead
+        self.load_workers = load_workers
+        self.lazy_load = lazy_load
+        self.coalesce_gap = coalesce_gap
+        self.fold_wreg = fold_wreg
+        self.dcd_address = dcd_address
         # private
+        self._lock = threading.RLock()
+        self._store = SegmentStore(mem_budget, self._reload)
+        self._readahead = None
+        self._events = {}
+        # errors of data segments not loaded by load_async(): {<full name>: exception}
+        self._load_errors = {}
+        # memoized plans of all scripts (warm-up)
+        self._plans = None
+        # data segments pinned by loaded script (see get_script())
+        self._script_pins = []
+        # incremented by every open(), so that the warm-up of previous file is discarded
+        self._generation = 0
         self._name = ""
         self._description = ""
         self._platform = None
+        self._file = None
         self._path = None
+        self._roots = []
         self._data = []
         self._body = []
+        # path of archive opened for this SMX file
+        self._archive = None
         # init
         if file is not None:
             self.open(file, auto_load)
@@ -266,9 +620,36 @@ class SmxFile(object):
         """
         assert isinstance(file, str)
 
+        # the running background warm-up of previous file doesn't memoize its plans
+        self._generation += 1
+        with self._lock:
+            self._open(file, auto_load)
+
+    def _open(self, file, auto_load=False):
+
+        # the heavy modules are imported on first use
+        import imx
+        import yaml
+        import jinja2
+
+        # open SMX file inside zip or tar archive: <archive path>[/<member name>]
+        archive_path, member = split_archive_path(file)
+        if self._archive is not None and self._archive != archive_path:
+            self.close()
+        if archive_path is not None:
+            archive = open_archive(archive_path)
+            self._archive = archive_path
+            if not member:
+                members = [name for name in archive.names() if name.lower().endswith('.smx')]
+                if len(members) != 1:
+                    raise Exception("Archive must contain exactly one SMX file or it must be specified: %s" % file)
+                member = members[0]
+            if member not in archive:
+                raise Exception("SMX file \"%s\" doesn't exist inside archive: %s" % (member, archive_path))
+            file = archive.member_path(member)
+
         # open core file
-        with open(file, 'r') as f:
-            txt_data = f.read()
+        txt_data = read_file(file, True)
 
         # load core file
         smx_data = yaml.load(txt_data)
@@ -282,7 +663,8 @@ class SmxFile(object):
         #   raise Exception("Some variables are not defined !")
 
         # set absolute path to core file
-        self._path = os.path.abspath(os.path.dirname(file))
+        self._file = os.path.abspath(file)
+        self._path = os.path.dirname(self._file)
 
         # validate segments in core file
         if 'HEAD' not in smx_data:
@@ -301,10 +683,26 @@ class SmxFile(object):
         self._description = smx_data['HEAD']['DESC'] if 'DESC' in smx_data['HEAD'] else ""
         self._platform = smx_data['HEAD']['CHIP']
 
+        # ordered list of search roots: SMX file directory, HEAD paths (relative to SMX file) and external paths
+        head_paths = smx_data['HEAD'].get('PATH', [])
+        if isinstance(head_paths, str):
+            head_paths = [head_paths]
+        self._roots = [self._path]
+        for path in head_paths + self.search_paths:
+            path = os.path.normpath(os.path.join(self._path, os.path.expanduser(path)))
+            if path not in self._roots:
+                self._roots.append(path)
+
         # clear all data
+        self._plans = None
+        self._store.clear()
+        self._script_pins = []
         self._data = []
         self._body = []
 
+        # start concurrent download of artifacts from stores
+        prefetch_artifacts(smx_files(smx_data['DATA']))
+
         # parse data segments
         for full_name, data in smx_data['DATA'].items():
             try:
@@ -312,11 +710,9 @@ class SmxFile(object):
             except ValueError:
                 raise Exception("Not supported data segments format: {}".format(full_name))
             # case tolerant type
-            item_type = item_type.lower()
-            if item_type not in self.data_segments.keys():
-                raise Exception("Not supported data segments type: {}".format(item_type))
-
-            self._data.append(self.data_segments[item_type](item_name, data))
+            item = get_segment_class(item_type)(item_name, data)
+            item.store = self._store
+            self._data.append(item)
 
         # parse scripts
         for item in smx_data['BODY']:
@@ -327,21 +723,400 @@ class SmxFile(object):
 
             self._body.append(SmxScript(item['NAME'], item['DESC'], item['CMDS']))
 
-        if auto_load:
+        # start reading of referenced files into page cache while the user is choosing a script
+        if self._readahead is not None:
+            self._readahead.stop()
+            self._readahead = None
+        if self.readahead:
+            files = []
+            for item in self._data:
+                files += item.files
+            self._readahead = Readahead(self._roots, files)
+            self._readahead.start()
+
+        if auto_load and not self.lazy_load:
             self.load()
 
+    def close(self):
+        """ Drop loaded data and close the archive of SMX file """
+        self._generation += 1
+        with self._lock:
+            self._plans = None
+            self._store.clear()
+            self._script_pins = []
+            for item in self._data:
+                item.data = None
+            if self._archive is not None:
+                close_archive(self._archive)
+                self._archive = None
+
     def load(self):
-        # load simple data segments
+        with self._lock:
+            self._load()
+
+    def _load(self, executor=None, done=None):
+        self._plans = None
+
+        # verify pinned hashes of source files in parallel with loading of data segments
+        pinned = [item for item in self._data if item.sha256 is not None]
+        checks = []
+        try:
+            if pinned:
+                with ThreadPoolExecutor(self.verify_workers) as verify_executor:
+                    checks = [verify_executor.submit(item.verify, self._roots) for item in pinned]
+                    self._load_segments(executor, done)
+            else:
+                self._load_segments(executor, done)
+        finally:
+            # the data of not verified segments must never be used, they are loaded and checked again on next access
+            failed = [item for item, check in zip(pinned, checks) if check.exception() is not None]
+            if failed:
+                self._discard(failed)
+        for check in checks:
+            check.result()
+
+        # sign boot images, the unchanged ones are taken from signatures cache
+        self._sign(self._data)
+        if done is not None:
+            for item in self._data:
+                if self._is_composite(item):
+                    done(item)
+
+        # release data segments which are used only as input for building of other segments
+        if self.release_inputs:
+            used = set()
+            for script in self._body:
+                used.update(script.segments)
+            inputs = set()
+            for item in self._data:
+                inputs.update(name.upper() for name in item.depends)
+            released = [item for item in self._data if item.full_name.upper() in inputs - used]
+            # the buffers referenced by kept data segments (zero-copy composition) would not be freed
+            held = set()
+            for item in self._data:
+                if item.loaded and item not in released:
+                    held.update(data_buffers(item.data))
+            for item in released:
+                if item.loaded and not held.intersection(data_buffers(item.data)):
+                    item.release()
+
+    def _discard(self, items):
+        """ Drop loaded data of data segments and of all data segments built from them """
+        names = {item.full_name.upper() for item in items}
+        while True:
+            dependents = {item.full_name.upper() for item in self._data if item.full_name.upper() not in names and
+                          any(name.upper() in names for name in item.depends)}
+            if not dependents:
+                break
+            names |= dependents
         for item in self._data:
-            if item.MARK not in (DatSegIMX2.MARK, DatSegIMX2B.MARK, DatSegIMX3.MARK):
-                item.load(self._data, self._path)
+            if item.full_name.upper() in names:
+                item.data = None
+
+    @staticmethod
+    def _is_composite(item):
+        """ Check if data segment is boot image or it's built from other data segments """
+        return item.MARK in BOOT_IMAGES or bool(item.depends)
+
+    def _load_segments(self, executor=None, done=None):
+        """ Load simple data segments and then complex ones which can include simple data segments
+        :param executor: The executor for loading of segments in parallel (None is sequential)
+        :param done: The callback called after every loaded simple data segment: done(item)
+        """
+        simple = [item for item in self._data if not self._is_composite(item)]
+        levels = self._composite_levels([item for item in self._data if self._is_composite(item)])
+
+        if executor is None:
+            for item in simple:
+                item.load(self._data, self._roots)
+                if done is not None:
+                    done(item)
+            for level in levels:
+                for item in level:
+                    item.load(self._data, self._roots)
+            return
+
+        def load_item(item):
+            item.load(self._data, self._roots)
+            if done is not None:
+                done(item)
+
+        batches = [(simple, load_item)] + [(level, lambda item: item.load(self._data, self._roots)) for level in levels]
+        for items, callback in batches:
+            for future in [executor.submit(callback, item) for item in items]:
+                future.result()
+
+    @staticmethod
+    def _composite_levels(items):
+        """ Split composite data segments into levels, every one depends only on segments from previous levels
+        :param items: The list of composite data segments
+        :return: list of lists
+        """
+        pending = {item.full_name.upper(): item for item in items}
+        levels = []
+        while pending:
+            level = [item for item in pending.values()
+                     if not any(name.upper() in pending for name in item.depends)]
+            if not level:
+                raise Exception("Circular dependency of data segments: {}".format(
+                    ', '.join(item.full_name for item in pending.values())))
+            for item in level:
+                del pending[item.full_name.upper()]
+            levels.append(level)
+        return levels
+
+    def segment_event(self, name):
+        """ Get completion event of data segment for async API
+        :param name: The full name of data segment: <name>.<type>
+        :return: asyncio.Event which is set when the data segment is loaded or failed by load_async()
+        """
+        import asyncio
+        return self._events.setdefault(name.upper(), asyncio.Event())
+
+    async def wait_segment(self, name):
+        """ Wait until data segment is loaded by load_async(), raise the error if loading has failed
+        :param name: The full name of data segment: <name>.<type>
+        """
+        await self.segment_event(name).wait()
+        error = self._load_errors.get(name.upper())
+        if error is not None:
+            raise error
+
+    async def open_async(self, file, auto_load=False):
+        """ Open SMX file without blocking of event loop
+        :param file: The path to SMX file
+        :param auto_load: Load data segments after open
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.open, file, False)
+        if auto_load:
+            await self.load_async()
+
+    async def load_async(self):
+        """ Load data segments without blocking of event loop
 
-        # load complex data segments which can include simple data segments
+            The file I/O and building of data segments runs in worker threads, the images are signed in separate
+            processes. The per segment completion can be awaited by wait_segment().
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        for event in self._events.values():
+            event.clear()
+        self._load_errors = {}
+        events = {item.full_name.upper(): self.segment_event(item.full_name) for item in self._data}
+
+        def done(item):
+            loop.call_soon_threadsafe(events[item.full_name.upper()].set)
+
+        def fail(error):
+            # wake up the waiters of not loaded data segments with the error
+            for name, event in events.items():
+                if not event.is_set():
+                    self._load_errors[name] = error
+                    event.set()
+
+        def load():
+            try:
+                with self._lock, ThreadPoolExecutor(self.load_workers, thread_name_prefix='imxsb-load') as executor:
+                    self._load(executor, done)
+            except Exception as e:
+                loop.call_soon_threadsafe(fail, e)
+                raise
+
+        await loop.run_in_executor(None, load)
+
+    async def get_script_async(self, index):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get_script, index)
+
+    async def get_plan_async(self, index):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get_plan, index)
+
+    def _sign(self, items):
+        jobs = []
+        for item in items:
+            if hasattr(item, 'sign_job'):
+                job = item.sign_job(self._roots)
+                if job is not None:
+                    jobs.append((item, job))
+        if jobs:
+            outputs = sign_images([job for _, job in jobs], self.sign_cache, self.sign_workers)
+            for (item, _), output in zip(jobs, outputs):
+                item.sign_done(output)
+
+    def _reload(self, item):
+        """ Reload released or evicted data segment """
+        item.verify(self._roots)
+        item.load(self._data, self._roots)
+        self._sign([item])
+
+    def memory_info(self):
+        """ Get report of memory held by data segments
+        :return: string
+        """
+        msg = ""
+        total = 0
+        buffers = set()
         for item in self._data:
-            if item.MARK in (DatSegIMX2.MARK, DatSegIMX2B.MARK, DatSegIMX3.MARK):
-                item.load(self._data, self._path)
+            if item.loaded and is_stream(item.data):
+                # the content is read from file during transfer
+                state = "{} (streamed)".format(fmt_size(item.size))
+            elif item.loaded:
+                for key, part in data_buffers(item.data).items():
+                    # count every underlying buffer only once
+                    if key not in buffers:
+                        buffers.add(key)
+                        total += memoryview(part).nbytes
+                state = fmt_size(item.size)
+            elif item.released:
+                state = "released"
+            elif item.evicted:
+                state = "evicted"
+            else:
+                state = "not loaded"
+            msg += " {}: {}\n".format(item.full_name, state)
+        msg += " Total: {}\n".format(fmt_size(total))
+        return msg
+
+    def get_plan(self, index, lazy=None):
+        """ Get immutable snapshot of fully resolved boot script
+        :param index: The script index
+        :param lazy: Defer loading of not loaded data segments until execution (default: lazy_load attribute)
+        :return: BootPlan object
+        """
+        if lazy is None:
+            lazy = self.lazy_load
+        with self._lock:
+            if self._plans is not None:
+                return self._plans[index]
+            if not lazy and any(not item.loaded and not item.evicted for item in self._data):
+                self._load()
+            return self._build_plan(self._body[index], lazy)
+
+    def _build_plan(self, script, lazy=False):
+        # the plan references the data of loaded segments, they are not evicted until the plan is dropped
+        items = [item for item in self._data if item.full_name.upper() in script.segments]
+        self._store.pin(items)
+        try:
+            if lazy:
+                cmds = script.resolve(self._data, self._prepare, self._size_hint, self.coalesce_gap, self.fold_wreg,
+                                      self.dcd_address)
+            else:
+                cmds = script.resolve(self._data, coalesce=self.coalesce_gap, fold=self.fold_wreg,
+                                      dcd_address=self.dcd_address)
+        except Exception:
+            self._store.unpin(items)
+            raise
+        plan = BootPlan(script.name, script.description, self._platform, cmds, len(script) - len(cmds),
+                        self._plan_key(script, items))
+        # the deferred data are loaded on demand, they don't stay referenced by the plan
+        self._store.unpin([item for item in items if not item.loaded])
+        weakref.finalize(plan, self._store.unpin, [item for item in items if item.loaded])
+        return plan
+
+    def _plan_key(self, script, items):
+        """ Get identity of plan sources from metadata of files, the content of files isn't read
+        :param script: The SmxScript object
+        :param items: The data segments used by script
+        :return: hex string
+        """
+        # the data segments which the used ones are built from
+        items, names = list(items), {item.full_name.upper() for item in items}
+        for item in items:
+            for name in item.depends:
+                if name.upper() not in names:
+                    names.add(name.upper())
+                    items.append(get_data_segment(self._data, name))
+        sha = hashlib.sha256(repr((file_key(self._file), script.name, self.coalesce_gap, self.fold_wreg,
+                                   self.dcd_address)).encode())
+        for item in items:
+            for path in item.files:
+                try:
+                    path = get_full_path(self._roots, path)[0]
+                except Exception:
+                    pass
+                sha.update(repr((item.full_name, file_key(path))).encode())
+        return sha.hexdigest()
+
+    def _prepare(self, item):
+        """ Load data segment together with data segments which it's built from """
+        with self._lock:
+            if not item.loaded:
+                for name in item.depends:
+                    dep = get_data_segment(self._data, name)
+                    if not dep.loaded and not dep.evicted:
+                        self._prepare(dep)
+                self._reload(item)
+            return item
+
+    def _size_hint(self, item):
+        """ Estimate size of not loaded data segment from size of its files """
+        size = 0
+        for path in item.files:
+            try:
+                size += os.path.getsize(get_full_path(self._roots, path)[0])
+            except Exception:
+                pass
+        return size
 
     def get_script(self, index):
-        script = self._body[index]
-        script.load(self._data)
-        return script
+        with self._lock:
+            if self._plans is not None and self._body[index].loaded:
+                # all scripts are loaded by warm-up without memory budget
+                return self._body[index]
+            # keep loaded only selected script, so the data of others can be evicted
+            for script in self._body:
+                if script.loaded:
+                    script.unload()
+            self._store.unpin(self._script_pins)
+            script = self._body[index]
+            script.load(self._data)
+            self._script_pins = [item for item in self._data if item.loaded and
+                                 item.full_name.upper() in script.segments]
+            self._store.pin(self._script_pins)
+            return script
+
+    def warm_up(self, background=False):
+        """ Resolve and validate all scripts and memoize their plans
+
+            The data segments are loaded if it's needed. After warm-up get_plan() returns the memoized plans in
+            constant time. If the memory budget is set, the memoized plans keep only the data segments which stay
+            loaded within the budget and the others are loaded on demand during execution (like lazy plans),
+            otherwise all used data segments are kept in memory and get_script() returns the loaded scripts too.
+            The memoized plans are dropped by next open() or load().
+
+        :param background: Run warm-up in background thread and return it
+        :return: threading.Thread object if background is True
+        """
+        if background:
+            thread = threading.Thread(target=self._warm_up, args=(True, self._generation), name='imxsb-warmup',
+                                      daemon=True)
+            thread.start()
+            return thread
+        self._warm_up()
+
+    def _warm_up(self, quiet=False, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                # another file has been opened in meantime
+                return
+            try:
+                if any(not item.loaded and not item.evicted for item in self._data):
+                    self._load()
+                # the evicted data segments are deferred, so that the plans don't hold more than the budget
+                lazy = self._store.budget is not None
+                plans = [self._build_plan(script, lazy) for script in self._body]
+                if not lazy:
+                    for script in self._body:
+                        script.load(self._data)
+            except Exception:
+                # in background the error is reported later by get_plan() or get_script() of invalid script
+                if quiet:
+                    return
+                raise
+            if generation is None or generation == self._generation:
+                self._plans = plans
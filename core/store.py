@@ -0,0 +1,140 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import threading
+from collections import OrderedDict
+
+
+class SegmentStore(object):
+    """ Memory-budgeted store of loaded data segments
+
+        The store tracks the size of loaded data segments in LRU order. If the total size exceeds the budget, the
+        least recently used segments are evicted. An evicted segment is transparently reloaded via loader callback
+        on next access of its data. The pinned segments (referenced by boot plans, ...) are never evicted, because
+        their memory would not be freed, and the streamed segments aren't evicted, because they hold no memory.
+        The buffers shared by several segments (zero-copy composition) are counted only once and the segment is
+        evicted only if it holds some buffer which isn't shared.
+    """
+
+    @property
+    def budget(self):
+        return self._budget
+
+    @budget.setter
+    def budget(self, value):
+        assert value is None or value >= 0
+        self._budget = value
+        with self._lock:
+            self._evict()
+
+    @property
+    def size(self):
+        with self._lock:
+            buffers = {}
+            for item_buffers in self._items.values():
+                buffers.update(item_buffers)
+            return sum(buffers.values())
+
+    def __init__(self, budget=None, loader=None):
+        """ Init SegmentStore
+        :param budget: The max size of loaded data in bytes (None is unlimited)
+        :param loader: The callback for loading of evicted segment: loader(item)
+        """
+        self._budget = budget
+        self._loader = loader
+        # {<data segment>: {<id of buffer>: <size of buffer>}}
+        self._items = OrderedDict()
+        # {<data segment>: <count of pins>}
+        self._pins = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def _evict(self, keep=None):
+        if self._budget is None:
+            return
+        total = self.size
+        while total > self._budget:
+            # the least recently used segment, which eviction frees some memory
+            for item in self._items:
+                if item is not keep and item not in self._pins:
+                    size = self._own_size(item)
+                    if size:
+                        break
+            else:
+                break
+            del self._items[item]
+            item.evict()
+            total -= size
+
+    def _own_size(self, item):
+        """ Get size of buffers held only by given data segment """
+        shared = set()
+        for other, buffers in self._items.items():
+            if other is not item:
+                shared.update(buffers)
+        return sum(size for key, size in self._items[item].items() if key not in shared)
+
+    def put(self, item):
+        """ Register loaded data segment and evict others if the budget is exceeded
+        :param item: The data segment object
+        """
+        with self._lock:
+            self._items[item] = item.mem_buffers
+            self._items.move_to_end(item)
+            self._evict(item)
+
+    def touch(self, item):
+        """ Mark data segment as recently used
+        :param item: The data segment object
+        """
+        with self._lock:
+            if item in self._items:
+                self._items.move_to_end(item)
+
+    def pin(self, items):
+        """ Protect data segments against eviction
+        :param items: The data segment objects
+        """
+        with self._lock:
+            for item in items:
+                self._pins[item] = self._pins.get(item, 0) + 1
+
+    def unpin(self, items):
+        """ Remove protection of data segments added by pin() and evict others if the budget is exceeded
+        :param items: The data segment objects
+        """
+        with self._lock:
+            for item in items:
+                count = self._pins.pop(item, 0) - 1
+                if count > 0:
+                    self._pins[item] = count
+            self._evict()
+
+    def discard(self, item):
+        """ Remove data segment from store
+        :param item: The data segment object
+        """
+        with self._lock:
+            self._items.pop(item, None)
+
+    def reload(self, item):
+        """ Load evicted data segment
+        :param item: The data segment object
+        """
+        if self._loader is None:
+            raise Exception("{}: Data has been released and can not be reloaded !".format(item.full_name))
+        with self._lock:
+            self._loader(item)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._pins.clear()
@@ -0,0 +1,166 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import json
+import threading
+from .cache import CACHE_DIR, atomic_write
+
+# File with remembered throughput measurements: {<device type>: {<chunk size>: [bytes, seconds, count]}}
+TRANSFER_TUNING_FILE = os.path.join(CACHE_DIR, 'transfer.json')
+
+# Candidate sizes of data chunk sent in single write transaction
+CHUNK_SIZES = (64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024)
+
+# The data smaller than this are sent in single transaction
+CHUNK_MIN_DATA = 1024 * 1024
+
+# Size of data packet of SDP (HID report)
+PACKET_SIZE = 1024
+
+# Count of progress updates from transport per chunk
+CHUNK_PG_UPDATES = 4
+
+_tuning_lock = threading.Lock()
+
+
+def device_type(transport):
+    """ Get device type of boot target used as key of tuning
+    :param transport: The target object
+    :return: string
+    """
+    return getattr(transport, 'device_name', None) or type(transport).__name__
+
+
+class ChunkTuner(object):
+    """ Selection of transfer chunk size by measured throughput of device type
+
+        Every candidate size is measured for given count of chunks, then the size with the best throughput is used.
+        The measurements are accumulated, so that the selection follows the changes of target or host, and they are
+        remembered in tuning file for the next boots of the same device type.
+    """
+
+    @property
+    def chunk_size(self):
+        """ The chunk size for next transaction """
+        with self._lock:
+            for size in self.sizes:
+                if self._stats.get(size, (0, 0, 0))[2] < self.samples:
+                    return size
+            return max(self.sizes, key=self.throughput)
+
+    def __init__(self, device, sizes=CHUNK_SIZES, samples=3, file=TRANSFER_TUNING_FILE):
+        """ Init ChunkTuner
+        :param device: The device type (see device_type())
+        :param sizes: The candidate chunk sizes
+        :param samples: The count of measured chunks of every candidate before selection
+        :param file: The tuning file (None is not remembered)
+        """
+        assert sizes
+        self.device = device
+        self.sizes = tuple(sorted(sizes))
+        self.samples = samples
+        self.file = file
+        # private
+        self._lock = threading.Lock()
+        # {<chunk size>: [bytes, seconds, count]}
+        self._stats = {}
+        if file is not None:
+            with _tuning_lock:
+                try:
+                    with open(file) as f:
+                        stats = json.load(f).get(device, {})
+                    self._stats = {int(size): list(value) for size, value in stats.items()}
+                except (OSError, ValueError, AttributeError, TypeError):
+                    pass
+
+    def throughput(self, size):
+        """ Get measured throughput of chunk size
+        :param size: The chunk size
+        :return: bytes per second (0 if not measured)
+        """
+        nbytes, seconds, _ = self._stats.get(size, (0, 0, 0))
+        return nbytes / seconds if seconds > 0 else 0
+
+    def record(self, size, nbytes, elapsed):
+        """ Add measurement of single transaction
+        :param size: The used chunk size
+        :param nbytes: The count of transferred bytes
+        :param elapsed: The transaction time in seconds
+        """
+        with self._lock:
+            stat = self._stats.setdefault(size, [0, 0, 0])
+            stat[0] += nbytes
+            stat[1] += elapsed
+            stat[2] += 1
+
+    def save(self):
+        """ Store the measurements into tuning file """
+        if self.file is None:
+            return
+        with _tuning_lock:
+            try:
+                with open(self.file) as f:
+                    tuning = json.load(f)
+            except (OSError, ValueError):
+                tuning = {}
+            with self._lock:
+                tuning[self.device] = {str(size): value for size, value in self._stats.items()}
+            try:
+                atomic_write(self.file, json.dumps(tuning))
+            except OSError:
+                pass
+
+    def info(self):
+        """ Get report of measured throughput
+        :return: string
+        """
+        msg = " Device: {}\n".format(self.device)
+        for size in self.sizes:
+            count = self._stats.get(size, (0, 0, 0))[2]
+            msg += " {:>8d} kB: {:8.1f} kB/s ({} chunks)\n".format(size // 1024, self.throughput(size) / 1024, count)
+        return msg
+
+
+class ChunkedTransfer(object):
+    """ Splitting of data for write transactions
+
+        The data are written by chunks at address + offset. The chunk size is fixed or selected by ChunkTuner from
+        measured throughput. The progress is reported once per chunk and only few times from transport, so that the
+        callbacks don't slow down the transfer of large images.
+    """
+
+    def __init__(self, tuner=None, chunk_size=None, min_data=CHUNK_MIN_DATA):
+        """ Init ChunkedTransfer
+        :param tuner: The ChunkTuner object
+        :param chunk_size: The fixed chunk size (used if tuner is None)
+        :param min_data: The data smaller than this are sent in single transaction
+        """
+        assert tuner is not None or chunk_size
+        self.tuner = tuner
+        self.min_data = min_data
+        self._chunk_size = chunk_size
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size if self.tuner is None else self.tuner.chunk_size
+
+    @staticmethod
+    def pg_resolution(size):
+        """ Get transport progress resolution (in packets) for chunk size """
+        return max(1, size // (PACKET_SIZE * CHUNK_PG_UPDATES))
+
+    def split(self, length):
+        """ Check if data of given length should be split into chunks """
+        return length >= self.min_data
+
+    def record(self, size, nbytes, elapsed):
+        if self.tuner is not None:
+            self.tuner.record(size, nbytes, elapsed)
+
+    def save(self):
+        if self.tuner is not None:
+            self.tuner.save()
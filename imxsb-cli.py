@@ -7,7 +7,6 @@
 # or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
 
 import sys
-import imx
 import time
 import argparse
 # SmartBoot Core module
@@ -68,6 +67,35 @@ class ProgressBar(object):
             self._started = False
 
 
+class BootProgress(object):
+    """ Boot engine hooks which print command info and progressbar """
+
+    def __init__(self, bar, count):
+        self.bar = bar
+        self.count = count
+
+    def on_command(self, index, cmd):
+        print(" %d/%d) %s" % (index + 1, self.count, cmd.description))
+        if cmd.data is not None:
+            self.bar.start()
+
+    def on_resume(self, index, offset, reset):
+        if reset:
+            print(" Target has been reset, boot from start")
+        else:
+            print(" Resume from: %d/%d" % (index + 1, self.count))
+
+    def on_retry(self, index, cmd, attempt, error, delay):
+        print(" Retry %d/%d: %s" % (index + 1, self.count, str(error) or type(error).__name__))
+
+    def on_progress(self, value, level):
+        self.bar.update(level)
+
+    def on_command_done(self, index, cmd, elapsed):
+        if cmd.data is not None:
+            self.bar.finish()
+
+
 ########################################################################################################################
 # main function
 ########################################################################################################################
@@ -78,11 +106,29 @@ def main():
 
     # cli arguments
     parser = argparse.ArgumentParser()
-    parser.add_argument('smx_file', help='path to *.smx file')
+    parser.add_argument('smx_file', help='path to *.smx file or boot bundle')
     parser.add_argument('-i', '--info', dest='print_info', action='store_true',
                         help='print SMX file info and exit')
+    parser.add_argument('-e', '--export-bundle', dest='bundle', metavar='FILE',
+                        help='export all resolved scripts into boot bundle and exit')
     parser.add_argument('-s', '--script', dest='index', type=int, default=100,
                         help='select script by its index')
+    parser.add_argument('-w', '--warm-up', dest='warm_up', action='store_true',
+                        help='prebuild all boot scripts in background while selecting the target')
+    parser.add_argument('-a', '--readahead', dest='readahead', action='store_true',
+                        help='read files into page cache while selecting the target and load them on start of boot')
+    parser.add_argument('-l', '--lazy', dest='lazy', action='store_true',
+                        help='load images on demand while the previous ones are transferred')
+    parser.add_argument('-c', '--coalesce', dest='gap', type=lambda x: int(x, 0), metavar='GAP',
+                        help='merge writes of images into adjacent memory (max GAP bytes between them)')
+    parser.add_argument('-r', '--fold-wreg', dest='fold_wreg', action='store_true',
+                        help='write register values by DCD instead of separate writes')
+    parser.add_argument('-R', '--resume', dest='resume', action='store_true',
+                        help='continue interrupted boot of the same script on the same USB port')
+    parser.add_argument('-t', '--retry', dest='attempts', type=int, default=3, metavar='N',
+                        help='max count of attempts of command failed by USB error (default: 3)')
+    parser.add_argument('-T', '--retry-regs', dest='retry_regs', action='store_true',
+                        help='retry also register writes and DCD, which can be triggered by repeated write')
     parser.add_argument('-q', '--quiet', dest='quiet', action='store_true',
                         help='no progressbar')
     parser.add_argument('-v', '--version', action='version', version=core.__version__)
@@ -90,12 +136,25 @@ def main():
     results = parser.parse_args()
 
     try:
-        # open and load smx file
-        smx = core.SmxFile(results.smx_file, True)
+        # open and load smx file or prebuilt boot bundle
+        if core.is_bundle(results.smx_file):
+            smx = core.BundleFile(results.smx_file)
+        else:
+            smx = core.SmxFile(results.smx_file, not results.readahead, readahead=results.readahead,
+                               lazy_load=results.lazy, coalesce_gap=results.gap, fold_wreg=results.fold_wreg)
+        # export boot bundle
+        if results.bundle is not None:
+            size = core.export_bundle(smx, results.bundle)
+            print("\n Boot bundle: %s (%s)" % (results.bundle, core.smxfile.fmt_size(size)))
+            sys.exit(0)
     except Exception as e:
         print("\n ERROR: %s" % str(e))
         sys.exit(error_code)
 
+    # the info doesn't use the boot plans
+    if results.warm_up and not results.print_info:
+        smx.warm_up(background=True)
+
     if results.print_info:
         print("\n Name: %s\n Desc: %s\n Chip: %s\n" % (smx.name, smx.description, smx.platform))
         print(' ' + '-' * 50)
@@ -104,12 +163,15 @@ def main():
             print(" %d) %s (%s)" % (num, script.name, script.description))
             num += 1
         print(' ' + '-' * 50)
+        print(smx.memory_info())
     else:
         error_flg = False
         error_msg = ""
         script_index = results.index
         device_index = 0
 
+        import imx
+
         # scan for USB target
         devices = imx.sdp.scan_usb(smx.platform)
         if not devices:
@@ -145,63 +207,41 @@ def main():
             print()
 
         bar = ProgressBar(nbars=40, prefix=' ', file=sys.stdout)
-
-        def progress_handler(value):
-            bar.update(value)
-            return True
+        bar.disabled = results.quiet
 
         try:
-            # connect target
-            if results.quiet:
-                flasher.open()
-                bar.disabled = True
-            else:
-                flasher.open(progress_handler)
-                flasher.pg_resolution = 20
-
-            # load script
-            script = smx.get_script(script_index)
+            # get resolved boot script
+            script = smx.get_plan(script_index)
             print(' ' + '-' * 50)
             print(" START: %s (%s)" % (script.name, script.description))
+            if script.saved_round_trips:
+                print(" Saved: %d USB round-trips" % script.saved_round_trips)
             print(' ' + '-' * 50)
 
             # execute script
-            num = 1
-            for cmd in script:
-
-                # print command info
-                print(" %d/%d) %s" % (num, len(script), cmd['description']))
-
-                if cmd['name'] == 'wreg':
-                    flasher.write(cmd['address'], cmd['value'], cmd['bytes'])
-
-                elif cmd['name'] == 'wdcd':
-                    bar.start()
-                    flasher.write_dcd(cmd['address'], cmd['data'])
-                    bar.finish()
-
-                elif cmd['name'] == 'wimg':
-                    bar.start()
-                    flasher.write_file(cmd['address'], cmd['data'])
-                    bar.finish()
-
-                elif cmd['name'] == 'sdcd':
-                    flasher.skip_dcd()
-
-                elif cmd['name'] == 'jrun':
-                    flasher.jump_and_run(cmd['address'])
-
+            transfer = core.ChunkedTransfer(core.ChunkTuner(core.device_type(flasher)))
+            checkpoint = None
+            if results.resume:
+                port = core.port_path(flasher)
+                if port is None:
+                    print(" WARNING: USB port path is not known, the boot can not be resumed")
                 else:
-                    raise Exception("Command: {} not supported".format(cmd['name']))
-
-                num += 1
+                    checkpoint = core.Checkpoint(port)
+            commands = core.RETRY_COMMANDS + (core.RETRY_REG_COMMANDS if results.retry_regs else ())
+            engine = core.BootEngine(flasher, script, [BootProgress(bar, len(script))], pg_range=bar.total,
+                                     transfer=transfer, checkpoint=checkpoint,
+                                     retry=core.RetryPolicy(attempts=max(1, results.attempts), commands=commands))
+            try:
+                engine.run()
+            finally:
+                if engine.retry_stats.retries:
+                    print(" " + engine.retry_stats.info())
 
         except Exception as e:
             error_msg = str(e) if str(e) else "Unknown Error !"
             error_flg = True
 
         finally:
-            flasher.close()
             if error_flg:
                 print()
             else:
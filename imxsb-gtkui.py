@@ -27,6 +27,13 @@ BASEDIR = os.path.dirname(os.path.realpath(__file__))
 # The range of progressbar
 PGRANGE = 1000
 
+# The memory budget for loaded data segments (in bytes)
+MEMBUDGET = 256 * 1024 * 1024
+
+# Prebuild all boot scripts in background after SMX file is opened, enabled by environment variable IMXSB_WARMUP=1
+# (the prebuilt scripts hold only the data which fit into MEMBUDGET, the others are loaded during boot)
+WARMUP = os.environ.get('IMXSB_WARMUP', '0') == '1'
+
 
 # ...
 def elapsed_time(start_time):
@@ -39,66 +46,31 @@ def elapsed_time(start_time):
 # Worker class
 class Worker(threading.Thread):
 
-    def __init__(self, device, script, logger, finish, prgbar):
+    def __init__(self, device, plan, logger, finish, prgbar):
         super().__init__()
-        self._device = device
-        self._script = script
         self._logger = logger
         self._finish = finish
         self._prgbar = prgbar
-        # internal variables
-        self._running = False
-        self._pgstp = 0
-        self._pgval = 0
+        self._engine = core.BootEngine(device, plan, [self], PGRANGE, retry=core.RetryPolicy())
+        self._start_time = 0
 
     def stop(self):
-        self._running = False
+        self._engine.cancel()
 
-    def progress_handler(self, level):
-        GLib.idle_add(self._prgbar, self._pgval + (self._pgstp / PGRANGE) * level)
-        return self._running
+    def on_start(self, plan):
+        self._start_time = time.time()
+        GLib.idle_add(self._logger, " START: {}\n".format(plan.name))
 
-    def run(self):
-        self._running = True
-        self._script.set_pgrange(PGRANGE)
-        self._device.pg_range = PGRANGE
+    def on_command(self, index, cmd):
+        # print command info
+        GLib.idle_add(self._logger, " {} {}\n".format(elapsed_time(self._start_time), cmd.description), False)
 
-        start_time = time.time()
-        GLib.idle_add(self._logger, " START: {}\n".format(self._script.name))
+    def on_progress(self, value, level):
+        GLib.idle_add(self._prgbar, value)
 
+    def run(self):
         try:
-            # connect target
-            self._device.open(self.progress_handler)
-            for cmd in self._script:
-
-                if not self._running:
-                    break
-
-                self._pgval += self._pgstp
-                self._pgstp = cmd['pg']
-
-                # print command info
-                GLib.idle_add(self._logger, " {} {}\n".format(elapsed_time(start_time), cmd['description']), False)
-
-                if cmd['name'] == 'wreg':
-                    self._device.write(cmd['address'], cmd['value'], cmd['bytes'])
-
-                elif cmd['name'] == 'wdcd':
-                    self._device.write_dcd(cmd['address'], cmd['data'])
-
-                elif cmd['name'] == 'wimg':
-                    self._device.write_file(cmd['address'], cmd['data'])
-
-                elif cmd['name'] == 'sdcd':
-                    self._device.skip_dcd()
-
-                elif cmd['name'] == 'jrun':
-                    self._device.jump_and_run(cmd['address'])
-
-                else:
-                    raise Exception("Command: {} not supported".format(cmd['name']))
-
-            GLib.idle_add(self._prgbar, PGRANGE)
+            self._engine.run()
 
         except Exception as e:
             GLib.idle_add(self._finish, " STOP: {}".format(str(e)), False)
@@ -106,14 +78,11 @@ class Worker(threading.Thread):
         else:
             GLib.idle_add(self._finish, " DONE: Successfully started", True)
 
-        finally:
-            self._device.close()
-
 
 # Main Window Class
 class MainWindow(Gtk.Window):
 
-    smx_file = core.SmxFile()
+    smx_file = core.SmxFile(mem_budget=MEMBUDGET, readahead=True)
     hotplug = core.HotPlug()
     devices = []
     target = None
@@ -317,7 +286,10 @@ class MainWindow(Gtk.Window):
             self.liststore.clear()
             self.smx_path.set_text("")
             try:
-                self.smx_file.open(path, True)
+                # with readahead the files are read into page cache and loaded on start of boot
+                self.smx_file.open(path, not self.smx_file.readahead)
+                if WARMUP:
+                    self.smx_file.warm_up(background=True)
             except Exception as e:
                 self.show_mesage_box("SMX File Open Error", str(e), Gtk.MessageType.ERROR)
                 self.target = None
@@ -367,12 +339,12 @@ class MainWindow(Gtk.Window):
         if self.start_button.get_label().endswith("Start"):
             try:
                 device = self.devices[self.devices_box.get_active()]
-                script = self.smx_file.get_script(self.get_script_selection_index())
+                plan = self.smx_file.get_plan(self.get_script_selection_index())
             except Exception as e:
                 self.show_mesage_box("Script Load Error", str(e), Gtk.MessageType.ERROR)
             else:
                 # Start Worker
-                self.worker = Worker(device, script, self.logger, self.on_finish, self.pgbar)
+                self.worker = Worker(device, plan, self.logger, self.on_finish, self.pgbar)
                 self.worker.daemon = True
                 self.worker.start()
 
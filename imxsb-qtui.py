@@ -28,6 +28,13 @@ BASEDIR = os.path.dirname(os.path.realpath(__file__))
 # The range of progressbar
 PGRANGE = 1000
 
+# The memory budget for loaded data segments (in bytes)
+MEMBUDGET = 256 * 1024 * 1024
+
+# Prebuild all boot scripts in background after SMX file is opened, enabled by environment variable IMXSB_WARMUP=1
+# (the prebuilt scripts hold only the data which fit into MEMBUDGET, the others are loaded during boot)
+WARMUP = os.environ.get('IMXSB_WARMUP', '0') == '1'
+
 
 # ...
 def elapsed_time(start_time):
@@ -44,63 +51,28 @@ class Worker(QThread):
     finish = pyqtSignal(str, bool)
     prgbar = pyqtSignal(int)
 
-    def __init__(self, device, script):
+    def __init__(self, device, plan):
         super().__init__()
-        self._device = device
-        self._script = script
-        # internal variables
-        self._running = False
-        self._pgstp = 0
-        self._pgval = 0
+        self._engine = core.BootEngine(device, plan, [self], PGRANGE, retry=core.RetryPolicy())
+        self._start_time = 0
 
     def stop(self):
-        self._running = False
-
-    def progress_handler(self, level):
-        self.prgbar.emit(int(self._pgval + (self._pgstp / PGRANGE) * level))
-        return self._running
-
-    def run(self):
-        self._running = True
-        self._script.set_pgrange(PGRANGE)
-        self._device.pg_range = PGRANGE
-        # start timer
-        start_time = time.time()
-        self.logger.emit(" START: {}".format(self._script.name), True)
-
-        try:
-            # connect target
-            self._device.open(self.progress_handler)
-            for cmd in self._script:
-
-                if not self._running:
-                    break
+        self._engine.cancel()
 
-                self._pgval += self._pgstp
-                self._pgstp = cmd['pg']
+    def on_start(self, plan):
+        self._start_time = time.time()
+        self.logger.emit(" START: {}".format(plan.name), True)
 
-                # print command info
-                self.logger.emit(" {} {}".format(elapsed_time(start_time), cmd['description']), False)
+    def on_command(self, index, cmd):
+        # print command info
+        self.logger.emit(" {} {}".format(elapsed_time(self._start_time), cmd.description), False)
 
-                if cmd['name'] == 'wreg':
-                    self._device.write(cmd['address'], cmd['value'], cmd['bytes'])
+    def on_progress(self, value, level):
+        self.prgbar.emit(value)
 
-                elif cmd['name'] == 'wdcd':
-                    self._device.write_dcd(cmd['address'], cmd['data'])
-
-                elif cmd['name'] == 'wimg':
-                    self._device.write_file(cmd['address'], cmd['data'])
-
-                elif cmd['name'] == 'sdcd':
-                    self._device.skip_dcd()
-
-                elif cmd['name'] == 'jrun':
-                    self._device.jump_and_run(cmd['address'])
-
-                else:
-                    raise Exception("Command: {} not supported".format(cmd['name']))
-
-            self.prgbar.emit(PGRANGE)
+    def run(self):
+        try:
+            self._engine.run()
 
         except Exception as e:
             self.finish.emit(" STOP: {}".format(str(e)), False)
@@ -108,14 +80,11 @@ class Worker(QThread):
         else:
             self.finish.emit(" DONE: Successfully started", True)
 
-        finally:
-            self._device.close()
-
 
 # Main Window Class
 class MainWindow(QFrame):
 
-    smx_file = core.SmxFile()
+    smx_file = core.SmxFile(mem_budget=MEMBUDGET, readahead=True)
     hotplug = core.HotPlug()
     devices = []
     target = None
@@ -291,7 +260,10 @@ class MainWindow(QFrame):
             self.smxEdit.clear()
             self.scriptsList.clear()
             try:
-                self.smx_file.open(fileName, True)
+                # with readahead the files are read into page cache and loaded on start of boot
+                self.smx_file.open(fileName, not self.smx_file.readahead)
+                if WARMUP:
+                    self.smx_file.warm_up(background=True)
             except Exception as e:
                 self.ShowMesageBox("SMX File Open Error", str(e), QMessageBox.Warning)
                 self.target = None
@@ -325,12 +297,12 @@ class MainWindow(QFrame):
         if self.startButton.text().endswith("Start"):
             try:
                 device = self.devices[self.deviceBox.currentIndex()]
-                script = self.smx_file.get_script(self.scriptsList.currentRow())
+                plan = self.smx_file.get_plan(self.scriptsList.currentRow())
             except Exception as e:
                 self.ShowMesageBox("Script Load Error", str(e), QMessageBox.Warning)
             else:
                 # Start Worker
-                self.worker = Worker(device, script)
+                self.worker = Worker(device, plan)
                 self.worker.logger.connect(self.Logger)
                 self.worker.finish.connect(self.on_finish)
                 self.worker.prgbar.connect(self.ProgressBar)
@@ -31,6 +31,13 @@ BASEDIR = os.path.dirname(os.path.realpath(__file__))
 # The range of progressbar
 PGRANGE = 1000
 
+# The memory budget for loaded data segments (in bytes)
+MEMBUDGET = 256 * 1024 * 1024
+
+# Prebuild all boot scripts in background after SMX file is opened, enabled by environment variable IMXSB_WARMUP=1
+# (the prebuilt scripts hold only the data which fit into MEMBUDGET, the others are loaded during boot)
+WARMUP = os.environ.get('IMXSB_WARMUP', '0') == '1'
+
 # Queue Message Format
 Message = collections.namedtuple('Message', ['status', 'msg', 'value', 'done'])
 
@@ -46,84 +53,41 @@ def elapsed_time(start_time):
 # Worker class
 class Worker(threading.Thread):
 
-    def __init__(self, device, script, queue):
+    def __init__(self, device, plan, queue):
         super().__init__()
-        self._device = device
-        self._script = script
         self._queue = queue
-        # internal variables
-        self._running = False
-        self._pgstp = 0
-        self._pgval = 0
+        self._engine = core.BootEngine(device, plan, [self], PGRANGE, 150, retry=core.RetryPolicy())
+        self._start_time = 0
 
     def stop(self):
-        self._running = False
+        self._engine.cancel()
 
-    def progress_handler(self, level):
-        self._queue.put(Message("progress", "", self._pgval + (self._pgstp / PGRANGE) * level, False))
-        return self._running
+    def on_start(self, plan):
+        self._start_time = time.time()
+        self._queue.put(Message("logger", " START: {}\n".format(plan.name), 1, False))
 
-    def run(self):
-        self._running = True
-        self._script.set_pgrange(PGRANGE)
-        self._device.pg_range = PGRANGE
-        self._device.pg_resolution = 150
+    def on_command(self, index, cmd):
+        # print command info
+        self._queue.put(Message("logger", " {} {}\n".format(elapsed_time(self._start_time), cmd.description), 0, False))
 
-        start_time = time.time()
+    def on_progress(self, value, level):
+        self._queue.put(Message("progress", "", value, False))
 
-        self._queue.put(Message("logger", " START: {}\n".format(self._script.name), 1, False))
+    def run(self):
         try:
-            # connect target
-            self._device.open(self.progress_handler)
-            for cmd in self._script:
-
-                if not self._running:
-                    break
-
-                self._pgval += self._pgstp
-                self._pgstp = cmd['pg']
-
-                # print command info
-                self._queue.put(
-                    Message("logger", " {} {}\n".format(elapsed_time(start_time), cmd['description']), 0, False)
-                )
-
-                if cmd['name'] == 'wreg':
-                    self._device.write(cmd['address'], cmd['value'], cmd['bytes'])
-
-                elif cmd['name'] == 'wdcd':
-                    self._device.write_dcd(cmd['address'], cmd['data'])
-
-                elif cmd['name'] == 'wimg':
-                    self._device.write_file(cmd['address'], cmd['data'])
-
-                elif cmd['name'] == 'sdcd':
-                    self._device.skip_dcd()
-
-                elif cmd['name'] == 'jrun':
-                    self._device.jump_and_run(cmd['address'])
-
-                else:
-                    raise Exception("Command: {} not supported".format(cmd['name']))
-
-            self._queue.put(Message("progress", "", PGRANGE, False))
+            self._engine.run()
 
         except Exception as e:
             self._queue.put(Message("finish", " STOP: {}".format(str(e)), 0, False))
-            pass
 
         else:
             self._queue.put(Message("finish", " DONE: Successfully started", 0, True))
-            pass
-
-        finally:
-            self._device.close()
 
 
 # Main Window Class
 class MainWindow(Tk):
 
-    smx_file = core.SmxFile()
+    smx_file = core.SmxFile(mem_budget=MEMBUDGET, readahead=True)
     hotplug = core.HotPlug()
     devices = []
     running = False
@@ -305,7 +269,10 @@ class MainWindow(Tk):
             self.script_view.delete(*self.script_view.get_children())
 
             try:
-                self.smx_file.open(path, True)
+                # with readahead the files are read into page cache and loaded on start of boot
+                self.smx_file.open(path, not self.smx_file.readahead)
+                if WARMUP:
+                    self.smx_file.warm_up(background=True)
             except Exception as e:
                 self.show_mesage_box("SMX File Open Error", str(e), 'error')
                 self.target = None
@@ -340,12 +307,12 @@ class MainWindow(Tk):
         if not self.running:
             try:
                 device = self.devices[self.devices_box.current()]
-                script = self.smx_file.get_script(self.get_script_selection_index())
+                plan = self.smx_file.get_plan(self.get_script_selection_index())
             except Exception as e:
                 self.show_mesage_box("Script Load Error", str(e), 'error')
             else:
                 # Start Worker
-                self.worker = Worker(device, script, self.queue)
+                self.worker = Worker(device, plan, self.queue)
                 self.worker.daemon = True
                 self.worker.start()
 
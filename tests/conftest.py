@@ -0,0 +1,105 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import sys
+import pytest
+
+# the core package is imported from repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeTarget(object):
+    """ Boot target which keeps written data in memory (see core.Transport)
+
+        The errors are injected by fail(), the next calls of given command raise them in order.
+    """
+
+    pg_range = 100
+    pg_resolution = 5
+
+    def __init__(self, memory=None):
+        # {<address>: <written bytes>}
+        self.memory = {} if memory is None else memory
+        self.log = []
+        self.opened = 0
+        self._errors = {}
+
+    def fail(self, name, *errors):
+        # the None passes the call
+        self._errors.setdefault(name, []).extend(errors)
+
+    def _call(self, name, *args):
+        if self._errors.get(name):
+            error = self._errors[name].pop(0)
+            if error is not None:
+                raise error
+        self.log.append((name,) + args)
+
+    def open(self, handler=None):
+        self.opened += 1
+
+    def close(self):
+        pass
+
+    def read(self, address, length):
+        for base, data in self.memory.items():
+            if base <= address and address + length <= base + len(data):
+                return bytearray(data[address - base:address - base + length])
+        return bytearray(length)
+
+    def write(self, address, value, count=4):
+        self._call('write', address, value)
+
+    def write_dcd(self, address, data):
+        self._call('write_dcd', address, bytes(data))
+
+    def write_file(self, address, data):
+        self._call('write_file', address, len(data))
+        self.memory[address] = bytes(data)
+
+    def skip_dcd(self):
+        self._call('skip_dcd')
+
+    def jump_and_run(self, address):
+        self._call('jump_and_run', address)
+
+    def image(self, address, size):
+        """ Read back written image """
+        data = bytearray(size)
+        for base, part in sorted(self.memory.items()):
+            if address <= base < address + size:
+                data[base - address:base - address + len(part)] = part[:address + size - base]
+        return bytes(data)
+
+
+@pytest.fixture
+def target():
+    return FakeTarget()
+
+
+@pytest.fixture
+def smx_loader(monkeypatch):
+    """ SmxFile parses the file by yaml.load() without Loader argument, which is required since PyYAML 6 """
+    import yaml
+    load = yaml.load
+    monkeypatch.setattr(yaml, 'load', lambda stream, Loader=yaml.SafeLoader: load(stream, Loader))
+
+
+def write_smx(directory, data, cmds, name='test.smx', head=''):
+    """ Create SMX file with single script
+    :param directory: The directory of SMX file
+    :param data: The content of DATA section (YAML indented by 4 spaces)
+    :param cmds: The script commands separated by new line
+    :param name: The file name
+    :param head: The additional content of HEAD section (YAML indented by 2 spaces)
+    :return: The path of SMX file
+    """
+    path = os.path.join(str(directory), name)
+    with open(path, 'w') as f:
+        f.write("HEAD:\n  NAME: Test\n  CHIP: MX7SD\n{}DATA:\n{}BODY:\n  - NAME: Boot\n    CMDS: |\n{}".format(
+            head, data, ''.join('      {}\n'.format(cmd) for cmd in cmds.splitlines())))
+    return path
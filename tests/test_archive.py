@@ -0,0 +1,101 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import io
+import tarfile
+import zipfile
+import pytest
+from conftest import write_smx
+from core.smxfile import SmxFile
+from core.engine import BootEngine
+from core.segments.archive import Archive, ArchiveError, split_archive_path, close_archive
+
+IMAGE = os.urandom(100000)
+
+
+def smx_text(tmp_path):
+    with open(write_smx(tmp_path, "    image.raw:\n      ADDR: 0x80800000\n      FILE: images/image.bin\n",
+                        'wimg image.raw\njrun image.raw')) as f:
+        return f.read()
+
+
+def zip_archive(tmp_path, compression=zipfile.ZIP_STORED, members=None):
+    path = str(tmp_path / 'boot.zip')
+    with zipfile.ZipFile(path, 'w', compression) as f:
+        for name, data in (members or {'test.smx': smx_text(tmp_path), 'images/image.bin': IMAGE}).items():
+            f.writestr(name, data)
+    return path
+
+
+def tar_archive(tmp_path):
+    path = str(tmp_path / 'boot.tar')
+    with tarfile.open(path, 'w:') as f:
+        for name, data in (('test.smx', smx_text(tmp_path).encode()), ('images/image.bin', IMAGE)):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            f.addfile(info, io.BytesIO(data))
+    return path
+
+
+@pytest.mark.parametrize('compression', [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_zip_member(tmp_path, compression):
+    archive = Archive(zip_archive(tmp_path, compression))
+    assert sorted(archive.names()) == ['images/image.bin', 'test.smx']
+    data = archive.read('images/image.bin')
+    assert bytes(data) == IMAGE
+    # the stored member is a view of mapped archive file
+    assert isinstance(data, memoryview) == (compression == zipfile.ZIP_STORED)
+    del data
+    archive.close()
+
+
+def test_tar_member(tmp_path):
+    archive = Archive(tar_archive(tmp_path))
+    data = archive.read('images/image.bin')
+    assert isinstance(data, memoryview) and bytes(data) == IMAGE
+    assert archive.member(archive.member_path('images/image.bin')) == 'images/image.bin'
+    del data
+    archive.close()
+
+
+def test_not_archive(tmp_path):
+    path = str(tmp_path / 'boot.tar')
+    with open(path, 'wb') as f:
+        f.write(os.urandom(1000))
+    with pytest.raises(ArchiveError):
+        Archive(path)
+
+
+def test_split_path(tmp_path):
+    path = zip_archive(tmp_path)
+    assert split_archive_path(path) == (path, '')
+    assert split_archive_path(os.path.join(path, 'images', 'image.bin')) == (path, 'images/image.bin')
+    assert split_archive_path(str(tmp_path / 'test.smx')) == (None, None)
+
+
+@pytest.mark.parametrize('make', [zip_archive, tar_archive])
+def test_boot_from_archive(tmp_path, smx_loader, target, make):
+    path = make(tmp_path)
+    os.remove(str(tmp_path / 'test.smx'))
+    smx = SmxFile(path)
+    try:
+        BootEngine(target, smx.get_plan(0)).run()
+        assert target.image(0x80800000, len(IMAGE)) == IMAGE
+    finally:
+        smx.close()
+        close_archive(path)
+
+
+def test_archive_with_more_smx(tmp_path, smx_loader):
+    text = smx_text(tmp_path)
+    path = zip_archive(tmp_path, members={'a.smx': text, 'b.smx': text, 'images/image.bin': IMAGE})
+    try:
+        with pytest.raises(Exception, match='exactly one SMX'):
+            SmxFile(path)
+        assert SmxFile(os.path.join(path, 'b.smx')).scripts[0].name == 'Boot'
+    finally:
+        close_archive(path)
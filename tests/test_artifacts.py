@@ -0,0 +1,97 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import hashlib
+import threading
+import functools
+import pytest
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from core.segments import artifacts
+from core.segments.artifacts import ArtifactCache, ArtifactError, HashBackend
+
+IMAGE = os.urandom(100000)
+DIGEST = hashlib.sha256(IMAGE).hexdigest()
+
+
+class Handler(SimpleHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        super().do_GET()
+
+
+@pytest.fixture
+def server(tmp_path):
+    """ HTTP server on localhost which serves files of directory 'www' """
+    www = tmp_path / 'www'
+    www.mkdir()
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(Handler, directory=str(www)))
+    httpd.requests = []
+    httpd.www = www
+    httpd.url = 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_fetch(tmp_path, server):
+    (server.www / 'image.bin').write_bytes(IMAGE)
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    path = cache.fetch(server.url + '/image.bin')
+    with open(path, 'rb') as f:
+        assert f.read() == IMAGE
+    assert os.path.basename(path) == DIGEST
+
+
+def test_cache_hit(tmp_path, server):
+    (server.www / 'image.bin').write_bytes(IMAGE)
+    path = ArtifactCache(str(tmp_path / 'cache')).fetch(server.url + '/image.bin')
+    # the next process finds the artifact in cache
+    (server.www / 'image.bin').unlink()
+    assert ArtifactCache(str(tmp_path / 'cache')).fetch(server.url + '/image.bin') == path
+    assert server.requests == ['/image.bin']
+
+
+def test_hash_mismatch(tmp_path, server, monkeypatch):
+    (server.www / DIGEST).write_bytes(IMAGE[:-1])
+    monkeypatch.setitem(artifacts._backends, 'sha256', HashBackend([server.url]))
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    with pytest.raises(ArtifactError, match='hash mismatch'):
+        cache.fetch('sha256:' + DIGEST)
+    assert not os.listdir(str(tmp_path / 'cache' / 'objects'))
+
+
+def test_mirror_fallback(tmp_path, server, monkeypatch):
+    (server.www / 'mirror').mkdir()
+    (server.www / 'mirror' / DIGEST).write_bytes(IMAGE)
+    monkeypatch.setitem(artifacts._backends, 'sha256', HashBackend([server.url + '/missing', str(tmp_path / 'none'),
+                                                                     server.url + '/mirror']))
+    path = ArtifactCache(str(tmp_path / 'cache')).fetch('sha256:' + DIGEST)
+    with open(path, 'rb') as f:
+        assert f.read() == IMAGE
+    assert server.requests == ['/missing/' + DIGEST, '/mirror/' + DIGEST]
+
+
+def test_evict_used(tmp_path, server):
+    for name in ('a.bin', 'b.bin'):
+        (server.www / name).write_bytes(os.urandom(1000))
+    cache = ArtifactCache(str(tmp_path / 'cache'), max_size=1500)
+    used = [cache.fetch(server.url + '/a.bin'), cache.fetch(server.url + '/b.bin')]
+    # the objects used by this process stay over the limit
+    assert all(os.path.exists(path) for path in used)
+
+    # the new process evicts the least recently used object, which it doesn't use
+    (server.www / 'c.bin').write_bytes(os.urandom(1000))
+    os.utime(used[0], (0, 0))
+    path = ArtifactCache(str(tmp_path / 'cache'), max_size=2500).fetch(server.url + '/c.bin')
+    assert os.path.exists(path) and os.path.exists(used[1])
+    assert not os.path.exists(used[0])
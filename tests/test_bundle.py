@@ -0,0 +1,61 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import pytest
+from conftest import write_smx
+from core.smxfile import SmxFile, FoldedDCD
+from core.bundle import BundleFile, BundleError, export_bundle, is_bundle
+from core.engine import BootEngine
+
+IMAGE = os.urandom(300000)
+
+
+def boot_smx(directory):
+    with open(os.path.join(str(directory), 'image.bin'), 'wb') as f:
+        f.write(IMAGE)
+    data = ("    ddr.dcd:\n      ADDR: 0x00910000\n      DATA: |\n        WriteValue 4 0x30340004 0x4F400005\n"
+            "    image.raw:\n      ADDR: 0x80800000\n      FILE: image.bin\n")
+    return write_smx(directory, data, 'wreg 32 0x30340004 0x1\nwreg 32 0x30340008 0x2\nwdcd ddr.dcd\n'
+                                      'wimg image.raw\njrun 0x80800000')
+
+
+def exported(tmp_path):
+    smx = SmxFile(boot_smx(tmp_path), fold_wreg=True)
+    file = str(tmp_path / 'test.smxb')
+    size = export_bundle(smx, file)
+    assert os.path.getsize(file) == size
+    return smx, file
+
+
+def test_export(tmp_path, smx_loader, target):
+    smx, file = exported(tmp_path)
+    assert is_bundle(file) and not is_bundle(str(tmp_path / 'test.smx'))
+    bundle = BundleFile(file)
+    plan, original = bundle.get_plan(0), smx.get_plan(0)
+    assert [(cmd.name, cmd.address, cmd.value) for cmd in plan] == \
+           [(cmd.name, cmd.address, cmd.value) for cmd in original]
+    # the folded register writes are kept
+    assert isinstance(plan[0].data, FoldedDCD) and plan[0].data.wregs == original[0].data.wregs
+    BootEngine(target, plan).run()
+    assert target.image(0x80800000, len(IMAGE)) == IMAGE
+
+
+def test_reexport(tmp_path, smx_loader):
+    _, file = exported(tmp_path)
+    copy = str(tmp_path / 'copy.smxb')
+    export_bundle(BundleFile(file), copy)
+    with open(file, 'rb') as f, open(copy, 'rb') as g:
+        assert f.read() == g.read()
+
+
+@pytest.mark.parametrize('size', [10, 200, -200000, -4096])
+def test_truncated(tmp_path, smx_loader, size):
+    _, file = exported(tmp_path)
+    with open(file, 'r+b') as f:
+        f.truncate(size if size > 0 else os.path.getsize(file) + size)
+    with pytest.raises(BundleError):
+        BundleFile(file)
@@ -0,0 +1,108 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import time
+import pytest
+from imx.img import SegDCD, EnumEngine
+from core.segments.dcd import compile_dcd_txt, check_dcd, optimize_dcd, _dcd_cache
+
+
+def register_table(count):
+    """ Generate DCD text with large register table """
+    lines = []
+    for index in range(count):
+        lines.append("WriteValue 4 0x{:08X} 0x{:08X}".format(0x021B0000 + index * 4, index))
+        if index % 100 == 99:
+            lines.append("CheckAllClear 4 0x021B0018 0x00000001")
+    return '\n'.join(lines)
+
+
+def best_time(func, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+DCD_TEXTS = [
+    "WriteValue 4 0x30340004 0x1\nSetBitMask 4 0x30340008 0x2\nNop\nCheckAnySet 4 0x3034000C 0x4\n",
+    # widths, operations and check with count
+    "WriteValue 1 0x30340004 0x1\nWriteValue 1 0x30340005 2\nWriteValue 2 0x30340006 0x3\nClearBitMask 4 0x1 0x10\n"
+    "CheckAllClear 2 0x30340010 0x1 100\nWriteValue1 4 0x30340014 0x5\n",
+    # comments and unknown lines
+    "# header\n  WriteValue 4 0x30340004 0x1 # comment\nunknown line\n  # indented comment\nNop\n",
+    # multi-line commands
+    "WriteValue 4 \\\n0x30340004 0x1\nCheckAnyClear 4 0x30340008 \\\n  0x1\n",
+    # the comment and empty lines inside of multi-line command are skipped
+    "WriteValue 4 0x30340004 \\\n# comment\n\n0x1\nWriteValue 4 0x30340008 0x2\n",
+    # the unknown line ended by backslash doesn't join the next line
+    "unknown \\\nWriteValue 4 0x30340004 0x1\n",
+    # the not finished multi-line command at the end and trailing zeros
+    "WriteValue 4 0x30340004 0x1\0\0\nNop \\\n",
+    register_table(1000),
+]
+
+
+@pytest.mark.parametrize('text', DCD_TEXTS)
+def test_compile_matches_imx(text):
+    assert compile_dcd_txt(text) == SegDCD.parse_txt(text).export()
+
+
+def test_compile_unlock():
+    # the values are packed as 32-bit words (SegDCD.export() doesn't support them)
+    data = compile_dcd_txt("Unlock SNVS 0x1 0x2\nUnlock OCOTP\n")
+    check_dcd(data)
+    assert data[4:] == bytes.fromhex('B2000C') + bytes([EnumEngine.SNVS]) + bytes.fromhex('0000000100000002') + \
+        bytes.fromhex('B20004') + bytes([EnumEngine.OCOTP])
+
+
+def test_compile_errors():
+    for text in ("WriteValue 4 0x30340004\n", "WriteValue 3 0x30340004 0x1\n", "WriteValue 4 0x30340004 0xZ\n",
+                 "CheckAllSet 4 0x30340004\n", "Unlock XYZ 0x1\n", "WriteValue 4 0x30340004 0x100000000\n"):
+        with pytest.raises(SyntaxError):
+            compile_dcd_txt(text)
+
+
+def test_compile_cache():
+    text = register_table(100)
+    _dcd_cache.clear()
+    data = compile_dcd_txt(text)
+    assert compile_dcd_txt(text) is data
+    assert compile_dcd_txt(text + "\n") is not data
+
+
+def test_compile_benchmark():
+    """ Microbenchmark of DCD text compiler against SegDCD.parse_txt() + export(), the times are only reported """
+    text = register_table(5000)
+    reference = best_time(lambda: SegDCD.parse_txt(text).export())
+
+    def cold():
+        _dcd_cache.clear()
+        compile_dcd_txt(text)
+
+    compiled = best_time(cold)
+    cached = best_time(lambda: compile_dcd_txt(text))
+    print("\n parse_txt + export: {:.2f} ms, compile: {:.2f} ms, cached: {:.3f} ms".format(
+        reference * 1000, compiled * 1000, cached * 1000))
+    assert compile_dcd_txt(text) == SegDCD.parse_txt(text).export()
+
+
+def test_check_dcd():
+    data = compile_dcd_txt(register_table(10))
+    check_dcd(data)
+    for invalid in (b'', b'\xD3' + data[1:], data[:-4], data[:3] + b'\x30' + data[4:], data + b'\0\0\0\0'):
+        with pytest.raises(ValueError):
+            check_dcd(invalid)
+
+
+def test_optimize_keeps_repeats_and_nops():
+    text = ("WriteValue 4 0x30340004 0x1\nWriteValue 4 0x30340004 0x1\nSetBitMask 4 0x30340008 0x0\n"
+            "WriteValue 4 0x30340010 0x2\nNop\nWriteValue 4 0x30340014 0x3\n")
+    dcd = optimize_dcd(SegDCD.parse_txt(text))
+    assert len(dcd) == 3
+    assert [list(item) for item in dcd[0]] == [[0x30340004, 1], [0x30340004, 1], [0x30340010, 2]]
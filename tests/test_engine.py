@@ -0,0 +1,261 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import asyncio
+import pytest
+from conftest import FakeTarget
+from core.smxfile import BootCmd, BootPlan, DeferredData
+from core.engine import BootEngine, BootCancelled
+from core.transfer import ChunkedTransfer, ChunkTuner
+from core.checkpoint import Checkpoint, plan_id
+from core.retry import RetryPolicy, RetryRule, RETRY_COMMANDS, RETRY_REG_COMMANDS
+
+IMAGE = os.urandom(1000) * 100
+
+
+class Hooks(object):
+
+    def __init__(self):
+        self.events = []
+
+    def on_command(self, index, cmd):
+        self.events.append(('command', index))
+
+    def on_resume(self, index, offset, reset):
+        self.events.append(('resume', index, offset, reset))
+
+    def on_retry(self, index, cmd, attempt, error, delay):
+        self.events.append(('retry', index, attempt))
+
+    def on_finish(self, error):
+        self.events.append(('finish', error))
+
+
+def boot_plan(image=IMAGE):
+    return BootPlan('Boot', 'Test', 'MX7SD', (
+        BootCmd('wreg', 0x30340004, 1, 4, None, ''),
+        BootCmd('wimg', 0x80800000, None, None, image, ''),
+        BootCmd('jrun', 0x80800000, None, None, None, '')))
+
+
+def test_run(target):
+    hooks = Hooks()
+    BootEngine(target, boot_plan(), [hooks]).run()
+    assert [item[0] for item in target.log] == ['write', 'write_file', 'jump_and_run']
+    assert target.image(0x80800000, len(IMAGE)) == IMAGE
+    assert hooks.events == [('command', 0), ('command', 1), ('command', 2), ('finish', None)]
+
+
+def test_cancel(target):
+    engine = BootEngine(target, boot_plan())
+    engine.cancel()
+    with pytest.raises(BootCancelled):
+        engine.run()
+    assert target.log == []
+
+
+def test_cancel_in_transfer(target):
+    hooks = Hooks()
+    engine = BootEngine(target, boot_plan(), [hooks])
+    # the transport aborts the transfer by its own exception when the progress handler returns False
+    original = target.write_file
+
+    def write_file(address, data):
+        engine.cancel()
+        raise IOError('transfer aborted')
+
+    target.write_file = write_file
+    with pytest.raises(BootCancelled):
+        engine.run()
+    target.write_file = original
+    assert [item[0] for item in target.log] == ['write']
+    assert isinstance(hooks.events[-1][1], BootCancelled)
+
+
+def test_run_async(target):
+    asyncio.run(BootEngine(target, boot_plan()).run_async())
+    assert [item[0] for item in target.log] == ['write', 'write_file', 'jump_and_run']
+
+
+def test_prefetch(target):
+    prepared = []
+
+    def loader(index, data):
+        def load():
+            prepared.append(index)
+            return data
+        return load
+
+    cmds = [BootCmd('wimg', 0x80000000 + index * 0x100000, None, None, DeferredData(loader(index, IMAGE), len(IMAGE)),
+                    '') for index in range(4)]
+    BootEngine(target, BootPlan('Boot', '', 'MX7SD', cmds), prefetch=1).run()
+    assert prepared == [0, 1, 2, 3]
+    assert [item[1] for item in target.log] == [cmd.address for cmd in cmds]
+    assert target.image(0x80300000, len(IMAGE)) == IMAGE
+
+
+def test_prefetch_error(target):
+    def broken():
+        raise IOError('segment file not found')
+
+    plan = BootPlan('Boot', '', 'MX7SD', (
+        BootCmd('wreg', 0x30340004, 1, 4, None, ''),
+        BootCmd('wimg', 0x80800000, None, None, DeferredData(lambda: IMAGE, len(IMAGE)), ''),
+        BootCmd('wimg', 0x83000000, None, None, DeferredData(broken, 100), ''),
+        BootCmd('jrun', 0x80800000, None, None, None, '')))
+    hooks = Hooks()
+    with pytest.raises(IOError, match='segment file not found'):
+        BootEngine(target, plan, [hooks]).run()
+    # the commands before the broken data are executed, the error is reported in the order of commands
+    assert [item[0] for item in target.log] == ['write', 'write_file']
+    assert isinstance(hooks.events[-1][1], IOError)
+
+
+def test_chunked(target):
+    BootEngine(target, boot_plan(), transfer=ChunkedTransfer(chunk_size=4096, min_data=0)).run()
+    assert len([item for item in target.log if item[0] == 'write_file']) == (len(IMAGE) + 4095) // 4096
+    assert target.image(0x80800000, len(IMAGE)) == IMAGE
+
+
+def test_chunk_tuner(tmp_path):
+    file = str(tmp_path / 'transfer.json')
+    tuner = ChunkTuner('MX7SD', sizes=(1024, 4096), samples=2, file=file)
+    for size, elapsed in ((1024, 1.0), (1024, 1.0), (4096, 1.0)):
+        assert tuner.chunk_size == size
+        tuner.record(size, size, elapsed)
+    tuner.record(4096, 4096, 1.0)
+    # every size is measured, the size with the best throughput is used and remembered
+    assert tuner.chunk_size == 4096
+    tuner.save()
+    assert ChunkTuner('MX7SD', sizes=(1024, 4096), samples=2, file=file).chunk_size == 4096
+    assert ChunkTuner('MX6UL', sizes=(1024, 4096), samples=2, file=file).chunk_size == 1024
+
+
+class SdpTimeoutError(Exception):
+    pass
+
+
+class SdpConnectionError(Exception):
+    pass
+
+
+def no_delay(attempts=3, commands=RETRY_COMMANDS):
+    return RetryPolicy({name: RetryRule(attempts, backoff=0) for name in commands}, attempts, commands)
+
+
+def test_retry_continues_image(target):
+    target.fail('write_file', SdpTimeoutError('timeout'), SdpConnectionError('disconnected'))
+    hooks = Hooks()
+    engine = BootEngine(target, boot_plan(), [hooks], transfer=ChunkedTransfer(chunk_size=4096, min_data=0),
+                        retry=no_delay())
+    engine.run()
+    assert target.image(0x80800000, len(IMAGE)) == IMAGE
+    # every chunk is written once
+    assert len([item for item in target.log if item[0] == 'write_file']) == (len(IMAGE) + 4095) // 4096
+    assert engine.retry_stats.retries == 2
+    assert engine.retry_stats.reopens == 1
+    assert target.opened == 2
+    assert ('retry', 1, 2) in hooks.events
+
+
+def test_retry_defaults(target):
+    # the register writes, DCD and jump are not retried by default
+    for name in ('write', 'jump_and_run'):
+        target.fail(name, SdpTimeoutError('timeout'))
+        with pytest.raises(SdpTimeoutError):
+            BootEngine(target, boot_plan(), retry=no_delay()).run()
+    assert RetryPolicy().rule('wreg') is None
+    assert RetryPolicy().rule('wdcd') is None
+    assert RetryPolicy().rule('jrun').attempts == 1
+    # on request
+    target.fail('write', SdpTimeoutError('timeout'))
+    BootEngine(target, boot_plan(), retry=no_delay(commands=RETRY_COMMANDS + RETRY_REG_COMMANDS)).run()
+    assert target.log[-1][0] == 'jump_and_run'
+
+
+def test_retry_limits(target):
+    target.fail('write_file', *[SdpTimeoutError('timeout')] * 3)
+    with pytest.raises(SdpTimeoutError):
+        BootEngine(target, boot_plan(), retry=no_delay(3)).run()
+    target.fail('write_file', ValueError('not transient'))
+    with pytest.raises(ValueError):
+        BootEngine(target, boot_plan(), retry=no_delay()).run()
+
+
+def test_retry_delay():
+    rule = RetryRule(backoff=0.1, factor=2.0, max_delay=0.3)
+    assert [rule.delay(attempt) for attempt in (1, 2, 3)] == [0.1, 0.2, 0.3]
+
+
+def test_checkpoint_resume(tmp_path, target):
+    plan = boot_plan()
+    checkpoint = Checkpoint('1-2.3', str(tmp_path))
+    target.fail('jump_and_run', ValueError('USB glitch'))
+    with pytest.raises(ValueError):
+        BootEngine(target, plan, transfer=ChunkedTransfer(chunk_size=4096, min_data=0), checkpoint=checkpoint).run()
+    assert checkpoint.load(plan) == (2, 0)
+
+    # the same target continues with jrun
+    resumed = FakeTarget(target.memory)
+    hooks = Hooks()
+    BootEngine(resumed, plan, [hooks], checkpoint=checkpoint).run()
+    assert [item[0] for item in resumed.log] == ['jump_and_run']
+    assert ('resume', 2, 0, False) in hooks.events
+    assert checkpoint.load(plan) is None
+
+
+def test_checkpoint_reset(tmp_path, target):
+    plan = boot_plan()
+    checkpoint = Checkpoint('1-2.3', str(tmp_path))
+    target.fail('jump_and_run', ValueError('USB glitch'))
+    with pytest.raises(ValueError):
+        BootEngine(target, plan, checkpoint=checkpoint).run()
+
+    # the power cycled target has lost the memory content, so the whole plan is executed again
+    hooks = Hooks()
+    fresh = FakeTarget()
+    BootEngine(fresh, plan, [hooks], checkpoint=checkpoint).run()
+    assert [item[0] for item in fresh.log] == ['write', 'write_file', 'jump_and_run']
+    assert ('resume', 0, 0, True) in hooks.events
+
+
+def test_checkpoint_offset(tmp_path, target):
+    plan = boot_plan()
+    checkpoint = Checkpoint('1-2.3', str(tmp_path), interval=0)
+    transfer = ChunkedTransfer(chunk_size=4096, min_data=0)
+    # the write of the 4th chunk fails
+    target.fail('write_file', None, None, None, ValueError('USB glitch'))
+    with pytest.raises(ValueError):
+        BootEngine(target, plan, transfer=transfer, checkpoint=checkpoint).run()
+    assert checkpoint.load(plan) == (1, 3 * 4096)
+
+    resumed = FakeTarget(target.memory)
+    BootEngine(resumed, plan, transfer=transfer, checkpoint=checkpoint).run()
+    assert resumed.log[0] == ('write_file', 0x80800000 + 3 * 4096, 4096)
+    assert resumed.image(0x80800000, len(IMAGE)) == IMAGE
+
+
+def test_checkpoint_throttle(tmp_path):
+    plan = boot_plan()
+    checkpoint = Checkpoint('1-2.3', str(tmp_path), interval=60)
+    checkpoint.save(plan, 1, 4096)
+    checkpoint.save(plan, 1, 8192)
+    assert checkpoint.load(plan) == (1, 4096)
+    # the finished commands are always stored
+    checkpoint.save(plan, 2)
+    assert checkpoint.load(plan) == (2, 0)
+
+
+def test_plan_id():
+    assert plan_id(boot_plan()) == plan_id(boot_plan())
+    assert plan_id(boot_plan()) != plan_id(boot_plan(IMAGE[:-1] + bytes([IMAGE[-1] ^ 1])))
+
+    def loader():
+        raise AssertionError("deferred data loaded")
+
+    # the deferred data of lazy plan are not prepared
+    assert plan_id(boot_plan(DeferredData(loader, len(IMAGE))))
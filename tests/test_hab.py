@@ -0,0 +1,92 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import sys
+import pytest
+from conftest import write_smx
+from core.smxfile import SmxFile
+from core.segments.hab import SignJob, SignErrorHAB, sign_images
+
+# Signing tool which outputs the rendered CSF and logs its runs outside of keys directory (working directory)
+FAKE_CST = """import sys
+args = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+if '-e' in args:
+    sys.exit(args['-e'])
+with open(args['-i']) as f:
+    csf = f.read()
+with open(args['-o'], 'w') as f:
+    f.write(csf)
+with open('../runs.log', 'a') as f:
+    f.write(csf + '\\n')
+"""
+
+CSF_TEMPLATE = "[Authenticate Data]\n    Blocks = {{ BLOCKS }}\n    Size = {{ SIGN_SIZE }}"
+
+
+@pytest.fixture
+def keys(tmp_path):
+    keys_dir = tmp_path / 'keys'
+    keys_dir.mkdir()
+    (keys_dir / 'cst.py').write_text(FAKE_CST)
+    return keys_dir
+
+
+def sign_job(keys, data=bytes(range(256)), tool='-o {output} -i {csf}'):
+    return SignJob('boot.imx2', data, 0x877FF000, 0x100, CSF_TEMPLATE, str(keys),
+                   '"{}" cst.py {}'.format(sys.executable, tool))
+
+
+def runs(keys):
+    path = keys.parent / 'runs.log'
+    return path.read_text().count('[Authenticate Data]') if path.exists() else 0
+
+
+def test_sign(tmp_path, keys):
+    output, = sign_images([sign_job(keys)], str(tmp_path / 'cache'))
+    assert output.decode().startswith('[Authenticate Data]\n    Blocks = 0x877FF000 0x0 0x100 "')
+    assert output.decode().endswith('Size = 0x100')
+
+
+def test_sign_cache(tmp_path, keys):
+    cache = str(tmp_path / 'cache')
+    output, = sign_images([sign_job(keys)], cache)
+    # the unchanged image is not signed again
+    assert sign_images([sign_job(keys)], cache) == [output]
+    assert runs(keys) == 1
+    # the changed image or keys are signed again
+    sign_images([sign_job(keys, bytes(256))], cache)
+    assert runs(keys) == 2
+    (keys / 'key.pem').write_text('key')
+    sign_images([sign_job(keys)], cache)
+    assert runs(keys) == 3
+
+
+def test_sign_parallel(tmp_path, keys):
+    jobs = [sign_job(keys), sign_job(keys, bytes(256)), sign_job(keys)]
+    outputs = sign_images(jobs, None, 2)
+    # the same images are signed only once
+    assert runs(keys) == 2
+    assert outputs[0] == outputs[2] and len(outputs[1]) == len(outputs[0])
+
+
+def test_sign_error(tmp_path, keys):
+    with pytest.raises(SignErrorHAB, match='boot.imx2'):
+        sign_images([sign_job(keys, tool='-e "wrong key"')], str(tmp_path / 'cache'))
+    assert not (tmp_path / 'cache').exists()
+
+
+def test_sign_smx(tmp_path, keys, smx_loader):
+    (keys / 'boot.csft').write_text(CSF_TEMPLATE)
+    with open(str(tmp_path / 'u-boot.bin'), 'wb') as f:
+        f.write(bytes(range(256)) * 64)
+    data = ("    ub.ubi:\n      FILE: u-boot.bin\n    boot.imx2:\n      DATA:\n        STADDR: 0x877FF000\n"
+            "        APPSEG: ub.ubi\n      SIGN:\n        CSFT: keys/boot.csft\n        TOOL: '{}'\n").format(
+        sign_job(keys).tool.replace("'", "''"))
+    smx = SmxFile(write_smx(tmp_path, data, 'wimg boot.imx2\njrun boot.imx2'), sign_cache=str(tmp_path / 'cache'))
+    image = bytes(smx.get_plan(0)[0].data)
+    # the CSF created by signing tool is inserted into the reserved space of image
+    assert b'[Authenticate Data]\n    Blocks = 0x877FF' in image
+    assert runs(keys) == 1
@@ -0,0 +1,66 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import sys
+import subprocess
+from conftest import write_smx
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run CLI with yaml.load() patched for PyYAML 6 (see smx_loader fixture) and print all imported modules at exit.
+# The modules imported by importlib.import_module() (data segment types) are not reported by -X importtime.
+CLI_RUNNER = ("import sys, atexit, runpy, yaml; load = yaml.load; "
+              "yaml.load = lambda stream, Loader=yaml.SafeLoader: load(stream, Loader); "
+              "atexit.register(lambda: sys.stderr.write('modules: ' + ' '.join(sorted(sys.modules)) + '\\n')); "
+              "sys.argv = ['imxsb-cli.py'] + sys.argv[1:]; runpy.run_path('imxsb-cli.py', run_name='__main__')")
+
+# The modules which are used only for booting of target
+DEVICE_MODULES = ('pyudev', 'core.engine', 'core.hotplug', 'core.transfer', 'core.checkpoint')
+
+
+def run_cli(*args):
+    """ Run imxsb-cli.py with -X importtime
+    :return: (exit code, stdout, set of imported modules, {<module name>: <cumulative import time in us>})
+    """
+    ret = subprocess.run([sys.executable, '-X', 'importtime', '-c', CLI_RUNNER] + list(args), cwd=ROOT_DIR,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    modules, times = set(), {}
+    for line in ret.stderr.splitlines():
+        if line.startswith('modules: '):
+            modules = set(line.split()[1:])
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return ret.returncode, ret.stdout, modules, times
+
+
+def test_version_imports():
+    """ The --version path imports only the core package without any segment or device module """
+    code, out, modules, times = run_cli('--version')
+    assert code == 0 and out.strip()
+    assert 'core' in modules
+    for name in ('imx', 'jinja2', 'fdt', 'uboot', 'core.smxfile', 'core.segments.base') + DEVICE_MODULES:
+        assert name not in modules, name
+    print("\n --version: core imported in {} us".format(times['core']))
+
+
+def test_info_imports(tmp_path):
+    """ The --info path imports the SMX parser and used segment types, but no other segments and device modules """
+    with open(str(tmp_path / 'image.bin'), 'wb') as f:
+        f.write(bytes(256))
+    smx = write_smx(tmp_path, "    image.raw:\n      ADDR: 0x80800000\n      FILE: image.bin\n",
+                    'wimg image.raw\njrun image.raw')
+    code, out, modules, times = run_cli('-i', smx)
+    assert code == 0, out
+    assert 'Boot' in out
+    for name in ('core.smxfile', 'core.segments.raw'):
+        assert name in modules, name
+    for name in ('fdt', 'uboot', 'core.segments.fdt', 'core.segments.uboot', 'core.segments.imx') + DEVICE_MODULES:
+        assert name not in modules, name
+    print("\n --info: core imported in {} us, SMX parser in {} us".format(times['core'], times['core.smxfile']))
@@ -0,0 +1,58 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import time
+import resource
+import tracemalloc
+import imx
+from core.segments.base import LOAD_MMAP_MIN
+from core.segments.imx import DatSegIMX2
+from core.segments.uboot import DatSegUBI
+
+APP_SIZE = 2 * LOAD_MMAP_MIN
+
+
+def compose(tmp_path, zero_copy):
+    """ Build IMX2 boot image from large APP image
+    :return: (data, peak of allocated memory, time)
+    """
+    app_file = tmp_path / 'u-boot.bin'
+    if not app_file.exists():
+        with open(str(app_file), 'wb') as f:
+            f.write(os.urandom(1024) * (APP_SIZE // 1024))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    if zero_copy:
+        db = [DatSegUBI('ub', {'FILE': 'u-boot.bin'}), DatSegIMX2('img', {'DATA': {'STADDR': 0x877FF000,
+                                                                                    'APPSEG': 'ub.ubi'}})]
+        for item in db:
+            item.load(db, str(tmp_path))
+        data = db[1].data
+    else:
+        # the previous way: read file and export image by concatenation
+        with open(str(app_file), 'rb') as f:
+            imx_obj = imx.img.BootImg2(address=0x877FF000)
+            imx_obj.app = imx.img.SegAPP(f.read())
+        data = imx_obj.export()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return data, peak, elapsed
+
+
+def test_compose_benchmark(tmp_path):
+    """ Memory and time benchmark of zero-copy composition of IMX2 image """
+    data, peak, elapsed = compose(tmp_path, True)
+    ref_data, ref_peak, ref_elapsed = compose(tmp_path, False)
+    print("\n copy: {:.1f} copies of APP, {:.1f} ms; zero-copy: {:.1f} copies of APP, {:.1f} ms; "
+          "max RSS: {} MiB".format(ref_peak / APP_SIZE, ref_elapsed * 1000, peak / APP_SIZE, elapsed * 1000,
+                                   resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024))
+
+    assert bytes(data) == ref_data
+    assert ref_peak >= 2 * APP_SIZE
+    assert peak < APP_SIZE / 8
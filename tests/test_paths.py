@@ -0,0 +1,107 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import pytest
+from core.segments import base
+from core.segments.base import resolve_path, get_full_path
+from core.segments.uboot import DatSegUBT, InitErrorUBT
+
+ITS_TEMPLATE = """/dts-v1/;
+
+/ {
+    description = "Test FIT";
+    images {
+        kernel@1 {
+            description = "Kernel";
+            data = /incbin/("kernel.bin");
+            type = "kernel";
+            arch = "arm";
+            os = "linux";
+            compression = "none";
+            load = <0x80800000>;
+            entry = <0x80800000>;
+        };
+    };
+    configurations {
+        default = "conf@1";
+        conf@1 {
+            kernel = "kernel@1";
+        };
+    };
+};
+"""
+
+
+@pytest.fixture
+def roots(tmp_path):
+    dirs = [tmp_path / 'first', tmp_path / 'second']
+    for path in dirs:
+        path.mkdir()
+    return [str(path) for path in dirs]
+
+
+def touch_dir(path):
+    """ Change mtime of directory, the file system may have coarse timestamps """
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_search_order(roots):
+    for root in roots:
+        with open(os.path.join(root, 'image.bin'), 'wb') as f:
+            f.write(bytes(16))
+    assert resolve_path(roots, 'image.bin') == os.path.join(roots[0], 'image.bin')
+    assert resolve_path(roots[::-1], 'image.bin') == os.path.join(roots[1], 'image.bin')
+    with pytest.raises(Exception, match='none.bin'):
+        get_full_path(roots, 'none.bin')
+
+
+def test_path_cache(roots, monkeypatch):
+    with open(os.path.join(roots[1], 'image.bin'), 'wb') as f:
+        f.write(bytes(16))
+    assert resolve_path(roots, 'image.bin') == os.path.join(roots[1], 'image.bin')
+    probes = []
+    monkeypatch.setattr(base, 'path_exists', lambda path: probes.append(path) or os.path.exists(path))
+    assert resolve_path(roots, 'image.bin') == os.path.join(roots[1], 'image.bin')
+    assert not probes
+
+    # the file added into preceding search root invalidates the cached result
+    with open(os.path.join(roots[0], 'image.bin'), 'wb') as f:
+        f.write(bytes(16))
+    touch_dir(roots[0])
+    assert resolve_path(roots, 'image.bin') == os.path.join(roots[0], 'image.bin')
+    assert probes
+
+    # the removed file too
+    os.remove(os.path.join(roots[0], 'image.bin'))
+    os.remove(os.path.join(roots[1], 'image.bin'))
+    touch_dir(roots[0])
+    touch_dir(roots[1])
+    assert resolve_path(roots, 'image.bin') == ""
+
+
+@pytest.mark.parametrize('inline', [False, True])
+def test_ubt_search_roots(roots, inline):
+    kernel = os.urandom(5000)
+    with open(os.path.join(roots[1], 'kernel.bin'), 'wb') as f:
+        f.write(kernel)
+    if inline:
+        item = DatSegUBT('fit', {'ADDR': 0x83100000, 'DATA': ITS_TEMPLATE})
+        assert item.files == ['kernel.bin']
+    else:
+        with open(os.path.join(roots[0], 'fit.its'), 'w') as f:
+            f.write(ITS_TEMPLATE)
+        item = DatSegUBT('fit', {'ADDR': 0x83100000, 'FILE': 'fit.its'})
+    # the included file is found in the second search root
+    item.load([], roots)
+    assert kernel in bytes(item.data)
+
+
+def test_ubt_missing_file(roots):
+    item = DatSegUBT('fit', {'ADDR': 0x83100000, 'DATA': ITS_TEMPLATE})
+    with pytest.raises(InitErrorUBT, match='kernel.bin'):
+        item.load([], roots)
@@ -0,0 +1,106 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import pytest
+from imx.img import SegDCD
+from conftest import write_smx
+from core.smxfile import BootCmd, BootPlan, FoldedDCD, SmxFile, coalesce_writes, fold_wregs
+from core.segments.base import FileStream, SgBuffer
+from core.engine import BootEngine
+
+
+def wimg(address, data):
+    return BootCmd('wimg', address, None, None, data, '')
+
+
+def write_files(target):
+    return [item for item in target.log if item[0] == 'write_file']
+
+
+def test_coalesce_writes(target):
+    first, second, third = os.urandom(100), os.urandom(50), os.urandom(10)
+    cmds = [wimg(0x1000, first), wimg(0x1000 + 104, second), wimg(0x1010, third)]
+    merged = coalesce_writes(cmds, ['a', 'b', 'c'], 4)
+    # the overlapping write is not merged
+    assert len(merged) == 2
+    assert isinstance(merged[0].data, SgBuffer)
+    BootEngine(target, BootPlan('Boot', '', 'MX7SD', merged)).run()
+    assert len(write_files(target)) == 2
+    assert target.image(0x1000, 154) == first[:16] + third + first[26:] + bytes(4) + second
+    assert len(coalesce_writes(cmds, ['a', 'b', 'c'], 0)) == 3
+    assert len(coalesce_writes(cmds, ['a', None, 'c'], 4)) == 3
+
+
+def test_coalesce_streams(tmp_path):
+    path = str(tmp_path / 'image.bin')
+    with open(path, 'wb') as f:
+        f.write(os.urandom(3000))
+    # the streamed images are written by their own chunks, so they are not merged
+    cmds = [wimg(0x1000, b'\1' * 8), wimg(0x1008, FileStream(path)), wimg(0x1008 + 3000, b'\2' * 8)]
+    assert coalesce_writes(cmds, ['a', 'b', 'c']) == tuple(cmds)
+
+
+def test_saved_round_trips(tmp_path, smx_loader, target):
+    with open(str(tmp_path / 'ramdisk.bin'), 'wb') as f:
+        f.write(os.urandom(3000))
+    data = ("    script.ubx:\n      ADDR: 0x83100000\n      HEAD:\n        image: script\n      DATA: |\n"
+            "        echo hello\n"
+            "    boot.ubx:\n      ADDR: 0x83100100\n      HEAD:\n        image: script\n      DATA: |\n"
+            "        source 0x83100000\n"
+            "    ramdisk.raw:\n      ADDR: 0x83100200\n      FILE: ramdisk.bin\n")
+    path = write_smx(tmp_path, data, 'wimg script.ubx\nwimg boot.ubx\nwimg ramdisk.raw\njrun 0x83100000')
+    plan = SmxFile(path, coalesce_gap=0x100).get_plan(0)
+    BootEngine(target, plan).run()
+    # the scripts are written by single transfer, the streamed ramdisk by its own
+    assert len(write_files(target)) == 2
+    assert plan.saved_round_trips == 1
+
+
+def wreg(address, value):
+    return BootCmd('wreg', address, value, 4, None, '')
+
+
+class SdpCommandError(Exception):
+    pass
+
+
+def test_fold_wregs():
+    cmds = [wreg(0x30340004, 1), wreg(0x30340008, 2), BootCmd('wdcd', 0x910000, None, None, b'', ''),
+            wreg(0x3034000C, 3), wimg(0x80800000, b'\0' * 16), wreg(0x30340010, 4), wreg(0x30340014, 5)]
+    folded = fold_wregs(cmds)
+    assert [cmd.name for cmd in folded] == ['wdcd', 'wdcd', 'wreg', 'wimg', 'wreg', 'wreg']
+    assert folded[0].address == 0x910000
+    assert isinstance(folded[0].data, FoldedDCD)
+    assert [list(item) for item in SegDCD.parse(folded[0].data)[0]] == [[0x30340004, 1], [0x30340008, 2]]
+    # without DCD address the commands are kept
+    assert fold_wregs(cmds[:2]) == tuple(cmds[:2])
+
+
+def folded_plan():
+    return BootPlan('Boot', '', 'MX7SD', fold_wregs([wreg(0x30340004, 1), wreg(0x30340008, 2),
+                                                     wimg(0x80800000, b'\1' * 16)], 0x910000))
+
+
+def test_fold_fallback(target):
+    # the ROM rejects the DCD with register outside of allow-list by error status, the writes are sent one by one
+    target.fail('write_dcd', SdpCommandError('HAB: invalid address'))
+    BootEngine(target, folded_plan()).run()
+    assert target.log[:2] == [('write', 0x30340004, 1), ('write', 0x30340008, 2)]
+
+
+def test_fold_no_fallback(target):
+    # after other errors the ROM could already execute a part of the DCD, the writes are not repeated
+    target.fail('write_dcd', IOError('USB disconnected'))
+    with pytest.raises(IOError):
+        BootEngine(target, folded_plan()).run()
+    assert target.log == []
+    # the error of fallback is chained with the rejected DCD
+    target.fail('write_dcd', SdpCommandError('HAB: invalid address'))
+    target.fail('write', IOError('USB disconnected'))
+    with pytest.raises(IOError) as info:
+        BootEngine(target, folded_plan()).run()
+    assert isinstance(info.value.__cause__, SdpCommandError)
@@ -0,0 +1,83 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import pytest
+from conftest import write_smx
+from core.smxfile import SmxFile
+from core.engine import BootEngine
+from core.segments import registry
+from core.segments.base import DatSegBase
+from core.segments.raw import DatSegRAW
+from core.segments.registry import RegistryError, get_segment_class, register_segment, segment_types
+
+PLUGIN = """from core.segments.base import DatSegBase
+
+
+class DatSegBLOB(DatSegBase):
+
+    MARK = '{mark}'
+
+    def __init__(self, name, smx_data=None):
+        super().__init__(name)
+        if smx_data is not None:
+            self.init(smx_data)
+
+    def init(self, smx_data):
+        self.address = smx_data['ADDR']
+        self._text = smx_data['DATA']
+
+    def load(self, db, root_path):
+        self.data = self._text.encode()
+"""
+
+
+class DatSegTEST(DatSegBase):
+
+    MARK = 'test'
+
+
+@pytest.fixture
+def plugins(tmp_path, monkeypatch):
+    """ Clean registry with plugin directory """
+    monkeypatch.setattr(registry, '_registry', dict(registry._builtin))
+    monkeypatch.setattr(registry, '_discovered', False)
+    monkeypatch.setenv(registry.SEGMENTS_PLUGIN_PATH_ENV, str(tmp_path / 'plugins'))
+    (tmp_path / 'plugins').mkdir()
+    return tmp_path / 'plugins'
+
+
+def test_builtin(plugins):
+    assert get_segment_class('RAW') is DatSegRAW
+    with pytest.raises(RegistryError, match='xyz'):
+        get_segment_class('xyz')
+
+
+def test_register(plugins):
+    register_segment('test', DatSegTEST)
+    assert get_segment_class('Test') is DatSegTEST
+    register_segment('raw2', 'core.segments.raw:DatSegRAW')
+    # the class MARK must match the type
+    with pytest.raises(RegistryError, match="MARK = 'raw2'"):
+        get_segment_class('raw2')
+
+
+def test_plugin_dir(plugins, tmp_path, smx_loader, target):
+    (plugins / 'blob.py').write_text(PLUGIN.format(mark='blob'))
+    # the built-in types have priority
+    (plugins / 'raw.py').write_text(PLUGIN.format(mark='raw'))
+    assert 'blob' in segment_types()
+    assert get_segment_class('raw') is DatSegRAW
+
+    smx = SmxFile(write_smx(tmp_path, "    fw.blob:\n      ADDR: 0x80800000\n      DATA: firmware\n",
+                            'wimg fw.blob\njrun fw.blob'))
+    BootEngine(target, smx.get_plan(0)).run()
+    assert target.image(0x80800000, 8) == b'firmware'
+
+
+def test_plugin_mark(plugins):
+    (plugins / 'blob.py').write_text(PLUGIN.format(mark='other'))
+    with pytest.raises(RegistryError, match="MARK = 'blob'"):
+        get_segment_class('blob')
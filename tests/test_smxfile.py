@@ -0,0 +1,88 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+import os
+import hashlib
+import pytest
+from conftest import write_smx
+from core.smxfile import SmxFile, DeferredData
+from core.engine import BootEngine
+from core.checkpoint import plan_id
+from core.segments.digest import DigestError
+from core.segments.raw import DatSegRAW, InitErrorRAW
+
+IMAGE = os.urandom(300000)
+
+
+def pinned_smx(directory, image=IMAGE):
+    with open(os.path.join(str(directory), 'image.bin'), 'wb') as f:
+        f.write(image)
+    data = ("    image.raw:\n      ADDR: 0x80800000\n      FILE: image.bin\n      SHA256: '{}'\n"
+            "    ubi.ubi:\n      FILE: image.bin\n      SHA256: '{}'\n"
+            "    boot.imx2:\n      DATA:\n        STADDR: 0x877FF000\n        APPSEG: ubi.ubi\n").format(
+        hashlib.sha256(IMAGE).hexdigest(), hashlib.sha256(IMAGE).hexdigest())
+    return write_smx(directory, data, 'wimg boot.imx2\nwimg image.raw\njrun boot.imx2')
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_tampered_file(tmp_path, smx_loader, target, lazy):
+    smx = SmxFile(pinned_smx(tmp_path), lazy_load=lazy)
+    # the file is changed after release
+    with open(str(tmp_path / 'image.bin'), 'r+b') as f:
+        f.write(bytes([IMAGE[0] ^ 1]))
+    for _ in range(2):
+        with pytest.raises(DigestError):
+            BootEngine(target, smx.get_plan(0)).run()
+    # neither the tampered file nor the image built from it reach the target
+    assert all(item[2] < 1000 for item in target.log if item[0] == 'write_file')
+    assert not any(item.loaded for item in smx._data if item.name in ('image', 'ubi', 'boot'))
+
+
+def test_verified_file(tmp_path, smx_loader, target):
+    smx = SmxFile(pinned_smx(tmp_path))
+    BootEngine(target, smx.get_plan(0)).run()
+    assert target.image(0x80800000, len(IMAGE)) == IMAGE
+
+
+def test_sha256_value():
+    item = DatSegRAW('image', {'FILE': 'image.bin', 'SHA256': 'AB' * 32})
+    assert item.sha256 == 'ab' * 32
+    with pytest.raises(InitErrorRAW, match='quoted'):
+        DatSegRAW('image', {'FILE': 'image.bin', 'SHA256': int('1' * 64)})
+    with pytest.raises(InitErrorRAW, match='64 chars'):
+        DatSegRAW('image', {'FILE': 'image.bin', 'SHA256': 'ab'})
+
+
+def test_plan_key(tmp_path, smx_loader):
+    smx = SmxFile(pinned_smx(tmp_path), lazy_load=True)
+    plan = smx.get_plan(0)
+    key = plan_id(plan)
+    # the plan is identified without loading of deferred data segments
+    assert not smx._data[0].loaded
+    assert plan_id(smx.get_plan(0)) == key
+    # the changed file of data segment changes the plan identity
+    path = str(tmp_path / 'image.bin')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert plan_id(smx.get_plan(0)) != key
+
+
+def test_warm_up_budget(tmp_path, smx_loader, target):
+    images = {name: os.urandom(300000) for name in ('a', 'b')}
+    data = ""
+    for name, image in images.items():
+        with open(os.path.join(str(tmp_path), name + '.bin'), 'wb') as f:
+            f.write(image)
+        data += ("    {0}.ubi:\n      FILE: {0}.bin\n    {0}.imx2:\n      DATA:\n        STADDR: 0x{1:08X}\n"
+                 "        APPSEG: {0}.ubi\n").format(name, 0x80000000 if name == 'a' else 0x88000000)
+    smx = SmxFile(write_smx(tmp_path, data, 'wimg a.imx2\nwimg b.imx2\njrun b.imx2'), mem_budget=400000)
+    smx.warm_up()
+    # the memoized plan holds only the image which fits into budget, the other one is loaded during boot
+    plan = smx.get_plan(0)
+    assert smx._store.size <= 400000
+    assert isinstance(plan[0].data, DeferredData)
+    BootEngine(target, plan).run()
+    assert [item[2] for item in target.log if item[0] == 'write_file'] == [len(plan[1].data)] * 2
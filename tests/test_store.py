@@ -0,0 +1,60 @@
+# Copyright (c) 2017-2019 Martin Olejar
+#
+# SPDX-License-Identifier: BSD-3-Clause
+# The BSD-3-Clause license for this file can be found in the LICENSE file included with this distribution
+# or at https://spdx.org/licenses/BSD-3-Clause.html#licenseText
+
+from core.store import SegmentStore
+from core.segments.base import SgBuffer
+from core.segments.raw import DatSegRAW
+
+
+def segment(store, name, data):
+    item = DatSegRAW(name, {'FILE': name + '.bin'})
+    item.store = store
+    item.data = data
+    return item
+
+
+def test_budget():
+    store = SegmentStore(1000)
+    a, b = segment(store, 'a', bytes(400)), segment(store, 'b', bytes(400))
+    # the least recently used one is evicted
+    a.data
+    c = segment(store, 'c', bytes(400))
+    assert a.loaded and not b.loaded and c.loaded
+    assert b.evicted and store.size == 800
+
+
+def test_pin():
+    store = SegmentStore(1000)
+    a = segment(store, 'a', bytes(600))
+    store.pin([a])
+    b = segment(store, 'b', bytes(600))
+    # the pinned data would not be freed, so the budget is exceeded
+    assert a.loaded and b.loaded
+    store.unpin([a])
+    assert not a.loaded and b.loaded
+    assert store.size == 600
+
+
+def test_shared_buffers():
+    store = SegmentStore(1000)
+    a = segment(store, 'a', bytes(600))
+    # zero-copy composition: the image references the buffer of its input
+    b = segment(store, 'b', SgBuffer(bytes(10), memoryview(a.data)[100:]))
+    assert store.size == 610
+    c = segment(store, 'c', bytes(400))
+    # the eviction of input would free nothing, the image holds its buffer
+    assert a.loaded and not b.loaded and c.loaded
+    assert store.size == 1000
+
+
+def test_shared_pinned():
+    store = SegmentStore(1000)
+    a = segment(store, 'a', bytes(600))
+    b = segment(store, 'b', SgBuffer(memoryview(a.data)[100:]))
+    store.pin([b])
+    segment(store, 'c', bytes(500))
+    # the buffer of pinned image is not freed by eviction of its input
+    assert a.loaded and b.loaded